@@ -4,15 +4,39 @@
 # Full licence terms located in LICENCE file
 
 import os
-from shutil import copy
-from tempfile import NamedTemporaryFile
+import sys
+from os import path
+from time import time
+from sqlite3 import DatabaseError
 from argparse import ArgumentParser
-from sqlite3 import Error as SQLError
-from urllib import error
-from urllib.error import URLError
 
-from blacklistparser.core import Database, types, Exceptions, Net, Data
-from blacklistparser.core import Logging
+from blacklistparser.core import Database, types, Exceptions, Data
+from blacklistparser.core import Logging, Metrics, Profile, Storage
+
+# the network, parsing and file modules are imported by the actions that
+# use them so short commands like address --add start quickly
+
+SUBCOMMANDS = ('source', 'address', 'update', 'output', 'stats', 'sync',
+    'shard', 'backup', 'serve')
+# options of the parent parser that take a value
+VALUE_OPTIONS = frozenset(('-l', '--loglevel', '--logpath', '--prometheus',
+    '--profile', '--profile-output', '--profile-top', '--engine'))
+
+def find_subcommand(argv):
+    '''
+    return the subcommand named in argv or None if there isn't one
+    '''
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in VALUE_OPTIONS:
+            skip = True
+        elif arg in SUBCOMMANDS:
+            return arg
+        elif not arg.startswith('-'):
+            return None
+    return None
 
 class App:
     def __init__(self):
@@ -26,15 +50,39 @@ class App:
             self.args.syslog,
             self.args.logpath,
             self.args.loglevel)
+        self.metrics = Metrics.Recorder(
+            self.logger.log,
+            self.args.metrics or self.args.prometheus is not None)
         try:
-            self.logger.log.debug('Initalizing database')
-            self.db = Database.Manager(self.args.database)
+            self.db = None
+            # serve only reads output files
+            if getattr(self.args, 'database', None) is not None:
+                self.logger.log.debug('Initalizing database')
+                self.db = Storage.open_backend(self.args.engine,
+                    self.args.database)
             self.parser_action = {
                 'source': self.action_source,
                 'address': self.action_address,
                 'update': self.action_update,
-                'output': self.action_output }
-            self.parser_action[self.args.subparser_name]()
+                'output': self.action_output,
+                'stats': self.action_stats,
+                'sync': self.action_sync,
+                'shard': self.action_shard,
+                'backup': self.action_backup,
+                'serve': self.action_serve }
+            action = self.parser_action[self.args.subparser_name]
+            try:
+                if self.args.profile is not None:
+                    Profile.Profiler(
+                        self.args.profile,
+                        self.logger.log,
+                        self.args.profile_output,
+                        self.args.profile_top,
+                        all_threads=self.args.profile_all_threads).run(action)
+                else:
+                    action()
+            finally:
+                self._report_metrics()
         except Exceptions.UnsuccessfulExit as error:
             s = str(error)
             if s != '': # don't log blank messages
@@ -62,6 +110,19 @@ class App:
         self.address_parser = self.subparser.add_parser('address')
         self.update_parser = self.subparser.add_parser('update')
         self.output_parser = self.subparser.add_parser('output')
+        self.stats_parser = self.subparser.add_parser('stats')
+        self.sync_parser = self.subparser.add_parser('sync')
+        self.shard_parser = self.subparser.add_parser('shard')
+        self.backup_parser = self.subparser.add_parser('backup')
+        self.serve_parser = self.subparser.add_parser('serve')
+
+        self.parent_parser.add_argument(
+            '--engine',
+            help=('storage engine, memory keeps everything in this process '
+                + 'and ignores --database (default sqlite)'),
+            choices=list(Storage.BACKENDS.keys()),
+            default='sqlite',
+            action='store')
 
         # add option to control logging output level
         self.logging = self.parent_parser.add_argument_group()
@@ -100,7 +161,72 @@ class App:
             help='use user syslog facility for logging',
             action='store_true',
             default=True)
+        self.logging.add_argument(
+            '--metrics',
+            help='log time, rows and bytes for each stage and source',
+            action='store_true')
+        self.logging.add_argument(
+            '--prometheus',
+            help=('write stage metrics to this file for the prometheus '
+                + 'node_exporter textfile collector'),
+            type=types.base_path_type,
+            action='store')
+
+        # profile any subcommand
+        self.profiling = self.parent_parser.add_argument_group()
+        self.profiling.add_argument(
+            '--profile',
+            help=('profile the subcommand with cProfile or by sampling '
+                + 'stacks and log the hottest functions'),
+            choices=Profile.MODES,
+            action='store')
+        self.profiling.add_argument(
+            '--profile-output',
+            help=('write the profile to this file, pstats for cprofile or '
+                + 'collapsed stacks for sample'),
+            type=types.base_path_type,
+            action='store')
+        self.profiling.add_argument(
+            '--profile-top',
+            help='number of hot functions to log (default 20)',
+            type=int,
+            default=20,
+            action='store')
+        self.profiling.add_argument(
+            '--profile-all-threads',
+            help=('sample every busy thread, not just the one running the '
+                + 'subcommand'),
+            action='store_true')
+
+        # only the subcommand being run gets its arguments built, all of
+        # them are built when it can't be found so argparse can report
+        selected = find_subcommand(sys.argv[1:])
+        for name, build_args in (
+                ('source', self._source_args),
+                ('address', self._address_args),
+                ('update', self._update_args),
+                ('output', self._output_args),
+                ('stats', self._stats_args),
+                ('sync', self._sync_args),
+                ('shard', self._shard_args),
+                ('backup', self._backup_args),
+                ('serve', self._serve_args)):
+            if selected is None or selected == name:
+                build_args()
+
+        self.args = self.parent_parser.parse_args()
 
+        if self.args.subparser_name is None:
+            no_action_msg = ('An action must be specified. eg. '
+                + 'blacklistparser --database /tmp/test.db source'
+                + '--add https://example.com --frequency 3600 '
+                + '--format \'ipset\'')
+            raise self.parent_parser.error(no_action_msg)
+        if self.args.subparser_name == 'source':
+            self.base_type = Data.BASE_TYPE[self.args.format]
+        return self.args
+
+    def _source_args(self):
         '''
         source subparser
         '''
@@ -144,6 +270,13 @@ class App:
             choices=list(Data.VALIDATOR.keys()),
             required=True
             )
+        self.source_parser.add_argument(
+            '-c',
+            '--column',
+            help='column holding the address in csv/tsv sources',
+            action='store',
+            type=int
+            )
         self.source_parser.add_argument(
             '-g',
             '--group',
@@ -152,6 +285,7 @@ class App:
             type=str
             )
 
+    def _address_args(self):
         '''
         address subparser
         '''
@@ -200,10 +334,11 @@ class App:
             help='Add or Remove an address from the whitelist table',
             action='store_true'
             )
+
+    def _output_args(self):
         '''
         output subparser
         '''
-        self.output_parser = self.subparser.add_parser('output')
         self.output_parser.set_defaults(func=self.action_output)
         self.output_parser.add_argument(
             '-d',
@@ -216,33 +351,77 @@ class App:
         self.output_parser.add_argument(
             '-f',
             '--format',
-            help='input/output format',
-            choices=list(Data.FORMAT.keys()),
-            action='store',
-            required=True,
+            help=('output format, may be repeated with one --output for '
+                + 'each --format to write several files in one pass'),
+            choices=list(Data.OUTPUT_TYPES.keys()),
+            action='append',
             )
         self.output_parser.add_argument(
             '-o',
             '--output',
             help='write to a file specified by this argument',
             type=types.base_path_type,
+            action='append',
+            )
+        self.output_parser.add_argument(
+            '-c',
+            '--config',
+            help=('write every output section of this INI or TOML config '
+                + 'instead of --format/--output'),
             action='store',
-            required=True,
             )
         expiry_help = ('Specify an expiry in seconds. Blacklist entries older '
-                + 'than this argument will not be included.')
+                + 'than this argument will not be included, with --config '
+                + 'it replaces the expiry of every output.')
         self.output_parser.add_argument(
             '-e',
             '--expiry',
             help=expiry_help,
             type=int,
             action='store',
-            required=True
             )
+        self.output_parser.add_argument(
+            '--fp-rate',
+            help=('false positive rate of bloom filter outputs '
+                + '(default 0.001)'),
+            type=float,
+            action='store'
+            )
+        self.output_parser.add_argument(
+            '-z',
+            '--compress',
+            help=('also write OUTPUT.gz or OUTPUT.zst (needs zstandard) in '
+                + 'the same pass, may be repeated, with --config it replaces '
+                + 'the compress setting of every output'),
+            choices=list(Data.COMPRESSORS.keys()),
+            action='append',
+            )
+        self.output_parser.add_argument(
+            '--compress-level',
+            help=('compression level, 1-9 for gz (default 6) and 1-22 '
+                + 'for zst (default 3)'),
+            type=int,
+            action='store',
+            )
+        self.output_parser.add_argument(
+            '--no-plain',
+            help='only write the compressed files of --compress',
+            action='store_true',
+            )
+        group_help = ('Only output entries from sources in this group, may be '
+                + 'repeated to write several groups in one pass in which '
+                + 'case --output must contain {group}')
+        self.output_parser.add_argument(
+            '-g',
+            '--group',
+            help=group_help,
+            action='append'
+            )
+
+    def _update_args(self):
         '''
         update subparser
         '''
-        self.update_parser = self.subparser.add_parser('update')
         self.update_parser.set_defaults(func=self.action_update)
         self.update_parser.add_argument(
             '-d',
@@ -252,26 +431,222 @@ class App:
             action='store',
             required=True
             )
+        self.update_parser.add_argument(
+            '--min-factor',
+            help=('shortest polling interval as a fraction of the source '
+                + 'interval, changing feeds are polled more often down to '
+                + 'this (default 0.25)'),
+            type=float,
+            action='store'
+            )
+        self.update_parser.add_argument(
+            '--max-factor',
+            help=('longest polling interval as a multiple of the source '
+                + 'interval, unchanging feeds are polled less often up to '
+                + 'this (default 8, use 1 with --min-factor 1 for fixed '
+                + 'intervals)'),
+            type=float,
+            action='store'
+            )
+        self.update_parser.add_argument(
+            '--jitter',
+            help=('random fraction of the interval added or taken from '
+                + 'each poll time (default 0.1)'),
+            type=float,
+            action='store'
+            )
+        self.update_parser.add_argument(
+            '--queue-size',
+            help=('chunks waiting for the database writer before parsing '
+                + 'pauses (default 8)'),
+            type=int,
+            action='store'
+            )
+        self.update_parser.add_argument(
+            '--chunk-rows',
+            help=('names per transaction, large feeds are committed in '
+                + 'chunks of this size and small ones grouped up to it '
+                + '(default '
+                + str(Database.CHUNK_ROWS) + ')'),
+            type=int,
+            default=Database.CHUNK_ROWS,
+            action='store'
+            )
 
-        self.args = self.parent_parser.parse_args()
+    def _stats_args(self):
+        '''
+        stats subparser
+        '''
+        self.stats_parser.set_defaults(func=self.action_stats)
+        self.stats_parser.add_argument(
+            '-d',
+            '--database',
+            help='file path of database',
+            type=types.base_path_type,
+            action='store',
+            required=True
+            )
 
-        if self.args.subparser_name is None:
-            no_action_msg = ('An action must be specified. eg. '
-                + 'blacklistparser --database /tmp/test.db source'
-                + '--add https://example.com --frequency 3600 '
-                + '--format \'ipset\'')
-            raise self.parent_parser.error(no_action_msg)
-        if self.args.subparser_name == 'output':
-            self.base_type = Data.BASE_TYPE[self.args.format]
-        if self.args.subparser_name == 'source':
-            self.base_type = Data.BASE_TYPE[self.args.format]
-        return self.args
+    def _sync_args(self):
+        '''
+        sync subparser
+        '''
+        self.sync_parser.set_defaults(func=self.action_sync)
+        self.sync_parser.add_argument(
+            '-d',
+            '--database',
+            help='file path of database',
+            type=types.base_path_type,
+            action='store',
+            required=True
+            )
+        self.sync_parser.add_argument(
+            '-c',
+            '--config',
+            help='INI or TOML config listing sources, exceptions and outputs',
+            action='store',
+            required=True
+            )
+        self.sync_parser.add_argument(
+            '-k',
+            '--keep',
+            help='keep sources and exceptions that are not in the config',
+            action='store_true'
+            )
+        self.sync_parser.add_argument(
+            '-n',
+            '--dry-run',
+            help='log the changes without writing them',
+            action='store_true'
+            )
+
+    def _shard_args(self):
+        '''
+        shard subparser
+        '''
+        self.shard_parser.set_defaults(func=self.action_shard)
+        self.shard_parser.add_argument(
+            '-d',
+            '--database',
+            help='file path of database',
+            type=types.base_path_type,
+            action='store',
+            required=True
+            )
+        self.shard_parser.add_argument(
+            '-b',
+            '--by',
+            help=('split data into one file per data format or into '
+                + '--count files by a hash of the name'),
+            choices=Database.SHARD_SCHEMES,
+            action='store',
+            required=True
+            )
+        self.shard_parser.add_argument(
+            '-n',
+            '--count',
+            help='number of hash shards (2 to '
+                + str(Database.MAX_SHARDS) + ')',
+            type=int,
+            action='store'
+            )
+
+    def _backup_args(self):
+        '''
+        backup subparser
+        '''
+        self.backup_parser.set_defaults(func=self.action_backup)
+        self.backup_parser.add_argument(
+            '-d',
+            '--database',
+            help='file path of database',
+            type=types.base_path_type,
+            action='store',
+            required=True
+            )
+        self.backup_parser.add_argument(
+            '-o',
+            '--output',
+            help='file path of the backup, shard copies go next to it',
+            type=types.base_path_type,
+            action='store',
+            required=True
+            )
+        self.backup_parser.add_argument(
+            '--pages',
+            help='pages copied per step (default 256)',
+            type=int,
+            default=256,
+            action='store'
+            )
+        self.backup_parser.add_argument(
+            '--pause',
+            help='seconds between steps so writers can commit (default 0.05)',
+            type=float,
+            default=0.05,
+            action='store'
+            )
+        self.backup_parser.add_argument(
+            '--vacuum',
+            help='vacuum the copy, the live database is left alone',
+            action='store_true'
+            )
+        self.backup_parser.add_argument(
+            '-z',
+            '--compress',
+            help='gzip the copy',
+            action='store_true'
+            )
+        self.backup_parser.add_argument(
+            '--level',
+            help='gzip compression level 1-9 (default 6)',
+            type=int,
+            default=6,
+            choices=range(1, 10),
+            metavar='LEVEL',
+            action='store'
+            )
+
+    def _serve_args(self):
+        '''
+        serve subparser
+        '''
+        self.serve_parser.set_defaults(func=self.action_serve)
+        self.serve_parser.add_argument(
+            '-r',
+            '--root',
+            help='directory of the files written by output',
+            action='store',
+            required=True
+            )
+        self.serve_parser.add_argument(
+            '-b',
+            '--bind',
+            help='address to listen on (default 127.0.0.1)',
+            default='127.0.0.1',
+            action='store'
+            )
+        self.serve_parser.add_argument(
+            '-p',
+            '--port',
+            help='port to listen on (default 8080)',
+            type=int,
+            default=8080,
+            action='store'
+            )
+
+    def _report_metrics(self):
+        self.metrics.emit()
+        if self.args.prometheus is not None:
+            try:
+                self.metrics.write_prometheus(self.args.prometheus)
+            except OSError as err:
+                self.logger.log.error('Failed to write metrics: ' + str(err))
     def _action_group(self):
         glogmsg = ('attempting to add source url: ' + self.args.add +
             ' to group ' + self.args.group)
         self.logger.log.debug(glogmsg)
-        Database.Manager.change_group(
-            self.db,
+        self.db.change_group(
             self.args.group,
             self.args.add)
         self.logger.log.info('Changed group OK')
@@ -281,36 +656,40 @@ class App:
             # attempt to add a url
             logmsg = ('attempting to add source url: ' + self.args.add)
             self.logger.log.debug(logmsg)
+            # the column is stored as part of the page format eg. csv:2
+            page_format = self.args.format
+            if self.args.column is not None:
+                from blacklistparser.core import Parser
+                page_format += ':' + str(self.args.column)
+                try:
+                    Parser.split_format(page_format)
+                except Exceptions.IncorrectDataType as err:
+                    raise self.source_parser.error(str(err))
             try:
-                Database.Manager.test_source_url(
-                self.db,
-                self.args.add)
+                self.db.test_source_url(self.args.add)
                 self.logger.log.info('source url already present in database')
                 if self.args.group:
                     self._action_group()
-                    self.db.db_conn.commit()
+                    self.db.commit()
                 # success
                 return
             except Exceptions.NoMatchesFound:
                 # excpected when adding a new url
                 pass
 
-            Database.Manager.add_source_url(
-                self.db,
+            self.db.add_source_url(
                 self.args.add,
-                self.args.format,
+                page_format,
                 self.args.interval)
             # commit
-            self.db.db_conn.commit()
+            self.db.commit()
             # check url is added
             try:
-                Database.Manager.test_source_url(
-                    self.db,
-                    self.args.add)
+                self.db.test_source_url(self.args.add)
                 self.logger.log.info('source added to database OK')
                 if self.args.group:
                     self._action_group()
-                    self.db.db_conn.commit()
+                    self.db.commit()
                 # success
                 return
             except Exceptions.NoMatchesFound as error:
@@ -329,7 +708,7 @@ class App:
                 return
             # attempt to remove url
             self.db.delete_source_url(self.args.remove)
-            self.db.db_conn.commit()
+            self.db.commit()
             # check removal is ok
             try:
                 self.db.test_source_url(self.args.remove)
@@ -347,83 +726,321 @@ class App:
         if self.args.whitelist and self.args.source:
             errmsg = '--whitelist and --source are exclusive'
             raise self.source_parser.error(errmsg)
+        from blacklistparser.core import Canonical
+        canonical = Canonical.Canonicalizer(self.args.type)
         if self.args.add is not None:
             self.db.add_element(
-                    self.args.add,
+                    canonical(self.args.add.strip()),
                     self.args.type,
                     self.args.source,
                     self.args.whitelist)
-            self.db.db_conn.commit()
+            self.db.commit()
         elif self.args.remove is not None:
             self.db.remove_element(
-                self.args.remove,
+                canonical(self.args.remove.strip()),
                 self.args.source,
                 self.args.whitelist)
-            self.db.db_conn.commit()
+            self.db.commit()
         else:
             sperr = 'either --add or --remove must be specified'
             raise self.source_parser.error(sperr)
 
     def action_output(self):
         '''
-        Validate everything from the db then format and finally write output
+        Read the db once and write every requested output as rows arrive,
+        each row is validated once whichever files it goes to
         '''
         self.logger.log.info('Started output module')
-        err = 0 # invalid lines
-        valid = 0 # valid lines
-        results = self.db.pull_names_2(self.args.expiry, self.base_type)
-        if not results:
-            raise Exceptions.DatabaseError('No results from db found')
-
-        pending = []
-        for result in results:
-            if Data.VALIDATOR[self.base_type](result[0]):
-                valid += 1
-                pending.append(result[0])
-            else:
-                err += 1
+        targets = self._output_targets()
+        now = time()
+        # (base type, group): [(oldest last_seen, sink)]
+        routes = {}
+        sinks = []
+        try:
+            for target in targets:
+                sink = Data.open_sink(target['path'], target['format'],
+                    target['fp_rate'], target['compress'],
+                    self.args.compress_level, not self.args.no_plain)
+                sinks.append(sink)
+                for base_type in Data.OUTPUT_TYPES[target['format']]:
+                    routes.setdefault((base_type, target['group']), []).append(
+                        (now - target['expiry'], sink))
+            data_formats = sorted({base_type for base_type, _ in routes})
+            groups = sorted({group for _, group in routes if group is not None})
+            # outputs without a group read active, grouped ones read data
+            queries = []
+            if any(group is None for _, group in routes):
+                queries.append(None)
+            if groups:
+                queries.append(groups)
+            expiry = max(target['expiry'] for target in targets)
+
+            err = 0 # invalid lines
+            valid = 0 # valid lines
+            with self.metrics.stage('export') as stage:
+                for query_groups in queries:
+                    rows = self.db.stream_names(expiry, data_formats,
+                        query_groups)
+                    for name, data_format, group, last_seen in rows:
+                        if not Data.VALIDATOR[data_format](name):
+                            err += 1
+                            continue
+                        valid += 1
+                        # membership may come back as an int
+                        if group is not None:
+                            group = str(group)
+                        for oldest, sink in routes.get(
+                                (data_format, group), ()):
+                            if last_seen >= oldest:
+                                sink.write(name, data_format)
+                stage.rows = valid
+        except BaseException:
+            for sink in sinks:
+                sink.abort()
+            raise
         ## LOG errors and valid counts
-        icountmsg = ('Counted ' + str(err) + ' invalid addresses')
         # log how many addresses where dropped
-        self.logger.log.debug(icountmsg)
-        countmsg = ('Counted ' + str(valid) + ' valid addresses')
+        self.logger.log.debug('Counted %d invalid addresses', err)
         # log how many addresses are valid
-        self.logger.log.debug(countmsg)
+        self.logger.log.debug('Counted %d valid addresses', valid)
 
-
-        if len(pending) < 1:
+        written = 0
+        for target, sink in zip(targets, sinks):
+            if not sink.rows:
+                sink.abort()
+                self.logger.log.warning('No addresses for %s', target['path'])
+                continue
+            with self.metrics.stage('write', target['path']) as stage:
+                try:
+                    sink.close()
+                except OSError as error:
+                    sink.abort()
+                    self.logger.log.error('Failed to write %s: %s',
+                        target['path'], error)
+                    continue
+                stage.rows = sink.rows
+                stage.bytes = sink.bytes
+            self._compression_stats(sink)
+            written += 1
+            pathnames = [out.pathname for out in getattr(sink, 'compressed',
+                ())]
+            if not self.args.no_plain:
+                pathnames.insert(0, target['path'])
+            self.logger.log.warning('Wrote to ' + ', '.join(pathnames))
+        if not written:
             self.logger.log.error('No addresses found. Exiting.')
             raise Exceptions.UnsuccessfulExit()
 
-        # format the page
-        output = Data.FORMAT[self.args.format](pending)
-        if not output:
-            self.logger.log.error('Nothing to output, exiting non-zero')
-            raise Exceptions.UnsuccessfulExit()
+    def _compression_stats(self, sink):
+        for out in getattr(sink, 'compressed', ()):
+            ratio = out.bytes / sink.bytes if sink.bytes else 0.0
+            rate = sink.bytes / out.seconds / 1e6 if out.seconds else 0.0
+            self.logger.log.info('Compressed %s %d to %d bytes (%.1f%%) at '
+                '%.1f MB/s', out.pathname, sink.bytes, out.bytes,
+                ratio * 100, rate)
+            self.metrics.add(('compress', out.pathname), out.seconds,
+                sink.rows, out.bytes)
 
-        # gather existing filemode
-        if os.path.exists(self.args.output):
-            stats = os.stat(self.args.output)
+    def _output_targets(self):
+        '''
+        return a dict with path, format, expiry and group for every file
+        the output action writes, from --config or --format/--output pairs
+        '''
+        if self.args.fp_rate is not None and not 0 < self.args.fp_rate < 1:
+            raise self.output_parser.error('--fp-rate must be between 0 and 1')
+        if self.args.config is not None:
+            from blacklistparser.core import Config
+            targets = Config.Config.load(self.args.config).outputs
+            if not targets:
+                raise self.output_parser.error('config has no output sections')
         else:
-            stats = None
-
-        with NamedTemporaryFile(mode='w+', delete=True) as tmp:
-            tmp.write(output)
-            tmp.flush()
-            copy(tmp.name, self.args.output)
-            self.logger.log.warning('Wrote to ' + str(self.args.output))
-        # attempt to set old filemode
-        if stats:
-            try:
-                os.chmod(self.args.output, mode=stats.st_mode)
-            except OSError:
-                err = 'Failed to chmod permissions from original file'
-                self.logger.log.error(err)
-        return 
+            formats = self.args.format or []
+            paths = self.args.output or []
+            if not formats or len(formats) != len(paths):
+                errmsg = ('--format and --output must be given in pairs or '
+                    + '--config used')
+                raise self.output_parser.error(errmsg)
+            if self.args.expiry is None:
+                raise self.output_parser.error('--expiry is required')
+            targets = [{
+                'path' : pathname,
+                'format' : out_format,
+                'expiry' : self.args.expiry,
+                'group' : None,
+                'fp_rate' : None,
+                'compress' : []} for out_format, pathname in zip(formats, paths)]
+        if self.args.no_plain and not self.args.compress:
+            raise self.output_parser.error('--no-plain needs --compress')
+        for target in targets:
+            if self.args.expiry is not None:
+                target['expiry'] = self.args.expiry
+            if self.args.fp_rate is not None:
+                target['fp_rate'] = self.args.fp_rate
+            if self.args.compress:
+                target['compress'] = sorted(set(self.args.compress))
+        groups = self.args.group
+        if groups:
+            if len(groups) > 1 and any('{group}' not in target['path']
+                    for target in targets):
+                errmsg = ('--output must contain {group} when writing '
+                    + 'several groups')
+                raise self.output_parser.error(errmsg)
+            targets = [dict(target, group=str(group),
+                path=target['path'].replace('{group}', str(group)))
+                for target in targets for group in groups]
+        pathnames = [target['path'] for target in targets]
+        if len(set(pathnames)) != len(pathnames):
+            raise self.output_parser.error('each output needs its own file')
+        level = self.args.compress_level
+        if level is not None:
+            for suffix in sorted({suffix for target in targets
+                    for suffix in target['compress']}):
+                levels = Data.COMPRESS_LEVELS[suffix]
+                if level not in levels:
+                    raise self.output_parser.error('--compress-level for '
+                        + suffix + ' must be ' + str(levels[0]) + '-'
+                        + str(levels[-1]))
+        return targets
+
+    def action_stats(self):
+        '''
+        log deduplication and source overlap statistics
+        '''
+        stats = self.db.overlap_stats()
+        self.logger.log.info(str(stats['distinct']) + ' distinct names from '
+            + str(stats['rows']) + ' rows')
+        for source_count, names in stats['histogram']:
+            self.logger.log.info(str(names) + ' names in '
+                + str(source_count) + ' sources')
+        for url, names, unique in stats['sources']:
+            self.logger.log.info(str(url) + ' ' + str(names) + ' names, '
+                + str(unique) + ' unique')
+
+    def action_sync(self):
+        '''
+        apply the sources and exceptions in a config file to the database
+        in a single transaction
+        '''
+        from blacklistparser.core import Config
+        config = Config.Config.load(self.args.config)
+        prune = not self.args.keep
+        try:
+            added, changed, removed = self.db.sync_sources(
+                config.sources, prune)
+            ex_added, ex_removed = self.db.sync_exceptions(
+                config.exceptions, prune)
+        except Exception:
+            self.db.rollback()
+            raise
+        for action, urls in (('add', added), ('change', changed),
+                ('remove', removed)):
+            for url in urls:
+                self.logger.log.debug('%s source %s', action, url)
+        self.logger.log.info('sources: %d added, %d changed, %d removed',
+            len(added), len(changed), len(removed))
+        self.logger.log.info('exceptions: %d added, %d removed',
+            len(ex_added), len(ex_removed))
+        if self.args.dry_run:
+            self.db.rollback()
+            self.logger.log.info('Dry run, nothing written')
+        else:
+            self.db.commit()
+
+    def action_shard(self):
+        '''
+        move the data of the database into shard files next to it
+        '''
+        if self.args.engine != 'sqlite':
+            raise Exceptions.UnsuccessfulExit('shard needs the sqlite engine')
+        try:
+            shards = self.db.create_shards(self.args.by, self.args.count)
+        except Exceptions.DatabaseError as err:
+            raise Exceptions.UnsuccessfulExit(str(err))
+        for shard in shards:
+            self.logger.log.info('Created shard %s', shard['path'])
+
+    def action_backup(self):
+        '''
+        copy the database and its shards while other commands keep using it
+        '''
+        from blacklistparser.core import Backup
+        if self.args.engine != 'sqlite':
+            raise Exceptions.UnsuccessfulExit('backup needs the sqlite engine')
+        if self.args.pages < 1 or self.args.pause < 0:
+            errmsg = '--pages must be at least 1 and --pause at least 0'
+            raise self.backup_parser.error(errmsg)
+        if path.abspath(self.args.output) == path.abspath(self.args.database):
+            raise self.backup_parser.error('--output is the database')
+        try:
+            copies = Backup.backup(
+                self.args.database,
+                self.args.output,
+                self.args.pages,
+                self.args.pause,
+                self.args.vacuum,
+                self.args.compress,
+                self.args.level)
+        except (OSError, DatabaseError) as err:
+            raise Exceptions.UnsuccessfulExit('Backup failed: ' + str(err))
+        for copy in copies:
+            self.metrics.add(('backup', copy['path']), copy['seconds'],
+                copy['pages'], copy['bytes'])
+            self.logger.log.info('Backed up %d pages in %d steps to %s, '
+                '%d bytes in %.3fs', copy['pages'], copy['steps'],
+                copy['path'], copy['bytes'], copy['seconds'])
+
+    def action_serve(self):
+        '''
+        serve the files under --root over http until interrupted
+        '''
+        import signal
+        from blacklistparser.core import Serve
+        if not path.isdir(self.args.root):
+            raise self.serve_parser.error('--root must be a directory')
+        try:
+            server = Serve.Server((self.args.bind, self.args.port),
+                self.args.root, self.logger.log)
+        except OSError as err:
+            raise Exceptions.UnsuccessfulExit('Failed to listen on '
+                + str(self.args.bind) + ':' + str(self.args.port) + ': '
+                + str(err))
+        self.logger.log.info('Serving %s on http://%s:%d/', server.root,
+            *server.server_address[:2])
+
+        def stop(signum, frame):
+            raise KeyboardInterrupt
+        # stop the same way on SIGTERM from a service manager as on ^C
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        counts = server.counts
+        self.metrics.add(('serve', server.root), 0, counts['requests'],
+            counts['bytes'])
+        self.logger.log.info('%d requests, %d ok (%d gzip), %d not modified, '
+            '%d not found, %d bytes sent', counts['requests'], counts['ok'],
+            counts['gzip'], counts['not_modified'], counts['not_found'],
+            counts['bytes'])
 
     def action_update(self):
+        from blacklistparser.core import Schedule, Writer
         self.logger.log.info('Started update module')
-        retr = []
+        if self.args.chunk_rows < 1:
+            raise self.update_parser.error('--chunk-rows must be at least 1')
+        if self.args.queue_size is not None and self.args.queue_size < 1:
+            raise self.update_parser.error('--queue-size must be at least 1')
+        # options left unset keep the Schedule defaults
+        policy = {name : value for name, value in (
+            ('min_factor', self.args.min_factor),
+            ('max_factor', self.args.max_factor),
+            ('jitter', self.args.jitter)) if value is not None}
+        try:
+            self.schedule = Schedule.Policy(**policy)
+        except ValueError as err:
+            raise self.update_parser.error(str(err))
         try:
             # this will contain a tuple of url, last_modified
             # the last_modified header will be None or a Last-Modified header
@@ -431,19 +1048,91 @@ class App:
         except Exceptions.NoMatchesFound:
             self.logger.log.error('No sources ready to update. Exiting.')
             raise Exceptions.UnsuccessfulExit()
-        self.logger.log.debug(str(len(to_be_updated))
-            + ' sources to be updated')
+        self.logger.log.debug('%d sources to be updated', len(to_be_updated))
+
+        # every write goes through the writer thread and its own connection
+        # while this thread fetches and parses the next source
+        self.writer = Writer.Writer(
+            self._writer_backend(self.args.database),
+            self.logger.log,
+            self.args.chunk_rows,
+            self.args.queue_size or Writer.QUEUE_SIZE)
+        # sharded databases get a writer per shard file so the shards are
+        # written in parallel, sources are only marked as updated once
+        # every shard has their names
+        self.shard_writers = {shard['name'] : Writer.Writer(
+                self._writer_backend(shard['path']),
+                self.logger.log,
+                self.args.chunk_rows,
+                self.args.queue_size or Writer.QUEUE_SIZE,
+                'shard ' + shard['name'])
+            for shard in self.db.shards}
+        # (url, last_modified, schedule) of sources written to the shards
+        self.pending = []
+        for writer in [self.writer] + list(self.shard_writers.values()):
+            writer.start()
+        try:
+            try:
+                self._update_sources(to_be_updated)
+            finally:
+                try:
+                    self._finish_shards()
+                finally:
+                    self.writer.close()
+        except Exceptions.DatabaseError as err:
+            raise Exceptions.UnsuccessfulExit('Failed to write the database: '
+                + str(err))
+        finally:
+            for writer in [self.writer] + list(self.shard_writers.values()):
+                writer.report(self.metrics)
+
+    def _writer_backend(self, db_path):
+        '''
+        the open_db of a Writer for the database file db_path, a memory
+        store only exists in this object so the writer shares self.db
+        '''
+        if self.args.engine == 'memory':
+            return lambda: self.db
+        from functools import partial
+        return partial(Storage.open_backend, self.args.engine, db_path)
+
+    def _finish_shards(self):
+        '''
+        wait for the shard writers then mark the sources that every shard
+        wrote as updated, raises Exceptions.DatabaseError if a shard writer
+        stopped
+        '''
+        failed = set()
+        error = None
+        for writer in self.shard_writers.values():
+            try:
+                writer.close()
+            except Exceptions.DatabaseError as err:
+                error = err
+            failed |= writer.failed
+        if error is not None:
+            # the stopped shard may be missing names of any source
+            raise error
+        for url, last_modified, schedule in self.pending:
+            if url not in failed:
+                self.writer.submit(url, 0, _finish_source, url,
+                    last_modified, schedule)
 
+    def _update_sources(self, to_be_updated):
+        from urllib import error
+        from blacklistparser.core import Net, Parser, Schedule
+        retr = []
         # GET THE WEBPAGES
         self.logger.log.debug('Started retrieving webpages')
         for entry in to_be_updated: # get the webpages
-            self.logger.log.debug('URL '
-                + str(entry['url']) + ' last updated '
-                + str(entry['last_modified']))
+            # debug messages in loops are formatted only if they are logged
+            self.logger.log.debug('URL %s last updated %s', entry['url'],
+                entry['last_modified'])
             try:
-                response = Net.get_webpage(
-                    url=entry['url'],
-                    last_modified=entry['last_modified'])
+                with self.metrics.stage('fetch', entry['url']):
+                    response = Net.get_webpage(
+                        url=entry['url'],
+                        last_modified=entry['last_modified'])
                 result = {
                     'web_response' : response,
                     'source_config' : entry,
@@ -451,12 +1140,14 @@ class App:
                 retr.append(result)
             except error.HTTPError as ue:
                 if ue.code == 304:
-                    self.logger.log.debug('Not Modified ' + str(entry['url']))
+                    self.logger.log.debug('Not Modified %s', entry['url'])
+                    self.writer.submit(entry['url'], 0,
+                        'schedule_source',
+                        *self._reschedule(entry, changed=False))
                 else:
-                    self.logger.log.error(str(ue.code)
-                        + ' Error ' + str(entry['url']))
+                    self.logger.log.error('%s Error %s', ue.code, entry['url'])
             except error.URLError as ue:
-                self.logger.log.error('ERROR ' + str(ue))
+                self.logger.log.error('ERROR %s', ue)
 
         if not retr:
             self.logger.log.warning('No webpages to parse. Exiting.')
@@ -464,54 +1155,190 @@ class App:
             
         # Process webpages into data
         self.logger.log.info('Processing webpages')
-        db_modified = True
         for result in retr:
             try:
-                page = result['web_response'].read().decode('utf-8')
-                lines = page.splitlines()
-                
-                self.logger.log.debug(str(len(page)) + ' lines in page.')
-                self.logger.log.debug(str(result['web_response'].info()))
+                # decompress and parse the page as it is read
+                with self.metrics.stage('parse', result['url']) as stage:
+                    page = Metrics.CountingReader(result['web_response'])
+                    classes = {}
+                    lines = list(Parser.extract_stream(
+                        page,
+                        result['source_config']['page_format'],
+                        classes))
+                    stage.rows = len(lines)
+                    stage.bytes = page.bytes
+
+                self.logger.log.debug('%d names in page.', len(lines))
+                self.logger.log.debug('%s', result['web_response'].info())
+                if classes:
+                    self.logger.log.debug('Line classes of %s: %s',
+                        result['url'], ', '.join('%s %d' % item
+                            for item in classes.items() if item[1]))
 
                 # check page actually contains something
                 assert len(lines) > 0
+                if classes:
+                    # mixed pages are (base_type, name)
+                    page_hash = Schedule.content_hash(
+                        name for _, name in lines)
+                else:
+                    page_hash = Schedule.content_hash(lines)
 
-            except URLError:
-                self.logger.log.debug('Webpage failed to decode into utf-8')
-                page = result['web_response'].read()
+            except Exceptions.BadFileType as err:
+                self.logger.log.error('%s %s', err, result['url'])
             except AssertionError:
                 self.logger.log.error('page was empty')
             else: # try and enter data into db and update values only if success
+                if page_hash == result['source_config']['content_hash']:
+                    self.logger.log.debug('Unchanged %s', result['url'])
+                    self._refresh_source(result)
+                    continue
                 # IPList will only put validated data in self.data 
-                processed_data = Data.DataList(
-                    lines,
-                    datatype=result['source_config']['page_format'],
-                    source=result['web_response'].geturl())
-                # Add data to DB
-                try:
-                    processed_data.add_to_db(self.db)
-                    self.logger.log.debug('Added uncommitted content to db')
-                except Exceptions.ExtractorError:
+                with self.metrics.stage('validate', result['url']) as stage:
+                    processed = self._validate(result, lines, bool(classes))
+                    valid = sum(len(data.data) for data in processed)
+                    stage.rows = valid
+                for processed_data in processed:
+                    counts = processed_data.canonical.counts
+                    if counts['changed']:
+                        self.logger.log.debug(
+                            'Canonicalized %d names from %s: %s',
+                            counts['changed'], result['url'], ', '.join(
+                                '%s %d' % item for item in counts.items()
+                                if item[0] != 'changed' and item[1]))
+                        self.metrics.add(('canonical', result['url']), 0,
+                            counts['changed'])
+                if not valid:
                     self.logger.log.error('Failed to add page content to db')
-                    # raise # this causes bugs when page has no valid content
-                # Update Last-Modified into DB
-                else:
-                    try:
-                        wurl = result['web_response'].geturl()
-                        lmod = result['web_response'].info()['Last-Modified']
-                        self.db.update_last_modified(wurl, lmod)
-                        self.logger.log.debug('Last-Modified updated for '
-                            + str(wurl) + ' to ' + str(lmod))
-                        # Update last_updated into sources
-                        self.db.touch_source_url(result['url'])
-                    except SQLError:
-                        self.logger.log.error('Failed to update Last-Modified')
-                        self.logger.log.error('Failed to update source last updated')
-                        self.logger.log.error('Aborting without commit')
-        # COMMIT
-        try:
-            self.db.db_conn.commit()
-            self.logger.log.debug('Commit to sqlite3 db success')
-        except SQLError:
-            self.logger.log.error('Commit to sqlite3 db FAILED')
-            raise
+                    continue
+                self._write_source(result, processed, page_hash)
+
+    def _validate(self, result, lines, mixed=False):
+        '''
+        list of DataLists of a page's names, mixed pages hold
+        (base_type, name) and give a DataList for each base type
+        names are kept under the source's url, not the url it redirected to,
+        so they stay joined to the source and its group
+        '''
+        page_format = result['source_config']['page_format']
+        source = result['url']
+        if not mixed:
+            return [Data.DataList(lines, datatype=page_format, source=source)]
+        typed = {}
+        for base_type, name in lines:
+            typed.setdefault(base_type, []).append(name)
+        return [Data.DataList(names, datatype=base_type, source=source)
+            for base_type, names in sorted(typed.items())]
+
+    def _reschedule(self, entry, changed, content_hash=None,
+            name_count=None):
+        '''
+        return the Manager.schedule_source arguments that set when entry is
+        next polled after a fetch that changed (or didn't)
+        '''
+        interval = self.schedule.next_interval(
+            entry['interval'],
+            entry['timeout'],
+            changed)
+        name_delta = None
+        if name_count is not None and entry['name_count'] is not None:
+            name_delta = name_count - entry['name_count']
+        self.logger.log.debug('Next poll of %s in about %ds, %s',
+            entry['url'], interval, 'changed' if changed else 'unchanged')
+        if name_delta:
+            self.logger.log.debug('%+d names from %s', name_delta,
+                entry['url'])
+        return (entry['url'],
+            interval,
+            self.schedule.next_update(time(), interval),
+            changed,
+            content_hash,
+            name_count,
+            name_delta)
+
+    def _refresh_source(self, result):
+        finish = (result['url'],
+            result['web_response'].info()['Last-Modified'],
+            self._reschedule(result['source_config'], False))
+        if not self.shard_writers:
+            self.writer.submit(result['url'], 0, _refresh_source, *finish)
+            return
+        for writer in self.shard_writers.values():
+            writer.submit(result['url'], 0, 'refresh_source',
+                result['url'])
+        self.pending.append(finish)
+
+    def _write_source(self, result, processed, page_hash=None):
+        '''
+        queue one source's names (a list of DataLists) for the writer a
+        chunk of rows per job, its Last-Modified and last_updated are set
+        with the last chunk so a source that fails part way is fetched again
+        on the next run
+        '''
+        if self.shard_writers:
+            self._write_shards(result, processed, page_hash)
+            return
+        chunk_rows = self.args.chunk_rows
+        chunks = [(data, data.data[start:start + chunk_rows])
+            for data in processed
+            for start in range(0, len(data.data), chunk_rows)]
+        for data, rows in chunks[:-1]:
+            self.writer.submit(result['url'], len(rows),
+                'bulk_add',
+                rows,
+                data.base_type,
+                data.source_url)
+        data, last = chunks[-1]
+        name_count = sum(len(data.data) for data in processed)
+        self.writer.submit(result['url'], len(last), _write_last_chunk,
+            last,
+            data.base_type,
+            result['url'],
+            result['web_response'].info()['Last-Modified'],
+            self._reschedule(result['source_config'], True, page_hash,
+                name_count))
+        self.logger.log.debug('Queued %d names from %s in %d chunks',
+            name_count, result['url'], len(chunks))
+
+    def _write_shards(self, result, processed, page_hash):
+        chunk_rows = self.args.chunk_rows
+        for data in processed:
+            rows = data.data
+            for start in range(0, len(rows), chunk_rows):
+                parts = self.db.partition(rows[start:start + chunk_rows],
+                    data.base_type)
+                for shard, names in parts.items():
+                    self.shard_writers[shard].submit(result['url'],
+                        len(names),
+                        'bulk_add',
+                        names,
+                        data.base_type,
+                        data.source_url)
+        name_count = sum(len(data.data) for data in processed)
+        self.pending.append((result['url'],
+            result['web_response'].info()['Last-Modified'],
+            self._reschedule(result['source_config'], True, page_hash,
+                name_count)))
+        self.logger.log.debug('Queued %d names from %s for %d shards',
+            name_count, result['url'], len(self.shard_writers))
+
+
+# writer jobs, they run in the writer thread with its own db connection
+
+def _write_last_chunk(db, rows, base_type, url, last_modified, schedule):
+    db.bulk_add(rows, base_type, url)
+    _finish_source(db, url, last_modified, schedule)
+
+def _refresh_source(db, url, last_modified, schedule):
+    '''
+    the page has the same names as last time, mark them seen instead of
+    writing them again
+    '''
+    db.refresh_source(url)
+    _finish_source(db, url, last_modified, schedule)
+
+def _finish_source(db, url, last_modified, schedule):
+    db.update_last_modified(url, last_modified)
+    # Update last_updated into sources
+    db.touch_source_url(url)
+    db.schedule_source(*schedule)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+import os
+from os import path
+from time import sleep, perf_counter
+from sqlite3 import connect, OperationalError
+
+from blacklistparser.core import Data
+
+'''
+online backups of a database while update and output keep running, the
+sqlite3 backup API copies PAGES pages a step and only holds a read lock
+during a step, PAUSE seconds between steps give writers a chance to commit.
+A write from another connection restarts the copy so the backup is always
+a consistent snapshot
+
+stats = Backup.backup('/var/lib/bl.db', '/srv/bl.db.gz', vacuum_copy=True,
+    compress=True)
+
+the shard files of a sharded database are copied next to the backup and
+the backup's shards table points at the copies
+'''
+
+# pages copied per step
+PAGES = 256
+# seconds between steps
+PAUSE = 0.05
+# gzip level of compressed backups
+LEVEL = 6
+
+
+def shard_paths(db_path):
+    '''
+    (name, path) of the shard files of the database at db_path
+    '''
+    conn = connect(db_path)
+    try:
+        rows = conn.execute('''SELECT name, path FROM shards''').fetchall()
+    except OperationalError:
+        # databases from before shards
+        rows = []
+    finally:
+        conn.close()
+    base = path.dirname(path.abspath(db_path))
+    return [(name, path.join(base, shard_path)) for name, shard_path in rows]
+
+
+def copy_database(source_path, target_path, pages=PAGES, pause=PAUSE):
+    '''
+    copy the database at source_path to target_path a few pages at a time,
+    returns a dict of pages, steps and seconds
+    '''
+    stats = {'pages' : 0, 'steps' : 0, 'seconds' : 0.0}
+
+    def progress(status, remaining, total):
+        stats['pages'] = total
+        stats['steps'] += 1
+        if remaining:
+            sleep(pause)
+
+    start = perf_counter()
+    source = connect(source_path)
+    target = connect(target_path)
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+        source.close()
+    stats['seconds'] = perf_counter() - start
+    return stats
+
+
+def vacuum(db_path):
+    conn = connect(db_path)
+    try:
+        conn.execute('''VACUUM''')
+    finally:
+        conn.close()
+
+
+def gzip_file(source_path, target_path, level=LEVEL):
+    '''
+    gzip source_path into target_path, returns the bytes written
+    '''
+    import gzip
+    from shutil import copyfileobj
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as raw:
+        with gzip.GzipFile(path.basename(source_path), 'wb', level,
+                raw) as target:
+            copyfileobj(source, target, 1024 * 1024)
+        return raw.tell()
+
+
+def backup(db_path, out_path, pages=PAGES, pause=PAUSE, vacuum_copy=False,
+        compress=False, level=LEVEL):
+    '''
+    back up the database at db_path and its shards to out_path, shard
+    copies are named out_path + '.' + shard name (for out.db.gz they are
+    out.db.<name>.gz so they line up once decompressed)
+    - vacuum_copy vacuums each copy, it doesn't touch the live database
+    - compress writes each copy gzipped
+    copies are made under temporary names and renamed into place once all
+    of them are done, returns a list of dicts of path, pages, steps,
+    seconds and bytes for each file
+    '''
+    shards = shard_paths(db_path)
+    stem, suffix = out_path, ''
+    if compress and out_path.endswith('.gz'):
+        stem, suffix = out_path[:-3], '.gz'
+    files = [(db_path, out_path)] + [(shard_path,
+        stem + '.' + name + suffix) for name, shard_path in shards]
+    done = []
+    temporary = []
+    try:
+        for source_path, target_path in files:
+            tmp_path = _temporary(target_path)
+            temporary.append(tmp_path)
+            stats = copy_database(source_path, tmp_path, pages, pause)
+            if source_path == db_path and shards:
+                _point_at_copies(tmp_path, stem, shards)
+            if vacuum_copy:
+                vacuum(tmp_path)
+            if compress:
+                raw_path = tmp_path
+                tmp_path = _temporary(target_path)
+                temporary.append(tmp_path)
+                stats['bytes'] = gzip_file(raw_path, tmp_path, level)
+                Data.remove_quietly(raw_path)
+            else:
+                stats['bytes'] = path.getsize(tmp_path)
+            stats['path'] = target_path
+            done.append((tmp_path, stats))
+        # nothing is replaced unless every copy worked
+        for tmp_path, stats in done:
+            Data.install(tmp_path, stats['path'])
+    except BaseException:
+        for tmp_path in temporary:
+            Data.remove_quietly(tmp_path)
+        raise
+    return [stats for _, stats in done]
+
+
+def _temporary(target_path):
+    from tempfile import mkstemp
+    fd, tmp_path = mkstemp(dir=path.dirname(path.abspath(target_path)),
+        prefix='.' + path.basename(target_path) + '.')
+    os.close(fd)
+    return tmp_path
+
+
+def _point_at_copies(db_path, stem, shards):
+    # shard paths are relative to the database
+    conn = connect(db_path)
+    try:
+        conn.executemany('''UPDATE shards SET path=? WHERE name=?''',
+            [(path.basename(stem) + '.' + name, name)
+                for name, _ in shards])
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+import mmap
+from math import ceil, log
+from struct import Struct
+from hashlib import blake2b
+
+from blacklistparser.core import Exceptions, Data, IPv4
+
+'''
+bloom filter of the blacklist for services that want a cheap "definitely
+not listed" check before an exact lookup, a miss is always right and a hit
+is wrong at about the false positive rate the filter was built for
+
+keys are domains as lowercase ascii and ip entries as their network
+address with /prefix (no prefix for single addresses) eg. 1.2.3.0/24
+bit i of the filter is byte i >> 3, bit i & 7 and key k sets the bits
+    (h1 + j * h2) mod 2**64 mod bits for j in range(hashes)
+where h1, h2 are the two little endian u64 halves of blake2b(k, 16 bytes)
+with the lowest bit of h2 set
+
+all integers are little endian
+header (HEADER below)
+    magic b'BLBLOOM\\0', version u16, hashes u16, reserved u32,
+    bits u64, entries u64
+bits
+    bits / 8 bytes
+'''
+
+MAGIC = b'BLBLOOM\0'
+VERSION = 1
+HEADER = Struct('<8sHHIQQ')
+DEFAULT_FP_RATE = 0.001
+MASK64 = (1 << 64) - 1
+# keys hashed per numpy batch, bounds the position array to ~10MiB
+NUMPY_BATCH = 1 << 16
+
+
+def size_for(entries, fp_rate=DEFAULT_FP_RATE):
+    '''
+    return (bits, hashes) for a filter holding entries keys at fp_rate,
+    bits is a multiple of 8
+    '''
+    if not 0 < fp_rate < 1:
+        raise ValueError('false positive rate must be between 0 and 1')
+    entries = max(entries, 1)
+    bits = ceil(-entries * log(fp_rate) / log(2) ** 2)
+    bits = max(64, bits + -bits % 8)
+    hashes = max(1, round(bits / entries * log(2)))
+    return bits, hashes
+
+def _halves(key):
+    digest = blake2b(key, digest_size=16).digest()
+    return (int.from_bytes(digest[:8], 'little'),
+        int.from_bytes(digest[8:], 'little') | 1)
+
+def ip_key(name):
+    start, end = IPv4.to_range(name)
+    if start == end:
+        return IPv4.to_text(start).encode('ascii')
+    return (IPv4.to_text(start) + '/'
+        + str(32 - (end - start).bit_length())).encode('ascii')
+
+def domain_key(name):
+    return name.lower().rstrip('.').encode('ascii', 'replace')
+
+
+class Builder:
+    def __init__(self, entries, fp_rate=DEFAULT_FP_RATE):
+        '''
+        an empty filter sized for entries keys at fp_rate
+        '''
+        self.bits, self.hashes = size_for(entries, fp_rate)
+        self.array = bytearray(self.bits // 8)
+        self.entries = 0
+
+    def add(self, key):
+        h1, h2 = _halves(key)
+        for i in range(self.hashes):
+            pos = ((h1 + i * h2) & MASK64) % self.bits
+            self.array[pos >> 3] |= 1 << (pos & 7)
+        self.entries += 1
+
+    def add_many(self, keys, use_numpy=True):
+        '''
+        add a list of keys, with numpy the bit positions are computed and
+        set in batches rather than one key at a time, numpy is only
+        imported here
+        '''
+        numpy = IPv4.load_numpy() if use_numpy else None
+        if numpy is None:
+            for key in keys:
+                self.add(key)
+            return
+        steps = numpy.arange(self.hashes, dtype=numpy.uint64)
+        bits = numpy.frombuffer(self.array, dtype=numpy.uint8).copy()
+        for index in range(0, len(keys), NUMPY_BATCH):
+            batch = keys[index:index + NUMPY_BATCH]
+            digests = b''.join(blake2b(key, digest_size=16).digest()
+                for key in batch)
+            halves = numpy.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+            h1 = halves[:, 0:1]
+            h2 = halves[:, 1:2] | numpy.uint64(1)
+            # uint64 arithmetic wraps at 2**64 like the MASK64 above
+            pos = (h1 + steps * h2) % numpy.uint64(self.bits)
+            numpy.bitwise_or.at(bits, (pos >> numpy.uint64(3)).ravel(),
+                (numpy.uint8(1) << (pos & numpy.uint64(7)).astype(
+                    numpy.uint8)).ravel())
+            self.entries += len(batch)
+        self.array = bytearray(bits.tobytes())
+
+    def write(self, out_file):
+        '''
+        write the filter to the binary file out_file, returns bytes written
+        '''
+        written = out_file.write(HEADER.pack(MAGIC, VERSION, self.hashes, 0,
+            self.bits, self.entries))
+        return written + out_file.write(self.array)
+
+
+class Sink:
+    '''
+    collect keys from the output action and write a filter when closed,
+    same interface as Data.Sink
+    '''
+    def __init__(self, pathname, out_format='bloom', fp_rate=None):
+        self.pathname = pathname
+        self.out_format = out_format
+        self.fp_rate = DEFAULT_FP_RATE if fp_rate is None else fp_rate
+        # check the rate now rather than after the export
+        size_for(1, self.fp_rate)
+        self.keys = set()
+        self.rows = 0
+        self.bytes = 0
+
+    def write(self, name, data_format):
+        if data_format == 'ip':
+            self.keys.add(ip_key(name))
+        else:
+            self.keys.add(domain_key(name))
+        self.rows += 1
+
+    def close(self):
+        from tempfile import NamedTemporaryFile
+        from os import path
+        builder = Builder(len(self.keys), self.fp_rate)
+        builder.add_many(list(self.keys))
+        with NamedTemporaryFile('wb', delete=False,
+                dir=path.dirname(path.abspath(self.pathname)),
+                prefix='.' + path.basename(self.pathname) + '.') as tmp:
+            try:
+                self.bytes = builder.write(tmp)
+            except BaseException:
+                tmp.close()
+                Data.remove_quietly(tmp.name)
+                raise
+        Data.install(tmp.name, self.pathname)
+
+    def abort(self):
+        self.keys = set()
+
+
+class Reader:
+    '''
+    check keys against a filter file through mmap
+    with Bloom.Reader('/var/lib/bl.bloom') as bloom:
+        if not bloom.might_contain_domain('ads.example.com'):
+            # definitely not listed
+    '''
+    def __init__(self, pathname):
+        '''
+        raises Exceptions.BadFileType if the file isn't a filter
+        '''
+        with open(pathname, 'rb') as bloom_file:
+            try:
+                self.buf = mmap.mmap(bloom_file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+            except ValueError:
+                raise Exceptions.BadFileType('bloom filter is empty')
+        try:
+            self._read_header()
+        except Exceptions.BadFileType:
+            self.close()
+            raise
+
+    def _read_header(self):
+        if len(self.buf) < HEADER.size:
+            raise Exceptions.BadFileType('bloom filter is truncated')
+        (magic, version, self.hashes, _, self.bits,
+            self.entries) = HEADER.unpack_from(self.buf)
+        if magic != MAGIC:
+            raise Exceptions.BadFileType('not a blacklistparser bloom filter')
+        if version > VERSION:
+            raise Exceptions.BadFileType('bloom filter version '
+                + str(version) + ' is newer than supported version '
+                + str(VERSION))
+        if (not self.bits or self.bits % 8 or not self.hashes
+                or HEADER.size + self.bits // 8 != len(self.buf)):
+            raise Exceptions.BadFileType('bloom filter is truncated')
+
+    def close(self):
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def might_contain(self, key):
+        '''
+        False if the key bytes were definitely not added
+        '''
+        h1, h2 = _halves(key)
+        for i in range(self.hashes):
+            pos = ((h1 + i * h2) & MASK64) % self.bits
+            if not self.buf[HEADER.size + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def might_contain_domain(self, name, parents=True):
+        '''
+        with parents a.example.com also matches a filter holding example.com
+        '''
+        key = domain_key(name)
+        while True:
+            if self.might_contain(key):
+                return True
+            if not parents or b'.' not in key:
+                return False
+            key = key.partition(b'.')[2]
+
+    def might_contain_ip(self, addr):
+        '''
+        check the address and every block that could hold it, blocks are
+        /1 to /32 as accepted by Data.Validator.ipv4_addr
+        '''
+        starts = IPv4.network_starts(IPv4.to_int(addr))
+        if self.might_contain(IPv4.to_text(starts[0]).encode('ascii')):
+            return True
+        # starts[host] is the network address at prefix 32 - host
+        for host in range(1, 32):
+            if self.might_contain((IPv4.to_text(starts[host]) + '/'
+                    + str(32 - host)).encode('ascii')):
+                return True
+        return False
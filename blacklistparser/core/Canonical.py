@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+import re
+from functools import lru_cache
+
+from blacklistparser.core import IPv4
+
+'''
+canonical spellings of names, applied before validation so a host or
+network written several ways is stored once
+- domains are lowercased, lose trailing dots and IDNs become punycode
+- ipv4 addresses lose leading zeros, CIDR blocks have their host bits
+  cleared and /32 blocks become plain addresses
+names that can't be made canonical are returned as they are for the
+validator to reject
+
+canon = Canonical.Canonicalizer('domain')
+canon('Example.COM.') == 'example.com'
+canon.counts['lowercase'] == 1
+'''
+
+# every counter of Canonicalizer.counts
+COUNTERS = ('changed', 'lowercase', 'trailing_dot', 'idn', 'leading_zeros',
+    'host_bits', 'host_prefix')
+# distinct unicode names whose punycode is kept
+IDN_CACHE_SIZE = 65536
+# an address that is already canonical, most of them are
+_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+CANONICAL_ADDR = re.compile(_OCTET + r'(?:\.' + _OCTET + r'){3}')
+
+
+@lru_cache(maxsize=IDN_CACHE_SIZE)
+def idn_to_ascii(name):
+    '''
+    punycode (xn--) form of a unicode domain, feeds repeat the same IDNs so
+    the conversions are cached, None if name isn't a valid IDN
+    '''
+    try:
+        return name.encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+
+
+class Canonicalizer:
+    '''
+    callable returning the canonical form of a name of base_type ('ip' or
+    'domain') and counting what it changed in counts
+    '''
+    def __init__(self, base_type):
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        if base_type == 'ip':
+            self.canonical = self.ip
+        else:
+            self.canonical = self.domain
+
+    def __call__(self, name):
+        canonical = self.canonical(name)
+        if canonical != name:
+            self.counts['changed'] += 1
+        return canonical
+
+    def domain(self, name):
+        counts = self.counts
+        if name.endswith('.'):
+            name = name.rstrip('.')
+            counts['trailing_dot'] += 1
+        if not name.isascii():
+            punycode = idn_to_ascii(name)
+            if punycode is None:
+                return name
+            counts['idn'] += 1
+            return punycode
+        lowered = name.lower()
+        if lowered != name:
+            counts['lowercase'] += 1
+        return lowered
+
+    def ip(self, name):
+        if CANONICAL_ADDR.fullmatch(name):
+            return name
+        addr, sep, prefix = name.partition('/')
+        octets = addr.split('.')
+        if (len(octets) != 4 or not addr.isascii()
+                or not all(octet.isdigit() and len(octet) <= 3
+                    for octet in octets)):
+            return name
+        values = [int(octet) for octet in octets]
+        if max(values) > 255:
+            return name
+        text = '.'.join(map(str, values))
+        if text != addr:
+            self.counts['leading_zeros'] += 1
+        if not sep:
+            return text
+        if not prefix.isascii() or not prefix.isdigit() or int(prefix) > 32:
+            return name
+        bits = int(prefix)
+        if bits == 32:
+            self.counts['host_prefix'] += 1
+            return text
+        value = IPv4.to_int(text)
+        host = (1 << (32 - bits)) - 1
+        if value & host:
+            self.counts['host_bits'] += 1
+            text = IPv4.to_text(value & ~host & 0xffffffff)
+        return text + '/' + str(bits)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+from os import path
+
+from blacklistparser.core import Exceptions, Data
+
+'''
+declarative config for the sync subcommand, either INI or TOML (by the
+.toml extension, needs python 3.11 tomllib)
+
+INI:
+[blacklistparser]
+version = 1
+
+[source https://example.com/hosts.txt]
+format = hosts
+interval = 3600
+group = ads
+
+[exception example.com]
+type = domain
+
+[output /var/unbound/blacklist.conf]
+format = unbound_nxdomain
+expiry = 86400
+compress = gz
+
+[output /var/lib/blacklist.bloom]
+format = bloom
+expiry = 86400
+fp_rate = 0.001
+
+TOML uses the same keys with arrays of tables:
+version = 1
+[[source]]
+url = "https://example.com/hosts.txt"
+format = "hosts"
+interval = 3600
+[[exception]]
+name = "example.com"
+type = "domain"
+[[output]]
+path = "/var/unbound/blacklist.conf"
+format = "unbound_nxdomain"
+expiry = 86400
+'''
+
+CONFIG_VERSION = 1
+ADDRESS_TYPES = ('ip', 'domain')
+
+
+class Config:
+    def __init__(self, sources=(), exceptions=(), outputs=(),
+            version=CONFIG_VERSION):
+        '''
+        - sources: dicts with url, page_format, timeout and membership
+        - exceptions: (name, data_format) tuples
+        - outputs: dicts with path, format, expiry, group, fp_rate and compress
+        '''
+        self.version = version
+        self.sources = list(sources)
+        self.exceptions = list(exceptions)
+        self.outputs = list(outputs)
+
+    @classmethod
+    def load(cls, pathname):
+        '''
+        read and validate a config file, raises Exceptions.ConfigError
+        '''
+        try:
+            if path.splitext(pathname)[1] == '.toml':
+                tables = _read_toml(pathname)
+            else:
+                tables = _read_ini(pathname)
+        except OSError as err:
+            raise Exceptions.ConfigError('Failed to read config: ' + str(err))
+        return cls.from_tables(tables)
+
+    @classmethod
+    def from_tables(cls, tables):
+        '''
+        build a Config from a dict holding version and lists of source,
+        exception and output tables
+        '''
+        try:
+            version = int(tables.get('version', CONFIG_VERSION))
+        except ValueError:
+            raise Exceptions.ConfigError('config version must be an integer')
+        if version > CONFIG_VERSION:
+            raise Exceptions.ConfigError('config version ' + str(version)
+                + ' is newer than supported version ' + str(CONFIG_VERSION))
+        sources = [_source(table) for table in tables.get('source', ())]
+        urls = [source['url'] for source in sources]
+        if len(set(urls)) != len(urls):
+            raise Exceptions.ConfigError('source urls must be unique')
+        exceptions = [_exception(table) for table in tables.get('exception', ())]
+        outputs = [_output(table) for table in tables.get('output', ())]
+        return cls(sources, exceptions, outputs, version)
+
+
+def _require(table, key, kind):
+    if key not in table:
+        raise Exceptions.ConfigError(kind + ' ' + str(table) + ' missing '
+            + key)
+    return table[key]
+
+def _integer(table, key, kind, default=None):
+    value = table.get(key, default)
+    if value is None:
+        value = _require(table, key, kind)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise Exceptions.ConfigError(kind + ' ' + key + ' must be an integer'
+            + ' not ' + str(value))
+
+def _source(table):
+    url = str(_require(table, 'url', 'source'))
+    page_format = str(_require(table, 'format', 'source'))
+    if page_format not in Data.VALIDATOR:
+        raise Exceptions.ConfigError('source ' + url + ' has unsupported '
+            + 'format ' + page_format)
+    if 'column' in table:
+        from blacklistparser.core import Parser
+        page_format += ':' + str(table['column'])
+        try:
+            Parser.split_format(page_format)
+        except Exceptions.IncorrectDataType as err:
+            raise Exceptions.ConfigError('source ' + url + ' ' + str(err))
+    group = table.get('group')
+    return {
+        'url' : url,
+        'page_format' : page_format,
+        'timeout' : float(_integer(table, 'interval', 'source ' + url)),
+        'membership' : None if group is None else str(group)}
+
+def _exception(table):
+    name = str(_require(table, 'name', 'exception'))
+    data_format = str(table.get('type', 'domain'))
+    if data_format not in ADDRESS_TYPES:
+        raise Exceptions.ConfigError('exception ' + name + ' type must be '
+            + 'one of ' + str(ADDRESS_TYPES))
+    return (name, data_format)
+
+def _output(table):
+    pathname = str(_require(table, 'path', 'output'))
+    out_format = str(_require(table, 'format', 'output'))
+    if out_format not in Data.OUTPUT_TYPES:
+        raise Exceptions.ConfigError('output ' + pathname + ' has '
+            + 'unsupported format ' + out_format)
+    group = table.get('group')
+    fp_rate = table.get('fp_rate')
+    if fp_rate is not None:
+        try:
+            fp_rate = float(fp_rate)
+        except ValueError:
+            fp_rate = None
+        if fp_rate is None or not 0 < fp_rate < 1:
+            raise Exceptions.ConfigError('output ' + pathname + ' fp_rate '
+                + 'must be between 0 and 1')
+    # a list in TOML, space or comma separated in INI
+    compress = table.get('compress', [])
+    if isinstance(compress, str):
+        compress = compress.replace(',', ' ').split()
+    for suffix in compress:
+        if suffix not in Data.COMPRESSORS:
+            raise Exceptions.ConfigError('output ' + pathname + ' compress '
+                + 'must be one of ' + str(tuple(Data.COMPRESSORS)))
+    return {
+        'path' : pathname,
+        'format' : out_format,
+        'expiry' : _integer(table, 'expiry', 'output ' + pathname),
+        'group' : None if group is None else str(group),
+        'fp_rate' : fp_rate,
+        'compress' : sorted(set(compress))}
+
+def _read_ini(pathname):
+    from configparser import ConfigParser, Error
+    parser = ConfigParser(interpolation=None)
+    try:
+        with open(pathname) as config_file:
+            parser.read_file(config_file)
+    except Error as err:
+        raise Exceptions.ConfigError('Failed to parse config: ' + str(err))
+    tables = {'source' : [], 'exception' : [], 'output' : []}
+    for section in parser.sections():
+        kind, _, name = section.partition(' ')
+        if kind == 'blacklistparser':
+            tables['version'] = parser[section].get('version', CONFIG_VERSION)
+            continue
+        # the section name holds the url, name or path
+        key = {'source' : 'url', 'exception' : 'name', 'output' : 'path'}
+        if kind not in key or not name.strip():
+            raise Exceptions.ConfigError('Unknown config section ' + section)
+        table = dict(parser[section])
+        table[key[kind]] = name.strip()
+        tables[kind].append(table)
+    return tables
+
+def _read_toml(pathname):
+    try:
+        from tomllib import load, TOMLDecodeError
+    except ImportError:
+        raise Exceptions.ConfigError('TOML configs need python 3.11 or newer')
+    try:
+        with open(pathname, 'rb') as config_file:
+            return load(config_file)
+    except TOMLDecodeError as err:
+        raise Exceptions.ConfigError('Failed to parse config: ' + str(err))
@@ -1,28 +1,50 @@
 #!/usr/bin/env python3
 # Liam Nolan (c) 2019 ISC
 
-from blacklistparser.core import Exceptions, Database, Regex
+import os
+from os import path
+from time import perf_counter
+
+from blacklistparser.core import Exceptions, Regex, IPv4
 
 
 class DataList:
-    def __init__(self, data, datatype, source=None, raise_errors=False):
+    def __init__(self, data, datatype, source=None, raise_errors=False,
+            canonical=True):
+        '''
+        validate data as datatype, with canonical each name is first made
+        canonical (see Canonical) and self.canonical holds its counts
+        '''
         self.data = []
         self.index = -1 # start index at -1 b/c it is inc before return
         self.source_url = source
+        # drop any column selector eg. csv:2
+        datatype = str(datatype).partition(':')[0]
 
         if datatype not in VALIDATOR.keys():
             errmsg = 'data type ' + str(datatype) + ' not supported'
             raise Exceptions.IncorrectDataType(errmsg)
         self.datatype = datatype
         self.base_type = BASE_TYPE[self.datatype]
+        if self.base_type is None:
+            errmsg = ('data type ' + self.datatype + ' must be split into '
+                + 'domain and ip names first')
+            raise Exceptions.IncorrectDataType(errmsg)
     
         assert len(data) > 0, 'DataList argument data is empty'
 
+        self.canonical = None
+        if canonical:
+            from blacklistparser.core import Canonical
+            self.canonical = Canonical.Canonicalizer(self.base_type)
         for line in data:
             errmsg = ('Not a valid ' + self.datatype + ' address')
+            line = str(line)
+            if self.canonical is not None:
+                line = self.canonical(line)
             try:
-                assert VALIDATOR[self.datatype](str(line)), errmsg
-                self.data.append(str(line))
+                assert VALIDATOR[self.datatype](line), errmsg
+                self.data.append(line)
             except AssertionError:
                 pass
 
@@ -71,9 +93,231 @@ class Format:
         '''
         sep = ''' always_nxdomain\nlocal-zone: '''
         output = sep.join(data)
-        output = 'local-zone: '' + output + '' always_nxdomain'
+        output = 'local-zone: ' + output + ' always_nxdomain'
         return output
 
+class Sink:
+    '''
+    write names one at a time in an output format, the file matches what
+    FORMAT produces for the same list. Lines go to a temporary file next
+    to pathname which close() renames over it so readers never see half a
+    list, the permissions of an existing file are kept
+    compress is a list of COMPRESSORS suffixes, each text chunk is also fed
+    to a compressor writing pathname.<suffix> in the same pass, without
+    plain only the compressed files are written
+    '''
+    BUFFER_ROWS = 4096
+
+    def __init__(self, pathname, out_format, compress=(), level=None,
+            plain=True):
+        if out_format not in LINE_FORMAT:
+            errmsg = 'output format ' + str(out_format) + ' not supported'
+            raise Exceptions.IncorrectDataType(errmsg)
+        if not plain and not compress:
+            raise Exceptions.IncorrectDataType('nothing to write for '
+                + str(pathname))
+        self.pathname = pathname
+        self.out_format = out_format
+        self.template = LINE_FORMAT[out_format]
+        self.rows = 0
+        self.bytes = 0
+        self.buffer = []
+        self.compressed = []
+        self.tmp_path = None
+        self.file = None
+        try:
+            for suffix in compress:
+                self.compressed.append(Compressed(pathname, suffix, level))
+            if plain:
+                self.tmp_path = _temporary(pathname)
+                self.file = open(self.tmp_path, 'wb')
+        except BaseException:
+            self.abort()
+            raise
+
+    def write(self, name, data_format=None):
+        self.buffer.append(self.template % name)
+        self.rows += 1
+        if len(self.buffer) >= self.BUFFER_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        text = '\n'.join(self.buffer)
+        # no trailing newline, the separator goes before all but the first
+        if self.bytes:
+            text = '\n' + text
+        data = text.encode('utf-8')
+        if self.file is not None:
+            self.file.write(data)
+        for out in self.compressed:
+            out.write(data)
+        self.bytes += len(data)
+        self.buffer = []
+
+    def close(self):
+        '''
+        finish the files and move them over pathname and its compressed
+        siblings
+        '''
+        self._flush()
+        if self.file is not None:
+            self.file.close()
+        for out in self.compressed:
+            out.finish()
+        if self.file is not None:
+            install(self.tmp_path, self.pathname)
+        for out in self.compressed:
+            install(out.tmp_path, out.pathname)
+
+    def abort(self):
+        '''
+        throw the temporary files away leaving pathname untouched
+        '''
+        if self.file is not None:
+            self.file.close()
+        if self.tmp_path is not None:
+            remove_quietly(self.tmp_path)
+        for out in self.compressed:
+            out.abort()
+
+class Compressed:
+    '''
+    compressed copy of a sink's output written as the sink writes, to a
+    temporary file the sink renames to pathname.<suffix>. The gzip header
+    has no timestamp so the same list always compresses to the same bytes
+    seconds is the time spent compressing and bytes the size written
+    '''
+    def __init__(self, pathname, suffix, level=None):
+        if suffix not in COMPRESSORS:
+            errmsg = 'compression ' + str(suffix) + ' not supported'
+            raise Exceptions.IncorrectDataType(errmsg)
+        if level is None:
+            level = COMPRESSORS[suffix]
+        self.pathname = pathname + '.' + suffix
+        self.suffix = suffix
+        self.level = level
+        self.bytes = 0
+        self.seconds = 0.0
+        if suffix == 'zst':
+            try:
+                import zstandard
+            except ImportError:
+                raise Exceptions.IncorrectDataType('zst output needs the '
+                    + 'zstandard module')
+        self.tmp_path = _temporary(self.pathname)
+        self.raw = None
+        try:
+            self.raw = open(self.tmp_path, 'wb')
+            if suffix == 'zst':
+                self.file = zstandard.ZstdCompressor(
+                    level=level).stream_writer(self.raw)
+            else:
+                import gzip
+                self.file = gzip.GzipFile(path.basename(pathname), 'wb',
+                    level, self.raw, mtime=0)
+        except BaseException:
+            # the sink only cleans up compressors it was given
+            if self.raw is not None:
+                self.raw.close()
+            remove_quietly(self.tmp_path)
+            raise
+
+    def write(self, data):
+        start = perf_counter()
+        self.file.write(data)
+        self.seconds += perf_counter() - start
+
+    def finish(self):
+        start = perf_counter()
+        self.file.close()
+        self.seconds += perf_counter() - start
+        # zstandard closes raw with the stream, gzip leaves it open
+        self.raw.close()
+        self.bytes = path.getsize(self.tmp_path)
+
+    def abort(self):
+        try:
+            self.file.close()
+        except (OSError, ValueError):
+            pass
+        self.raw.close()
+        remove_quietly(self.tmp_path)
+
+class MergedSink(Sink):
+    '''
+    ipset output with overlapping and touching entries joined and written
+    as the fewest CIDR blocks, the entries are held until close() and rows
+    counts entries until then and blocks written after
+    '''
+    def __init__(self, pathname, out_format='ipset_merged', compress=(),
+            level=None, plain=True):
+        super().__init__(pathname, 'ipset', compress, level, plain)
+        self.out_format = out_format
+        self.addrs = []
+
+    def write(self, name, data_format=None):
+        self.addrs.append(name)
+        self.rows += 1
+
+    def close(self):
+        self.rows = 0
+        for start, end in IPv4.merge_names(self.addrs):
+            for block in IPv4.to_cidrs(start, end):
+                Sink.write(self, block)
+        self.addrs = []
+        super().close()
+
+def install(tmp_path, pathname):
+    '''
+    rename a finished temporary file over pathname keeping the permissions
+    of the file it replaces
+    '''
+    try:
+        stats = os.stat(pathname)
+    except FileNotFoundError:
+        stats = None
+    if stats:
+        os.chmod(tmp_path, stats.st_mode)
+    os.replace(tmp_path, pathname)
+
+def _temporary(pathname):
+    # hidden file in the directory of pathname so it can be renamed over it
+    from tempfile import mkstemp
+    fd, tmp_path = mkstemp(dir=path.dirname(path.abspath(pathname)),
+        prefix='.' + path.basename(pathname) + '.')
+    os.close(fd)
+    return tmp_path
+
+def remove_quietly(pathname):
+    try:
+        os.unlink(pathname)
+    except FileNotFoundError:
+        pass
+
+def open_sink(pathname, out_format, fp_rate=None, compress=(), level=None,
+        plain=True):
+    '''
+    return the sink writing out_format to pathname, the sink takes
+    write(name, data_format) for each of OUTPUT_TYPES[out_format]
+    fp_rate is the false positive rate of bloom filters
+    compress, level and plain are passed to Sink, only the text formats of
+    LINE_FORMAT can be compressed
+    '''
+    if (compress or not plain) and out_format in ('snapshot', 'bloom'):
+        errmsg = 'output format ' + str(out_format) + ' can\'t be compressed'
+        raise Exceptions.IncorrectDataType(errmsg)
+    if out_format == 'snapshot':
+        from blacklistparser.core import Snapshot
+        return Snapshot.Sink(pathname, out_format)
+    if out_format == 'ipset_merged':
+        return MergedSink(pathname, out_format, compress, level, plain)
+    if out_format == 'bloom':
+        from blacklistparser.core import Bloom
+        return Bloom.Sink(pathname, out_format, fp_rate)
+    return Sink(pathname, out_format, compress, level, plain)
+
 class Validator:
     @staticmethod
     def ipv4_addr(addr, printerr=False):
@@ -88,20 +332,55 @@ class Validator:
         if Regex.NEWLINE_DOMAIN.match(name):
             return name
         return None
+    @staticmethod
+    def name(name):
+        return Validator.ipv4_addr(name) or Validator.domain(name)
 
 VALIDATOR = {
     'ipset' : Validator.ipv4_addr,
     'domain' : Validator.domain,
     'ip' : Validator.ipv4_addr,
-    'adblock' : Validator.domain}
+    'adblock' : Validator.domain,
+    'hosts' : Validator.domain,
+    'csv' : Validator.domain,
+    'csv_ip' : Validator.ipv4_addr,
+    'tsv' : Validator.domain,
+    'tsv_ip' : Validator.ipv4_addr,
+    'mixed' : Validator.name}
 BASE_TYPE = {
     'ipset' : 'ip',
     'ip' : 'ip',
     'domain' : 'domain',
     'adblock' : 'domain',
+    'hosts' : 'domain',
+    'csv' : 'domain',
+    'csv_ip' : 'ip',
+    'tsv' : 'domain',
+    'tsv_ip' : 'ip',
+    # split by Parser.MixedParser into domain and ip names
+    'mixed' : None,
     'unbound_nxdomain' : 'domain'}
 FORMAT = {
         'ipset' : Format.newline,
         'unbound_nxdomain' : Format.unbound_nxdomain }
+# one line of each output format, used by Sink
+LINE_FORMAT = {
+        'ipset' : '%s',
+        'unbound_nxdomain' : 'local-zone: %s always_nxdomain' }
+# suffix of compressed outputs: default level, zst needs zstandard
+COMPRESSORS = {
+        'gz' : 6,
+        'zst' : 3 }
+# suffix: levels the compressor takes
+COMPRESS_LEVELS = {
+        'gz' : range(1, 10),
+        'zst' : range(1, 23) }
+# every output format and the base types written to it
+OUTPUT_TYPES = {
+        'ipset' : ('ip',),
+        'ipset_merged' : ('ip',),
+        'unbound_nxdomain' : ('domain',),
+        'snapshot' : ('ip', 'domain'),
+        'bloom' : ('ip', 'domain') }
 
 
@@ -3,16 +3,36 @@
 
 from os import path
 from time import time
+from zlib import crc32
+from heapq import merge
 from struct import unpack
+from contextlib import contextmanager
 from sqlite3 import connect, DatabaseError
 
-from blacklistparser.core import Exceptions
+from blacklistparser.core import Exceptions, IPv4, Storage
 
 # SQLITE3 Application ID
 # from PRAGMA application_id = 1915402268
 APPLICATION_ID = 0x722ab81c
+# PRAGMA user_version, init_db migrates databases with an older version
+SCHEMA_VERSION = 0x7
+# rows written per transaction by update for large feeds
+CHUNK_ROWS = 50000
+# shard files are attached under SHARD_SCHEMA + shard name
+SHARD_SCHEMA = 'shard_'
+# shards split data by data_format or by a hash of the name
+SHARD_SCHEMES = ('format', 'hash')
+FORMAT_SHARDS = ('domain', 'ip')
+# sqlite attaches at most 10 databases to a connection
+MAX_SHARDS = 10
 
-class Manager:
+def shard_bucket(name, count):
+    '''
+    the hash shard of name out of count, stable across processes
+    '''
+    return crc32(name.encode('utf-8')) % count
+
+class Manager(Storage.Backend):
     def __init__(self, db_path=None):
         '''
         - opens a connection to a sqlite3 db (or creates a new one)
@@ -27,9 +47,11 @@ class Manager:
             if self.sqlite3_db_application_id(db_path) is False:
                 errmsg = 'File is a sqlite3 db, but the application_id is wrong'
                 raise Exceptions.BadFileType(errmsg)
+        self.db_path = db_path
         self.db_conn = connect(db_path)
         self.db_cur = self.db_conn.cursor()
         self.init_db()
+        self.shards = self._attach_shards()
 
 
     def init_db(self):
@@ -51,43 +73,443 @@ class Manager:
                 '''first_seen REAL, ''' +
                 '''last_seen REAL, ''' +
                 '''source_url TEXT, ''' +
+                '''ip_start INT, ''' +
+                '''ip_end INT, ''' +
                 '''UNIQUE ( name, source_url ))''')
         exceptions_table = ('''CREATE TABLE IF NOT EXISTS exceptions ( ''' +
                 '''name TEXT, ''' +
                 '''data_format TEXT )''')
+        # adaptive polling state per source, see Schedule
+        schedule_table = ('''CREATE TABLE IF NOT EXISTS schedule ( ''' +
+                '''url TEXT PRIMARY KEY, ''' +
+                '''interval REAL, ''' +
+                '''next_update REAL, ''' +
+                '''content_hash TEXT, ''' +
+                '''name_count INT, ''' +
+                '''name_delta INT, ''' +
+                '''unchanged INT )''')
+        # files holding data and active of a sharded database, the sources,
+        # schedule and exceptions stay in this one
+        shards_table = ('''CREATE TABLE IF NOT EXISTS shards ( ''' +
+                '''name TEXT PRIMARY KEY, ''' +
+                '''path TEXT, ''' +
+                '''scheme TEXT, ''' +
+                '''key TEXT )''')
+        schedule_delete = ('''CREATE TRIGGER IF NOT EXISTS ''' +
+                '''schedule_delete AFTER DELETE ON sources BEGIN ''' +
+                '''DELETE FROM schedule WHERE url=OLD.url; END''')
+        # one row per distinct name, kept up to date by the triggers below
+        # in the same transaction as any write to data
+        active_table = ('''CREATE TABLE IF NOT EXISTS active ( ''' +
+                '''name TEXT, ''' +
+                '''data_format TEXT, ''' +
+                '''source_count INT, ''' +
+                '''last_seen REAL, ''' +
+                '''PRIMARY KEY ( name, data_format ))''')
+        active_insert = ('''CREATE TRIGGER IF NOT EXISTS active_insert ''' +
+                '''AFTER INSERT ON data BEGIN ''' +
+                '''INSERT INTO active VALUES ''' +
+                '''( NEW.name, NEW.data_format, 1, NEW.last_seen ) ''' +
+                '''ON CONFLICT ( name, data_format ) DO UPDATE SET ''' +
+                '''source_count=source_count + 1, ''' +
+                '''last_seen=MAX(last_seen, excluded.last_seen); END''')
+        active_update = ('''CREATE TRIGGER IF NOT EXISTS active_update ''' +
+                '''AFTER UPDATE OF last_seen ON data BEGIN ''' +
+                '''UPDATE active SET last_seen=MAX(last_seen, NEW.last_seen) ''' +
+                '''WHERE name=NEW.name AND data_format=NEW.data_format; END''')
+        active_delete = ('''CREATE TRIGGER IF NOT EXISTS active_delete ''' +
+                '''AFTER DELETE ON data BEGIN ''' +
+                '''UPDATE active SET source_count=source_count - 1, ''' +
+                '''last_seen=(SELECT MAX(last_seen) FROM data ''' +
+                '''WHERE name=OLD.name AND data_format=OLD.data_format) ''' +
+                '''WHERE name=OLD.name AND data_format=OLD.data_format; ''' +
+                '''DELETE FROM active WHERE name=OLD.name AND ''' +
+                '''data_format=OLD.data_format AND source_count < 1; END''')
+        # indexes for joining sources to data by group
+        membership_index = ('''CREATE INDEX IF NOT EXISTS ''' +
+                '''sources_membership ON sources ( membership )''')
+        source_url_index = ('''CREATE INDEX IF NOT EXISTS ''' +
+                '''data_source_url ON data ( source_url, data_format )''')
+        # ip entries by range for lookups and merged exports
+        ip_range_index = ('''CREATE INDEX IF NOT EXISTS ''' +
+                '''data_ip_range ON data ( ip_start, ip_end ) ''' +
+                '''WHERE ip_start IS NOT NULL''')
+        # fill active for databases created before it existed
+        active_fill = ('''INSERT INTO active SELECT name, data_format, ''' +
+                '''COUNT(*), MAX(last_seen) FROM data ''' +
+                '''GROUP BY name, data_format''')
         # set an application ID and user_version
         application_id = ('''PRAGMA application_id = 1915402268''')
-        user_version = ('''PRAGMA user_version = 0x3''')
+        user_version = ('''PRAGMA user_version = ''' + str(SCHEMA_VERSION))
+        # sqlite3 only begins transactions before DML, the tables and
+        # migrations are committed together or not at all
+        self.begin()
         try:
+            self.db_cur.execute('''PRAGMA user_version''')
+            old_version = self.db_cur.fetchone()[0]
             self.db_cur.execute(application_id)
-            self.db_cur.execute(user_version)
             # set up tables
             self.db_cur.execute(source_table)
             self.db_cur.execute(data_table)
             self.db_cur.execute(exceptions_table)
+            self.db_cur.execute(active_table)
+            self.db_cur.execute(schedule_table)
+            self.db_cur.execute(shards_table)
+            self.db_cur.execute(schedule_delete)
+            self.db_cur.execute(active_insert)
+            self.db_cur.execute(active_update)
+            self.db_cur.execute(active_delete)
+            self.db_cur.execute(membership_index)
+            self.db_cur.execute(source_url_index)
+            # migrate older databases
+            if old_version < 0x4:
+                self.db_cur.execute('''DELETE FROM active''')
+                self.db_cur.execute(active_fill)
+            if old_version < 0x5:
+                self._add_ip_ranges()
+            self.db_cur.execute(ip_range_index)
+            # only a fully migrated database gets the new version
+            self.db_cur.execute(user_version)
             self.db_conn.commit()
             return True
-        except DatabaseError:
+        except Exception:
+            self.db_conn.rollback()
             raise
 
-    def pull_names_2(self, timeout, data_format, exceptions=True):
-        line = ('SELECT name FROM data WHERE (last_seen + ? >= ?) ' +
-            'AND (data_format = ?)')
-        except_line = ('SELECT name FROM data WHERE (last_seen + ? >= ?) AND ' +
-            '(data_format = ?) AND name NOT IN (SELECT name FROM exceptions) ')
-        if exceptions:
-            self.db_cur.execute(except_line, (timeout, time(), data_format))
+    def _add_ip_ranges(self):
+        '''
+        add the ip_start and ip_end columns to data if they are missing and
+        fill them for ip rows
+        '''
+        self.db_cur.execute('''PRAGMA table_info(data)''')
+        columns = [row[1] for row in self.db_cur.fetchall()]
+        for column in ('ip_start', 'ip_end'):
+            if column not in columns:
+                self.db_cur.execute('''ALTER TABLE data ADD COLUMN ''' +
+                    column + ''' INT''')
+        self.db_cur.execute('''SELECT rowid, name FROM data ''' +
+            '''WHERE data_format='ip' AND ip_start IS NULL''')
+        rows = self.db_cur.fetchall()
+        if rows:
+            starts, ends = IPv4.parse([name for _, name in rows])
+            self.db_cur.executemany('''UPDATE data SET ip_start=?, ''' +
+                '''ip_end=? WHERE rowid=?''',
+                zip(starts, ends, (rowid for rowid, _ in rows)))
+
+    def _attach_shards(self):
+        '''
+        attach the shard files listed in shards, returns a list of dicts of
+        name, path, scheme, key and schema in bucket order
+        '''
+        self.db_cur.execute('''SELECT name, path, scheme, key FROM shards''')
+        shards = sorted(self.db_cur.fetchall(),
+            key=lambda row: (row[2] == 'hash' and int(row[3]), row[3]))
+        attached = []
+        for name, shard_path, scheme, key in shards:
+            shard = self._shard(name, shard_path, scheme, key)
+            if not path.isfile(shard['path']):
+                errmsg = 'Missing shard file ' + shard['path']
+                raise Exceptions.DatabaseError(errmsg)
+            self._attach(shard)
+            attached.append(shard)
+        return attached
+
+    def _shard(self, name, shard_path, scheme, key):
+        # shard paths are relative to the database so the files can move
+        return {
+            'name' : name,
+            'path' : path.join(path.dirname(path.abspath(self.db_path)),
+                shard_path),
+            'scheme' : scheme,
+            'key' : key,
+            'schema' : SHARD_SCHEMA + name}
+
+    def _attach(self, shard):
+        # a Manager creates or migrates the shard's tables
+        Manager(shard['path']).db_conn.close()
+        self.db_cur.execute('''ATTACH DATABASE ? AS ''' + shard['schema'],
+            (shard['path'],))
+
+    def create_shards(self, scheme, count=None):
+        '''
+        move data into shard files next to the database, attached from then
+        on so the other methods read and write them
+        - scheme 'format' makes one shard per data_format
+        - scheme 'hash' makes count shards split by shard_bucket(name)
+        each name lives in one shard so the active table of each is exact,
+        returns the list of shards
+        '''
+        if self.shards:
+            raise Exceptions.DatabaseError('Database is already sharded')
+        if self.db_path == ':memory:':
+            errmsg = 'In memory databases can not be sharded'
+            raise Exceptions.DatabaseError(errmsg)
+        if scheme == 'format':
+            keys = list(FORMAT_SHARDS)
+        elif scheme == 'hash':
+            if count is None or not 1 < count <= MAX_SHARDS:
+                errmsg = ('Hash sharding needs 2 to ' + str(MAX_SHARDS)
+                    + ' shards')
+                raise Exceptions.DatabaseError(errmsg)
+            keys = [str(bucket) for bucket in range(count)]
         else:
+            raise Exceptions.DatabaseError('Unknown shard scheme '
+                + str(scheme))
+        self.db_cur.execute('''SELECT COUNT(*) FROM data ''' +
+            '''WHERE data_format NOT IN ( ''' +
+            ', '.join('?' * len(FORMAT_SHARDS)) + ''' )''', FORMAT_SHARDS)
+        if self.db_cur.fetchone()[0]:
+            errmsg = 'Data has formats other than ' + ', '.join(FORMAT_SHARDS)
+            raise Exceptions.DatabaseError(errmsg)
+        base = path.basename(self.db_path)
+        shards = [self._shard(key, base + '.' + key, scheme, key)
+            for key in keys]
+        # ATTACH isn't allowed inside a transaction
+        self.db_conn.commit()
+        self.db_conn.create_function('shard_bucket', 2, shard_bucket,
+            deterministic=True)
+        columns = ('''name, data_format, first_seen, last_seen, ''' +
+            '''source_url, ip_start, ip_end''')
+        try:
+            for shard in shards:
+                self._attach(shard)
+            self.db_cur.executemany('''INSERT INTO shards VALUES ''' +
+                '''( ?, ?, ?, ? )''',
+                [(shard['name'], base + '.' + shard['key'], scheme,
+                    shard['key']) for shard in shards])
+            for shard in shards:
+                line = ('''INSERT OR IGNORE INTO ''' + shard['schema'] +
+                    '''.data ( ''' + columns + ''' ) SELECT ''' + columns +
+                    ''' FROM main.data WHERE ''')
+                if scheme == 'format':
+                    line += '''data_format=?'''
+                    params = (shard['key'],)
+                else:
+                    line += '''shard_bucket(name, ?)=?'''
+                    params = (len(shards), int(shard['key']))
+                self.db_cur.execute(line, params)
+            # active first so the delete trigger has nothing to update
+            self.db_cur.execute('''DELETE FROM main.active''')
+            self.db_cur.execute('''DELETE FROM main.data''')
+            self.db_conn.commit()
+        except BaseException:
+            self.db_conn.rollback()
+            self._detach(shards)
+            raise
+        self.shards = shards
+        return shards
+
+    def _detach(self, shards):
+        attached = {row[1] for row in
+            self.db_conn.execute('''PRAGMA database_list''')}
+        for shard in shards:
+            if shard['schema'] in attached:
+                self.db_cur.execute('''DETACH DATABASE ''' + shard['schema'])
+
+    def partition(self, names, data_format):
+        '''
+        split names by the shard that holds them, returns a dict of
+        shard name: names, an unsharded database puts them all under None
+        '''
+        if not self.shards:
+            return {None : names}
+        if self.shards[0]['scheme'] == 'format':
+            for shard in self.shards:
+                if shard['key'] == data_format:
+                    return {shard['name'] : names}
+            errmsg = 'No shard holds ' + str(data_format)
+            raise Exceptions.IncorrectDataType(errmsg)
+        count = len(self.shards)
+        parts = {}
+        for name in names:
+            shard = self.shards[shard_bucket(name, count)]['name']
+            parts.setdefault(shard, []).append(name)
+        return parts
+
+    def _data_schemas(self, data_formats=None):
+        '''
+        the schemas whose data and active tables may hold rows of any of
+        data_formats, 'main' unless the database is sharded
+        '''
+        if not self.shards:
+            return ['main']
+        return [shard['schema'] for shard in self.shards
+            if shard['scheme'] == 'hash' or data_formats is None
+            or shard['key'] in data_formats]
+
+    @staticmethod
+    def _schema_of(shard):
+        return 'main' if shard is None else SHARD_SCHEMA + shard
+
+    def pull_names_2(self, timeout, data_format, exceptions=True):
+        '''
+        return the names seen in the last timeout seconds, read from the
+        active table so each name appears once however many sources have it
+        '''
+        names = []
+        for schema in self._data_schemas([data_format]):
+            line = ('SELECT name FROM ' + schema + '.active WHERE ' +
+                '(last_seen + ? >= ?) AND (data_format = ?)')
+            if exceptions:
+                line += ' AND name NOT IN (SELECT name FROM exceptions) '
             self.db_cur.execute(line, (timeout, time(), data_format))
-        return self.db_cur.fetchall()
+            names += self.db_cur.fetchall()
+        return names
+
+    def stream_names(self, timeout, data_formats, groups=None,
+            exceptions=True):
+        '''
+        return a cursor over (name, data_format, group, last_seen) rows for
+        names of any of data_formats seen in the last timeout seconds, rows
+        are fetched as they are read so exports don't hold the whole list
+        - without groups rows come from active and group is None
+        - with groups each name appears once per group it has a source in
+        a sharded database reads each shard in order and merges the streams
+        so rows come sorted by group, name and data_format
+        '''
+        data_formats = list(data_formats)
+        formats_in = ', '.join('?' * len(data_formats))
+        schemas = self._data_schemas(data_formats)
+        cursors = []
+        for schema in schemas:
+            if groups is None:
+                line = ('''SELECT name, data_format, NULL, last_seen ''' +
+                    '''FROM ''' + schema + '''.active ''' +
+                    '''WHERE data_format IN ( ''' + formats_in +
+                    ''' ) AND last_seen + ? >= ? ''')
+                if exceptions:
+                    line += '''AND name NOT IN (SELECT name FROM exceptions) '''
+                order = '''ORDER BY name, data_format'''
+                params = data_formats + [timeout, time()]
+            else:
+                group_list = [str(group) for group in groups]
+                line = ('''SELECT data.name, data.data_format, ''' +
+                    '''sources.membership, MAX(data.last_seen) ''' +
+                    '''FROM sources JOIN ''' + schema + '''.data AS data ''' +
+                    '''ON data.source_url=sources.url ''' +
+                    '''WHERE sources.membership IN ( ''' +
+                    ', '.join('?' * len(group_list)) + ''' ) ''' +
+                    '''AND data.data_format IN ( ''' + formats_in + ''' ) ''' +
+                    '''AND data.last_seen + ? >= ? ''')
+                if exceptions:
+                    line += ('''AND data.name NOT IN ''' +
+                        '''(SELECT name FROM exceptions) ''')
+                line += ('''GROUP BY sources.membership, data.data_format, ''' +
+                    '''data.name ''')
+                order = ('''ORDER BY CAST(sources.membership AS TEXT), ''' +
+                    '''data.name, data.data_format''')
+                params = group_list + data_formats + [timeout, time()]
+            if len(schemas) > 1:
+                line += order
+            # a cursor of its own so db_cur stays free while this is read
+            cursors.append(self.db_conn.execute(line, params))
+        if len(cursors) == 1:
+            return cursors[0]
+        return merge(*cursors,
+            key=lambda row: (str(row[2]), row[0], row[1]))
+
+    def lookup_ip(self, addr, timeout=None, exceptions=True):
+        '''
+        return (name, source_url, last_seen) rows for the ip entries that
+        cover the address addr, with timeout only entries seen in the last
+        timeout seconds. Entries are CIDR blocks so the candidates are the
+        network address of addr at each prefix, each an index lookup
+        '''
+        value = IPv4.to_int(addr)
+        starts = IPv4.network_starts(value)
+        rows = []
+        schemas = self._data_schemas(['ip'])
+        for schema in schemas:
+            line = ('''SELECT ip_start, name, source_url, last_seen ''' +
+                '''FROM ''' + schema + '''.data ''' +
+                '''WHERE ip_start IS NOT NULL AND ip_start IN ( ''' +
+                ', '.join('?' * len(starts)) + ''' ) AND ip_end >= ? ''')
+            params = starts + [value]
+            if timeout is not None:
+                line += '''AND last_seen + ? >= ? '''
+                params += [timeout, time()]
+            if exceptions:
+                line += '''AND name NOT IN (SELECT name FROM exceptions) '''
+            line += '''ORDER BY ip_start, name, source_url'''
+            self.db_cur.execute(line, params)
+            rows += self.db_cur.fetchall()
+        if len(schemas) > 1:
+            rows.sort(key=lambda row: row[:3])
+        return [row[1:] for row in rows]
+
+    def merged_ip_ranges(self, timeout, exceptions=True):
+        '''
+        return the ip entries seen in the last timeout seconds as sorted
+        (start, end) ranges with overlapping and touching entries joined,
+        rows are read in index order so merging is a single pass
+        '''
+        cursors = []
+        for schema in self._data_schemas(['ip']):
+            line = ('''SELECT ip_start, ip_end FROM ''' + schema +
+                '''.data WHERE ip_start IS NOT NULL AND last_seen + ? >= ? ''')
+            if exceptions:
+                line += '''AND name NOT IN (SELECT name FROM exceptions) '''
+            line += '''ORDER BY ip_start'''
+            cursors.append(self.db_conn.execute(line, (timeout, time())))
+        merged = []
+        for start, end in merge(*cursors):
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        return [(start, end) for start, end in merged]
+
+    def overlap_stats(self):
+        '''
+        source overlap statistics, returns a dict with
+        - distinct: number of distinct names
+        - rows: number of rows in data
+        - histogram: list of (source_count, names found in that many sources)
+        - sources: list of (source_url, names, names only in this source)
+        '''
+        histogram = {}
+        sources = {}
+        for schema in self._data_schemas():
+            hist_line = ('''SELECT source_count, COUNT(*) FROM ''' + schema +
+                '''.active GROUP BY source_count''')
+            source_line = ('''SELECT data.source_url, COUNT(*), ''' +
+                '''SUM(active.source_count = 1) FROM ''' + schema +
+                '''.data AS data JOIN ''' + schema + '''.active AS active ''' +
+                '''ON active.name=data.name ''' +
+                '''AND active.data_format=data.data_format ''' +
+                '''GROUP BY data.source_url''')
+            # names are in one shard each so the counts add up
+            for source_count, count in self.db_conn.execute(hist_line):
+                histogram[source_count] = histogram.get(source_count, 0) + count
+            for url, names, unique in self.db_conn.execute(source_line):
+                total = sources.setdefault(url, [0, 0])
+                total[0] += names
+                total[1] += unique
+        histogram = sorted(histogram.items())
+        return {
+            'distinct' : sum(count for _, count in histogram),
+            'rows' : sum(n * count for n, count in histogram),
+            'histogram' : histogram,
+            # NULL urls first like ORDER BY
+            'sources' : [(url, names, unique) for url, (names, unique)
+                in sorted(sources.items(),
+                    key=lambda item: (item[0] is not None, item[0] or ''))]}
 
     def pull_active_source_urls(self):
         '''
-        return a list of the blacklist urls that need updating from sources
+        return a list of the blacklist urls that need updating from sources,
+        a source is due at its scheduled next_update or if it has never been
+        scheduled its configured timeout after last_updated
+        each entry is a dict of url, page_format, last_modified, timeout and
+        the schedule's interval, content_hash and name_count (None if unset)
         '''
         cur = self.db_cur
-        pull_line = ('''SELECT url, page_format, last_modified_head FROM'''
-            + ''' sources WHERE ? > last_updated + timeout''')
+        pull_line = ('''SELECT sources.url, page_format, ''' +
+            '''last_modified_head, timeout, interval, content_hash, ''' +
+            '''name_count FROM sources LEFT JOIN schedule ''' +
+            '''ON schedule.url=sources.url WHERE ? > ''' +
+            '''COALESCE(next_update, last_updated + timeout)''')
         self.db_cur.execute(pull_line, (time(),))
         # any invalid urls found increment this
         errcnt = 0
@@ -97,7 +519,11 @@ class Manager:
                 result = {
                     'url' : url_result[0],
                     'page_format' : url_result[1],
-                    'last_modified' : url_result[2]}
+                    'last_modified' : url_result[2],
+                    'timeout' : url_result[3],
+                    'interval' : url_result[4],
+                    'content_hash' : url_result[5],
+                    'name_count' : url_result[6]}
                 urls.append(result)
             else:
                 errcnt += 1
@@ -108,6 +534,41 @@ class Manager:
                 + ' Invalid urls found in db: ' + str(errcnt))
             raise Exceptions.NoMatchesFound(errmsg)
 
+    def schedule_source(self, url, interval, next_update, changed,
+            content_hash=None, name_count=None, name_delta=None):
+        '''
+        store the polling interval and next poll time of url, changed says
+        whether the last fetch found new content, content_hash and
+        name_count are kept from before when None
+        ! Does not explicitly commit
+        '''
+        line = ('''INSERT INTO schedule VALUES ( ?, ?, ?, ?, ?, ?, ? ) ''' +
+            '''ON CONFLICT ( url ) DO UPDATE SET ''' +
+            '''interval=excluded.interval, ''' +
+            '''next_update=excluded.next_update, ''' +
+            '''content_hash=COALESCE(excluded.content_hash, content_hash), ''' +
+            '''name_count=COALESCE(excluded.name_count, name_count), ''' +
+            '''name_delta=COALESCE(excluded.name_delta, name_delta), ''' +
+            '''unchanged=CASE WHEN ? THEN 0 ELSE unchanged + 1 END''')
+        self.db_cur.execute(line, (url, interval, next_update, content_hash,
+            name_count, name_delta, 0 if changed else 1, bool(changed)))
+        return True
+
+    def refresh_source(self, url):
+        '''
+        mark every name from url as seen now without re-adding them, for a
+        page with the same content as last time, returns the rows touched
+        ! Does not explicitly commit
+        '''
+        touched = 0
+        current_time = time()
+        for schema in self._data_schemas():
+            line = ('''UPDATE ''' + schema + '''.data SET last_seen=? ''' +
+                '''WHERE source_url=?''')
+            self.db_cur.execute(line, (current_time, url))
+            touched += self.db_cur.rowcount
+        return touched
+
     def update_last_modified(self, url, last_modified):
         '''
         change the last-modified date for url
@@ -122,6 +583,34 @@ class Manager:
         self.db_cur.execute(line, tu)
         return True
 
+    def begin(self):
+        self.db_cur.execute('''BEGIN''')
+
+    def commit(self):
+        self.db_conn.commit()
+
+    def rollback(self):
+        self.db_conn.rollback()
+
+    def close(self):
+        self.db_conn.close()
+
+    @contextmanager
+    def savepoint(self, name):
+        '''
+        run the with block inside SAVEPOINT name, if it raises the block is
+        rolled back leaving earlier work alone. Outside a transaction the
+        savepoint begins one and releasing it commits
+        '''
+        self.db_cur.execute('''SAVEPOINT ''' + name)
+        try:
+            yield
+        except BaseException:
+            self.db_cur.execute('''ROLLBACK TO ''' + name)
+            self.db_cur.execute('''RELEASE ''' + name)
+            raise
+        self.db_cur.execute('''RELEASE ''' + name)
+
     def bulk_add(self, data_lst, data_type, source_url):
         '''
         add a list of items to the db using executemany
@@ -130,22 +619,34 @@ class Manager:
         '''
         current_time = time()
 
-        time_update = []
-        data_insert = []
-
         if not data_lst:
             errmsg = 'No items to add.'
             raise Exceptions.EmptyList(errmsg)
-        for each in data_lst:
-            data = each.rstrip()
-            data_insert.append(
-                (data, data_type, current_time, current_time, source_url))
+        names = [each.rstrip() for each in data_lst]
+        for shard, part in self.partition(names, data_type).items():
+            self._insert(self._schema_of(shard), part, data_type,
+                source_url, current_time)
+        return True
+
+    def _insert(self, schema, names, data_type, source_url, current_time):
+        time_update = []
+        data_insert = []
+        # ip entries also get their integer range, parsed in one go
+        if data_type == 'ip':
+            starts, ends = IPv4.parse(names)
+        else:
+            starts = ends = [None] * len(names)
+        for data, start, end in zip(names, starts, ends):
+            data_insert.append((data, data_type, current_time, current_time,
+                source_url, start, end))
             time_update.append((current_time, data, source_url))
 
         #NOTE: this code above only writes the last url w/ addr to source
-        iline = (''' INSERT OR IGNORE INTO data''' +
-                ''' VALUES ( ?, ?, ?, ?, ? )''')
-        tline = (''' UPDATE data''' +
+        iline = (''' INSERT OR IGNORE INTO ''' + schema + '''.data''' +
+                ''' ( name, data_format, first_seen, last_seen, ''' +
+                '''source_url, ip_start, ip_end )''' +
+                ''' VALUES ( ?, ?, ?, ?, ?, ?, ? )''')
+        tline = (''' UPDATE ''' + schema + '''.data''' +
                 ''' SET last_seen=? WHERE name=? AND source_url=?''')
         try:
             self.db_cur.executemany(iline, data_insert)
@@ -153,8 +654,6 @@ class Manager:
         except:
             raise
 
-        return True
-
     def add_element(self, data, data_type, source_url, whitelist=False):
         '''
         add a single element to the db
@@ -164,18 +663,30 @@ class Manager:
         if not isinstance(data, str):
             raise Exceptions.NotString('address must be a string')
         current_time = time()
+        if data_type == 'ip':
+            start, end = IPv4.to_range(data.rstrip())
+        else:
+            start = end = None
         data_insert = (
             data.rstrip(),
             data_type,
             current_time,
             current_time,
-            source_url)
+            source_url,
+            start,
+            end)
         time_update = (current_time, source_url, data.rstrip())
         whitelist_insert = (data.rstrip(), data_type)
 
-        line = ('''INSERT OR IGNORE INTO data''' +
-                '''VALUES ( ?, ?, ?, ?, ? ) ''')
-        time_line = (''' UPDATE data ''' +
+        schema = 'main'
+        if not whitelist:
+            shard, = self.partition([data.rstrip()], data_type)
+            schema = self._schema_of(shard)
+        line = ('''INSERT OR IGNORE INTO ''' + schema + '''.data ''' +
+                '''( name, data_format, first_seen, last_seen, ''' +
+                '''source_url, ip_start, ip_end ) ''' +
+                '''VALUES ( ?, ?, ?, ?, ?, ?, ? ) ''')
+        time_line = (''' UPDATE ''' + schema + '''.data ''' +
             '''SET last_seen=?, source_url=? WHERE name=?''')
 
         white_line = ('''INSERT OR IGNORE INTO exceptions ''' +
@@ -196,7 +707,7 @@ class Manager:
         '''
         if not isinstance(data, str):
             raise Exceptions.NotString('address must be a string')
-        if not isinstance(source_url, None) and not isinstance(source_url, str):
+        if source_url is not None and not isinstance(source_url, str):
             raise Exceptions.NotString('source_url must be a string or None')
         element = data.rstrip()
         if not source_url and not whitelist:
@@ -210,8 +721,14 @@ class Manager:
             raise Exceptions.DatabaseError(errmsg)
         else:
             data_remove = (element, source_url)
-            remove_line = ('''DELETE FROM data WHERE name=? AND source=?''')
-        self.db_cur.execute(remove_line, data_remove)
+            remove_line = ('''DELETE FROM data WHERE name=? ''' +
+                '''AND source_url=?''')
+        if whitelist:
+            self.db_cur.execute(remove_line, data_remove)
+            return
+        for schema in self._data_schemas():
+            self.db_cur.execute(remove_line.replace('FROM data',
+                'FROM ' + schema + '.data'), data_remove)
 
     def add_source_url(self, url, dataformat, timeout):
         '''
@@ -246,6 +763,69 @@ class Manager:
         self.db_cur.execute(line, tu)
         return True
 
+    def pull_sources(self):
+        '''
+        return a dict of url: (page_format, timeout, membership) for every
+        source in the database
+        '''
+        line = '''SELECT url, page_format, timeout, membership FROM sources'''
+        self.db_cur.execute(line)
+        return {row[0] : (row[1], row[2], row[3])
+            for row in self.db_cur.fetchall()}
+
+    def sync_sources(self, sources, prune=True):
+        '''
+        make the sources table match sources, a list of dicts holding url,
+        page_format, timeout and membership (see Config.Config)
+        - sources not in the list are deleted unless prune is False
+        - last_updated and last_modified_head of existing sources are kept
+        ! Does not explicitly commit
+        returns a tuple of (added, changed, removed) url lists
+        '''
+        current = self.pull_sources()
+        wanted = {source['url'] : (source['page_format'],
+            float(source['timeout']), source['membership'])
+            for source in sources}
+        added = [url for url in wanted if url not in current]
+        changed = [url for url in wanted if url in current
+            and Storage.sync_key(current[url])
+                != Storage.sync_key(wanted[url])]
+        removed = []
+        if prune:
+            removed = [url for url in current if url not in wanted]
+        # last_updated set to 61sec after epoch (never) like add_source_url
+        add_line = ('''INSERT INTO sources VALUES ''' +
+            '''(?, ?, ?, 61.0, NULL, ?)''')
+        change_line = ('''UPDATE sources SET page_format=?, timeout=?, ''' +
+            '''membership=? WHERE url=?''')
+        remove_line = '''DELETE FROM sources WHERE url=?'''
+        self.db_cur.executemany(add_line,
+            [(url,) + wanted[url] for url in added])
+        self.db_cur.executemany(change_line,
+            [wanted[url] + (url,) for url in changed])
+        self.db_cur.executemany(remove_line, [(url,) for url in removed])
+        return added, changed, removed
+
+    def sync_exceptions(self, exceptions, prune=True):
+        '''
+        make the exceptions table match exceptions, a list of
+        (name, data_format) tuples, entries not in the list are deleted
+        unless prune is False
+        ! Does not explicitly commit
+        returns a tuple of (added, removed) lists
+        '''
+        self.db_cur.execute('''SELECT name, data_format FROM exceptions''')
+        current = set(self.db_cur.fetchall())
+        wanted = set(exceptions)
+        added = sorted(wanted - current)
+        removed = sorted(current - wanted) if prune else []
+        self.db_cur.executemany(
+            '''INSERT INTO exceptions VALUES (?, ?)''', added)
+        self.db_cur.executemany(
+            '''DELETE FROM exceptions WHERE name=? AND data_format=?''',
+            removed)
+        return added, removed
+
     def delete_source_url(self, url):
         '''
         delete a blacklist source url from the database
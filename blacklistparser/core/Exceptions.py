@@ -44,3 +44,7 @@ class ValidatorError(ExtractorError):
     Error validating ip/domain
     '''
 
+class ConfigError(ExtractorError):
+    '''
+    Error reading or validating a config file
+    '''
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+from socket import inet_aton, inet_ntoa
+
+'''
+IPv4 addresses and CIDR blocks as inclusive (start, end) integer ranges
+parse(), merge_arrays() and merge_names() work on whole feeds at once, with
+numpy they are vectorized and without it they fall back to to_range() and
+merge()
+'''
+
+# '.' and '/' become field separators for numpy.fromstring
+_SEPARATORS = str.maketrans('./', '  ')
+# numpy module, False when it isn't installed, None until first needed
+_numpy = None
+
+def load_numpy():
+    '''
+    return numpy or None if it isn't installed, it is imported on first use
+    so importing the database doesn't pay for it
+    '''
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+def to_int(addr):
+    '''
+    dotted quad to an unsigned 32 bit int
+    '''
+    return int.from_bytes(inet_aton(addr), 'big')
+
+def to_text(value):
+    return inet_ntoa(value.to_bytes(4, 'big'))
+
+def to_range(name):
+    '''
+    return (start, end) for an address or CIDR block eg. 1.2.3.0/24
+    validate the name first, host bits of a block are ignored
+    '''
+    addr, _, prefix = name.partition('/')
+    start = to_int(addr)
+    if not prefix:
+        return start, start
+    host = (1 << (32 - int(prefix))) - 1
+    start &= ~host & 0xffffffff
+    return start, start | host
+
+def network_starts(value):
+    '''
+    return the network address of value at every prefix from /32 to /1,
+    the starts of all the CIDR blocks that could hold it
+    '''
+    return [value & ~((1 << host) - 1) & 0xffffffff for host in range(32)]
+
+def to_cidrs(start, end):
+    '''
+    return the fewest CIDR blocks covering start to end as text, single
+    addresses have no prefix
+    '''
+    blocks = []
+    while start <= end:
+        # the largest aligned block at start that ends by end
+        size = start & -start or 1 << 32
+        while start + size - 1 > end:
+            size >>= 1
+        prefix = 33 - size.bit_length()
+        if prefix == 32:
+            blocks.append(to_text(start))
+        else:
+            blocks.append(to_text(start) + '/' + str(prefix))
+        start += size
+    return blocks
+
+def merge(ranges):
+    '''
+    sort ranges and join the ones that overlap or touch
+    '''
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+def parse(names, use_numpy=True):
+    '''
+    return (starts, ends) lists of ints for validated addresses and CIDR
+    blocks, the same as to_range() on each name
+    '''
+    if not use_numpy or not names or load_numpy() is None:
+        ranges = [to_range(name) for name in names]
+        return [start for start, _ in ranges], [end for _, end in ranges]
+    starts, ends = parse_arrays(names)
+    return starts.tolist(), ends.tolist()
+
+def parse_arrays(names):
+    '''
+    numpy only, return (starts, ends) uint32 arrays for the names
+    '''
+    numpy = load_numpy()
+    # every name as five integers a b c d prefix
+    text = ' '.join(name if '/' in name else name + '/32'
+        for name in names).translate(_SEPARATORS)
+    fields = numpy.fromstring(text, dtype=numpy.uint64, sep=' ')
+    if fields.size != 5 * len(names):
+        raise ValueError('names must be validated ipv4 addresses')
+    fields = fields.reshape(-1, 5)
+    starts = ((fields[:, 0] << numpy.uint64(24))
+        | (fields[:, 1] << numpy.uint64(16))
+        | (fields[:, 2] << numpy.uint64(8)) | fields[:, 3])
+    one = numpy.uint64(1)
+    host = (one << (numpy.uint64(32) - fields[:, 4])) - one
+    starts &= ~host & numpy.uint64(0xffffffff)
+    return starts.astype(numpy.uint32), (starts | host).astype(numpy.uint32)
+
+def merge_arrays(starts, ends, use_numpy=True):
+    '''
+    sort, dedupe and join overlapping or touching ranges given as parallel
+    sequences, returns a list of (start, end) like merge()
+    '''
+    if not use_numpy or not len(starts) or load_numpy() is None:
+        return merge(zip(starts, ends))
+    numpy = load_numpy()
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.asarray(ends, dtype=numpy.int64)
+    order = numpy.lexsort((ends, starts))
+    starts = starts[order]
+    # the furthest end reached by this range or any before it
+    reach = numpy.maximum.accumulate(ends[order])
+    # a range opens a new block when it starts past everything before it
+    opens = numpy.empty(len(starts), dtype=bool)
+    opens[0] = True
+    opens[1:] = starts[1:] > reach[:-1] + 1
+    first = numpy.flatnonzero(opens)
+    last = numpy.append(first[1:] - 1, len(starts) - 1)
+    return list(zip(starts[first].tolist(), reach[last].tolist()))
+
+def merge_names(names, use_numpy=True):
+    '''
+    merged (start, end) ranges of validated addresses and CIDR blocks, with
+    numpy the parsed arrays go straight to merge_arrays without becoming
+    lists in between
+    '''
+    if not use_numpy or not names or load_numpy() is None:
+        return merge_arrays(*parse(names, False), use_numpy=False)
+    return merge_arrays(*parse_arrays(names))
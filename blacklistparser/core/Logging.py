@@ -3,8 +3,9 @@
 # Liam Nolan (c) 2019 ISC
 # Full licence terms located in LICENCE file
 
+from atexit import register
+from queue import SimpleQueue
 from logging import getLogger, StreamHandler, Formatter
-from logging.handlers import WatchedFileHandler, SysLogHandler
 from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
 
 from blacklistparser.core import types
@@ -15,7 +16,11 @@ class StartLog:
         '''
         start logging facilities
         pass an optional logpath to log to disk (using WatchedFileHandler)
+        the logger only has a QueueHandler, records are passed to the real
+        handlers by a QueueListener thread so a slow disk or /dev/log never
+        blocks the caller
         '''
+        from logging.handlers import QueueHandler, QueueListener
         levels = {'DEBUG':DEBUG, 'INFO':INFO, 'WARNING':WARNING, 'ERROR':ERROR, 'CRITICAL':CRITICAL}
         assert loglevel in levels.keys() or loglevel == None, 'log level must be one of ' + str(levels)
         # set loglevel based on verbosity/quiet args
@@ -31,32 +36,52 @@ class StartLog:
         formatter = Formatter('%(name)s - %(message)s')
         self.log = getLogger('blacklistparser')
         self.log.setLevel(loglevel)
+        handlers = []
         # setup console logger
         self.console_log = StreamHandler()
         self.console_log.setFormatter(formatter)
         self.console_log.setLevel(loglevel)
-        self.log.addHandler(self.console_log)
+        handlers.append(self.console_log)
+        # setup the queue, the listener thread owns the real handlers
+        self.queue = SimpleQueue()
+        self.queue_handler = QueueHandler(self.queue)
+        self.log.addHandler(self.queue_handler)
+        self.listener = QueueListener(self.queue, respect_handler_level=True)
         self.log.debug('Added StreamHandler() console logging')
         # alternative logging types below
         if logpath is None:
             self.log.debug('log path not specified')
         elif types.base_path_type(logpath) is not None:
             # setup disk log
+            from logging.handlers import WatchedFileHandler
             self.disk_log = WatchedFileHandler(logpath)
             self.disk_log.setFormatter(formatter)
             self.disk_log.setLevel(loglevel)
-            self.log.addHandler(self.disk_log)
+            handlers.append(self.disk_log)
             self.log.debug('Added WatchedFileHandler() logging')
         if syslog:
             # setup syslog
             # this is using /dev/log socket that is very (linux/openbsd)
             # platform dependant, should add some os detection logic here
             # and an argument to log to remote syslog server/port
+            from logging.handlers import SysLogHandler
             self.sys_log_handler = SysLogHandler(address='/dev/log')
             self.sys_log_handler.setFormatter(formatter)
             self.sys_log_handler.setLevel(loglevel)
-            self.log.addHandler(self.sys_log_handler)
+            handlers.append(self.sys_log_handler)
             self.log.debug('Added SysLogHandler() logging')
+        self.listener.handlers = tuple(handlers)
+        self.listener.start()
+        self.running = True
+        # drain the queue before the interpreter exits
+        register(self.stop)
         # log setup success/fail msg at DEBUG level
-        debugmsg = ('setting log level to ' + str(loglevel))
-        self.log.debug(debugmsg)
+        self.log.debug('setting log level to %s', loglevel)
+
+    def stop(self):
+        '''
+        flush queued records to the handlers and stop the listener thread
+        '''
+        if self.running:
+            self.running = False
+            self.listener.stop()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+from time import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from blacklistparser.core import Exceptions, IPv4, Storage
+
+'''
+in memory storage engine with the semantics of Database.Manager, nothing
+is written to disk so it suits tests, CI and one off runs
+
+tables are dicts of key: tuple, every write records the old value in an
+undo log so rollback() and savepoints can put it back and commit() just
+forgets the log. Secondary indexes by name and by source are kept next to
+data, sorted lists of the active names and of the ip ranges are rebuilt
+when the rows they are built from change
+'''
+
+# undo log marker for a key that didn't exist
+_MISSING = object()
+
+
+class Manager(Storage.Backend):
+    def __init__(self):
+        # url: (page_format, timeout, last_updated, last_modified_head,
+        #   membership)
+        self.sources = {}
+        # url: (interval, next_update, content_hash, name_count,
+        #   name_delta, unchanged)
+        self.schedule = {}
+        # (name, source_url): (data_format, first_seen, last_seen,
+        #   ip_start, ip_end)
+        self.data = {}
+        # (name, data_format): (source_count, last_seen)
+        self.active = {}
+        # (name, data_format): None
+        self.exceptions = {}
+        self.tables = {
+            'sources' : self.sources,
+            'schedule' : self.schedule,
+            'data' : self.data,
+            'active' : self.active,
+            'exceptions' : self.exceptions}
+        # name: {source_url} and source_url: {name} for data
+        self.by_name = {}
+        self.by_source = {}
+        # (table, key, old value) of every write since the last commit
+        self.undo = []
+        # sorted active keys and (start, end, name, source_url) ip rows,
+        # None when they need rebuilding
+        self._active_keys = None
+        self._ip_rows = None
+
+    ## writes, everything goes through _put and _delete
+
+    def _put(self, table, key, value):
+        rows = self.tables[table]
+        old = rows.get(key, _MISSING)
+        self.undo.append((table, key, old))
+        self._set(table, key, old, value)
+
+    def _delete(self, table, key):
+        rows = self.tables[table]
+        if key in rows:
+            old = rows[key]
+            self.undo.append((table, key, old))
+            self._set(table, key, old, _MISSING)
+
+    def _set(self, table, key, old, value):
+        rows = self.tables[table]
+        if value is _MISSING:
+            del rows[key]
+        else:
+            rows[key] = value
+        if table == 'active' and (old is _MISSING or value is _MISSING):
+            self._active_keys = None
+        elif table == 'data':
+            name, source_url = key
+            if old is _MISSING:
+                self.by_name.setdefault(name, set()).add(source_url)
+                self.by_source.setdefault(source_url, set()).add(name)
+            elif value is _MISSING:
+                self._unindex(self.by_name, name, source_url)
+                self._unindex(self.by_source, source_url, name)
+            ip_row = value if value is not _MISSING else old
+            if ip_row[3] is not None:
+                self._ip_rows = None
+
+    @staticmethod
+    def _unindex(index, key, member):
+        members = index[key]
+        members.discard(member)
+        if not members:
+            del index[key]
+
+    def _rollback_to(self, mark):
+        while len(self.undo) > mark:
+            table, key, old = self.undo.pop()
+            current = self.tables[table].get(key, _MISSING)
+            self._set(table, key, current, old)
+
+    ## transactions
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self.undo = []
+
+    def rollback(self):
+        self._rollback_to(0)
+
+    def close(self):
+        self.rollback()
+
+    @contextmanager
+    def savepoint(self, name):
+        mark = len(self.undo)
+        try:
+            yield
+        except BaseException:
+            self._rollback_to(mark)
+            raise
+
+    ## sources
+
+    def add_source_url(self, url, dataformat, timeout):
+        url = str(url)
+        if url not in self.sources:
+            # last_updated set to 61sec after epoch (never)
+            self._put('sources', url,
+                (str(dataformat), float(timeout), 61.0, None, None))
+        return True
+
+    def _update_source(self, url, field, value):
+        if url in self.sources:
+            row = list(self.sources[url])
+            row[field] = value
+            self._put('sources', url, tuple(row))
+
+    def change_group(self, group, source_url):
+        self._update_source(str(source_url), 4, str(group))
+        return True
+
+    def test_source_url(self, url):
+        if str(url) not in self.sources:
+            errmsg = 'No source urls matching input found'
+            raise Exceptions.NoMatchesFound(errmsg)
+        return True
+
+    def delete_source_url(self, url):
+        self._delete('sources', str(url))
+        self._delete('schedule', str(url))
+        return True
+
+    def pull_sources(self):
+        return {url : (row[0], row[1], row[4])
+            for url, row in self.sources.items()}
+
+    def sync_sources(self, sources, prune=True):
+        current = self.pull_sources()
+        wanted = {source['url'] : (source['page_format'],
+            float(source['timeout']), source['membership'])
+            for source in sources}
+        added = [url for url in wanted if url not in current]
+        changed = [url for url in wanted if url in current
+            and Storage.sync_key(current[url])
+                != Storage.sync_key(wanted[url])]
+        removed = []
+        if prune:
+            removed = [url for url in current if url not in wanted]
+        for url in added:
+            page_format, timeout, membership = wanted[url]
+            self._put('sources', url,
+                (page_format, timeout, 61.0, None, membership))
+        for url in changed:
+            page_format, timeout, membership = wanted[url]
+            _, _, last_updated, last_modified, _ = self.sources[url]
+            self._put('sources', url, (page_format, timeout, last_updated,
+                last_modified, membership))
+        for url in removed:
+            self.delete_source_url(url)
+        return added, changed, removed
+
+    def pull_active_source_urls(self):
+        now = time()
+        urls = []
+        for url, row in self.sources.items():
+            page_format, timeout, last_updated, last_modified, _ = row
+            schedule = self.schedule.get(url, (None,) * 6)
+            due = schedule[1]
+            if due is None:
+                due = last_updated + timeout
+            if now > due:
+                urls.append({
+                    'url' : url,
+                    'page_format' : page_format,
+                    'last_modified' : last_modified,
+                    'timeout' : timeout,
+                    'interval' : schedule[0],
+                    'content_hash' : schedule[2],
+                    'name_count' : schedule[3]})
+        if urls:
+            return urls
+        errmsg = ('All urls on cooldown or none in database.'
+            + ' Invalid urls found in db: 0')
+        raise Exceptions.NoMatchesFound(errmsg)
+
+    def schedule_source(self, url, interval, next_update, changed,
+            content_hash=None, name_count=None, name_delta=None):
+        old = self.schedule.get(url)
+        if old is None:
+            unchanged = 0 if changed else 1
+        else:
+            unchanged = 0 if changed else old[5] + 1
+            content_hash = old[2] if content_hash is None else content_hash
+            name_count = old[3] if name_count is None else name_count
+            name_delta = old[4] if name_delta is None else name_delta
+        self._put('schedule', url, (interval, next_update, content_hash,
+            name_count, name_delta, unchanged))
+        return True
+
+    def update_last_modified(self, url, last_modified):
+        self._update_source(url, 3, last_modified)
+        return True
+
+    def touch_source_url(self, url):
+        self._update_source(url, 2, time())
+        return True
+
+    ## names
+
+    def _insert(self, name, data_type, source_url, now, start, end):
+        key = (name, source_url)
+        if key in self.data:
+            self._seen(key, now)
+            return
+        self._put('data', key, (data_type, now, now, start, end))
+        active_key = (name, data_type)
+        count, last_seen = self.active.get(active_key, (0, now))
+        self._put('active', active_key, (count + 1, max(last_seen, now)))
+
+    def _seen(self, key, now):
+        data_format, first_seen, _, start, end = self.data[key]
+        self._put('data', key, (data_format, first_seen, now, start, end))
+        active_key = (key[0], data_format)
+        count, last_seen = self.active[active_key]
+        if now > last_seen:
+            self._put('active', active_key, (count, now))
+
+    def bulk_add(self, data_lst, data_type, source_url):
+        if not data_lst:
+            errmsg = 'No items to add.'
+            raise Exceptions.EmptyList(errmsg)
+        now = time()
+        names = [each.rstrip() for each in data_lst]
+        if data_type == 'ip':
+            starts, ends = IPv4.parse(names)
+        else:
+            starts = ends = [None] * len(names)
+        for name, start, end in zip(names, starts, ends):
+            self._insert(name, data_type, source_url, now, start, end)
+        return True
+
+    def add_element(self, data, data_type, source_url, whitelist=False):
+        if not isinstance(data, str):
+            raise Exceptions.NotString('address must be a string')
+        name = data.rstrip()
+        if whitelist:
+            self._put('exceptions', (name, data_type), None)
+            return
+        start = end = None
+        if data_type == 'ip':
+            start, end = IPv4.to_range(name)
+        self._insert(name, data_type, source_url, time(), start, end)
+
+    def _remove(self, key):
+        data_format = self.data[key][0]
+        self._delete('data', key)
+        active_key = (key[0], data_format)
+        count, _ = self.active[active_key]
+        remaining = [self.data[(key[0], source_url)][2]
+            for source_url in self.by_name.get(key[0], ())
+            if self.data[(key[0], source_url)][0] == data_format]
+        if count > 1 and remaining:
+            self._put('active', active_key, (count - 1, max(remaining)))
+        else:
+            self._delete('active', active_key)
+
+    def remove_element(self, data, source_url=None, whitelist=False):
+        if not isinstance(data, str):
+            raise Exceptions.NotString('address must be a string')
+        if source_url is not None and not isinstance(source_url, str):
+            raise Exceptions.NotString('source_url must be a string or None')
+        name = data.rstrip()
+        if whitelist and source_url:
+            errmsg = 'Can not operate on whitelist with source url'
+            raise Exceptions.DatabaseError(errmsg)
+        if whitelist:
+            for key in [key for key in self.exceptions if key[0] == name]:
+                self._delete('exceptions', key)
+            return
+        if source_url:
+            sources = [source_url] if (name, source_url) in self.data else []
+        else:
+            sources = list(self.by_name.get(name, ()))
+        for source in sources:
+            self._remove((name, source))
+
+    def refresh_source(self, url):
+        now = time()
+        names = list(self.by_source.get(url, ()))
+        for name in names:
+            self._seen((name, url), now)
+        return len(names)
+
+    def sync_exceptions(self, exceptions, prune=True):
+        current = set(self.exceptions)
+        wanted = set(exceptions)
+        added = sorted(wanted - current)
+        removed = sorted(current - wanted) if prune else []
+        for key in added:
+            self._put('exceptions', key, None)
+        for key in removed:
+            self._delete('exceptions', key)
+        return added, removed
+
+    def _excepted(self):
+        return {name for name, _ in self.exceptions}
+
+    def stream_names(self, timeout, data_formats, groups=None,
+            exceptions=True):
+        '''
+        rows come sorted by group, name and data_format
+        '''
+        oldest = time() - timeout
+        data_formats = set(data_formats)
+        excepted = self._excepted() if exceptions else ()
+        if groups is None:
+            if self._active_keys is None:
+                self._active_keys = sorted(self.active)
+            for key in self._active_keys:
+                name, data_format = key
+                last_seen = self.active[key][1]
+                if (data_format in data_formats and last_seen >= oldest
+                        and name not in excepted):
+                    yield name, data_format, None, last_seen
+            return
+        groups = {str(group) for group in groups}
+        # (group, name, data_format): last_seen
+        found = {}
+        for (name, source_url), row in self.data.items():
+            source = self.sources.get(source_url)
+            if source is None or str(source[4]) not in groups:
+                continue
+            if (row[0] not in data_formats or row[2] < oldest
+                    or name in excepted):
+                continue
+            key = (str(source[4]), name, row[0])
+            found[key] = max(found.get(key, row[2]), row[2])
+        for key in sorted(found):
+            group, name, data_format = key
+            yield name, data_format, group, found[key]
+
+    def _ip_index(self):
+        if self._ip_rows is None:
+            self._ip_rows = sorted((row[3], row[4], name, source_url)
+                for (name, source_url), row in self.data.items()
+                if row[3] is not None)
+        return self._ip_rows
+
+    def lookup_ip(self, addr, timeout=None, exceptions=True):
+        value = IPv4.to_int(addr)
+        index = self._ip_index()
+        excepted = self._excepted() if exceptions else ()
+        oldest = None if timeout is None else time() - timeout
+        rows = []
+        # the entries covering value start at one of its network addresses
+        for start in sorted(set(IPv4.network_starts(value))):
+            at = bisect_left(index, (start,))
+            while at < len(index) and index[at][0] == start:
+                _, end, name, source_url = index[at]
+                last_seen = self.data[(name, source_url)][2]
+                if (end >= value and name not in excepted
+                        and (oldest is None or last_seen >= oldest)):
+                    rows.append((start, name, source_url, last_seen))
+                at += 1
+        return [row[1:] for row in sorted(rows)]
+
+    def merged_ip_ranges(self, timeout, exceptions=True):
+        oldest = time() - timeout
+        excepted = self._excepted() if exceptions else ()
+        merged = []
+        for start, end, name, source_url in self._ip_index():
+            if (self.data[(name, source_url)][2] < oldest
+                    or name in excepted):
+                continue
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        return [(start, end) for start, end in merged]
+
+    def overlap_stats(self):
+        histogram = {}
+        for count, _ in self.active.values():
+            histogram[count] = histogram.get(count, 0) + 1
+        histogram = sorted(histogram.items())
+        sources = {}
+        for (name, source_url), row in self.data.items():
+            total = sources.setdefault(source_url, [0, 0])
+            total[0] += 1
+            total[1] += self.active[(name, row[0])][0] == 1
+        return {
+            'distinct' : sum(count for _, count in histogram),
+            'rows' : sum(n * count for n, count in histogram),
+            'histogram' : histogram,
+            'sources' : [(url, names, unique) for url, (names, unique)
+                in sorted(sources.items(),
+                    key=lambda item: (item[0] is not None, item[0] or ''))]}
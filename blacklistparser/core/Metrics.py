@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+from os import replace, chmod, stat
+from time import perf_counter
+from os.path import dirname, abspath
+
+'''
+per stage timers and counters for update/output
+with recorder.stage('parse', url) as stage:
+    stage.rows = len(lines)
+when the recorder is disabled stage() hands back a shared NullStage so the
+cost is one method call per stage
+'''
+
+PROMETHEUS_PREFIX = 'blacklistparser_stage_'
+# mode of a new prometheus file, the collector often runs as another user
+PROMETHEUS_MODE = 0o644
+
+
+class NullStage:
+    '''
+    stand in for Stage when metrics are disabled, counters set on it
+    are thrown away
+    '''
+    rows = 0
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    '''
+    times a single run of a stage, set rows and bytes inside the with block
+    '''
+    __slots__ = ('recorder', 'key', 'rows', 'bytes', 'start')
+
+    def __init__(self, recorder, key):
+        self.recorder = recorder
+        self.key = key
+        self.rows = 0
+        self.bytes = 0
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add(self.key, perf_counter() - self.start,
+            self.rows, self.bytes)
+        return False
+
+
+class Recorder:
+    def __init__(self, logger=None, enabled=False):
+        '''
+        collect wall time, rows and bytes per (stage, source)
+        logger is used by emit() to write the structured log lines
+        '''
+        self.log = logger
+        self.enabled = enabled
+        # (stage, source): [seconds, rows, bytes, runs]
+        self.totals = {}
+
+    def stage(self, name, source=None):
+        '''
+        context manager timing the stage name, source is an optional label
+        such as the url being processed
+        '''
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, (name, source))
+
+    def add(self, key, seconds, rows=0, nbytes=0):
+        total = self.totals.setdefault(key, [0.0, 0, 0, 0])
+        total[0] += seconds
+        total[1] += rows
+        total[2] += nbytes
+        total[3] += 1
+
+    def emit(self):
+        '''
+        log one key=value line per stage and source at INFO level
+        '''
+        if not self.enabled or self.log is None:
+            return
+        for (name, source), (seconds, rows, nbytes, runs) in self.totals.items():
+            self.log.info('metric stage=%s source=%s seconds=%.6f rows=%d '
+                'bytes=%d runs=%d', name, source or '-', seconds, rows,
+                nbytes, runs)
+
+    def write_prometheus(self, pathname):
+        '''
+        write the totals in the prometheus text format for the node_exporter
+        textfile collector, the file is replaced atomically
+        '''
+        if not self.enabled:
+            return
+        lines = []
+        for metric, index, desc in (
+                ('seconds', 0, 'Wall time spent in the stage'),
+                ('rows', 1, 'Rows handled by the stage'),
+                ('bytes', 2, 'Bytes handled by the stage'),
+                ('runs', 3, 'Times the stage ran')):
+            lines.append('# HELP ' + PROMETHEUS_PREFIX + metric + ' ' + desc)
+            lines.append('# TYPE ' + PROMETHEUS_PREFIX + metric + ' gauge')
+            for (name, source), total in sorted(self.totals.items(),
+                    key=lambda item: (item[0][0], item[0][1] or '')):
+                labels = 'stage="' + _escape(name) + '"'
+                if source is not None:
+                    labels += ',source="' + _escape(source) + '"'
+                lines.append(PROMETHEUS_PREFIX + metric + '{' + labels + '} '
+                    + str(total[index]))
+        from tempfile import NamedTemporaryFile
+        # the collector may read at any time so never leave a partial file
+        with NamedTemporaryFile('w', dir=dirname(abspath(pathname)),
+                delete=False) as tmp:
+            tmp.write('\n'.join(lines) + '\n')
+        # temporary files are 0600, keep the mode of the file replaced
+        try:
+            mode = stat(pathname).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = PROMETHEUS_MODE
+        chmod(tmp.name, mode)
+        replace(tmp.name, pathname)
+
+
+class CountingReader:
+    '''
+    wraps a binary file object (eg. a http response) counting bytes read
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes += len(data)
+        return data
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n'))
@@ -2,20 +2,73 @@
 # Liam Nolan (c) 2019 ISC
 
 import re
+import zlib
+from os import fstat
+from csv import reader
+from codecs import iterdecode
+from itertools import chain
+from zipfile import ZipFile, BadZipFile
+from tempfile import SpooledTemporaryFile
+from mmap import mmap, ACCESS_READ
 from abc import ABCMeta, abstractmethod
 from blacklistparser.core import Exceptions, Regex
 
+# bytes read from a stream at a time
+CHUNK_SIZE = 64 * 1024
+# zip archives larger than this are spooled to disk
+ZIP_SPOOL_SIZE = 16 * 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+
 class BaseParser(metaclass=ABCMeta):
+    # bytes pattern and group used by extract_mapped
+    MAPPED_PATTERN = None
+    MAPPED_GROUP = 0
 
     def __init__(self, data):
         self.origin_data = data
         self.results = self.extract_data(self.origin_data)
 
-    @abstractmethod
     @staticmethod
+    @abstractmethod
     def extract_data(data):
         pass
 
+    @classmethod
+    def extract_mapped(cls, buf):
+        '''
+        scan a bytes-like object (eg. an mmap of a local file) with the bytes
+        version of the parsers pattern, only the matched names are decoded
+        returns a list of str or raises Exceptions.NoMatchesFound
+        '''
+        group = cls.MAPPED_GROUP
+        matches = [m.group(group).decode('utf-8', 'replace')
+            for m in cls.MAPPED_PATTERN.finditer(buf)]
+        if matches:
+            return matches
+        raise Exceptions.NoMatchesFound('No matches found in buffer.')
+
+    @classmethod
+    def extract_stream(cls, lines):
+        '''
+        generator matching each bytes line against the bytes pattern, used
+        with split_lines to parse a page without holding all of it
+        '''
+        pattern = cls.MAPPED_PATTERN
+        group = cls.MAPPED_GROUP
+        prepare = cls.prepare_line
+        for line in lines:
+            match = pattern.match(prepare(line))
+            if match:
+                yield match.group(group).decode('utf-8', 'replace')
+
+    @staticmethod
+    def prepare_line(line):
+        '''
+        the bytes line as the pattern of extract_stream sees it
+        '''
+        return line.strip()
+
     @classmethod
     def type_helper(cls, data):
         try:
@@ -25,6 +78,9 @@ class BaseParser(metaclass=ABCMeta):
         return data
 
 class ABPParser(BaseParser):
+    MAPPED_PATTERN = Regex.ABP_DOMAIN_BYTES
+    MAPPED_GROUP = 1
+
     @staticmethod
     def extract_data(data):
         '''
@@ -37,7 +93,7 @@ class ABPParser(BaseParser):
         eg. ||google.com^$third-party
         '''
         # regex string for ABP domains in Regex.abp_domain
-        pattern = re.compile(Regex.ABP_DOMAIN, re.MULTILINE)
+        pattern = re.compile(Regex.ABP_DOMAIN.pattern, re.MULTILINE)
 
         # exclude third party rules
         #   if third_party is not True:
@@ -58,6 +114,9 @@ class ABPParser(BaseParser):
             raise Exceptions.NoMatchesFound("No ABP syntax domains found.")
 
 class NewlineParser(BaseParser):
+    MAPPED_PATTERN = Regex.NEWLINE_DOMAIN_BYTES
+    MAPPED_GROUP = 1
+
     @staticmethod
     def extract_data(data):
         '''
@@ -66,17 +125,20 @@ class NewlineParser(BaseParser):
         google.com
         wikipedia.org
         '''
-        pattern = re.compile(Regex.NEWLINE_DOMAIN, re.MULTILINE)
+        pattern = re.compile(Regex.NEWLINE_DOMAIN.pattern, re.MULTILINE)
         matches = re.findall(pattern, data)
         if matches:
-            return matches
+            # only the outer group holds the whole domain
+            return [match[0] for match in matches]
         else:
             raise Exceptions.NoMatchesFound("No newline formatted domains found.")
 
 class IpsetParser(BaseParser):
+    MAPPED_PATTERN = Regex.IPV4_ADDR_BYTES
+
     @staticmethod
     def extract_data(data):
-        pattern = re.compile(Regex.IPV4_ADDR, re.MULTILINE)
+        pattern = Regex.IPV4_ADDR
         matches = re.findall(pattern, data)
 
         if matches:
@@ -88,24 +150,350 @@ def format_detector(data):
     '''
     Automatic detection of data type. Returns either a string naming the content
     type or raises a BadDataType exception
-    Currently supported types and return values are below.
+    The lines are classified once by MixedParser and the format of the most
+    common class wins, ties go to the first below.
     supported, return_value
         - adblock plus filter format, 'adblock'
+        - hosts file, 'hosts'
         - domain per line, 'newline'
+        - ip address or network per line, 'ipset'
+    '''
+    counts = MixedParser.classify(data.encode('utf-8').splitlines())
+    detected = max(DETECTED_FORMATS, key=lambda item: counts[item[0]])
+    if counts[detected[0]]:
+        return detected[1]
+    raise Exceptions.IncorrectDataType('Unable to detect format of input data.')
+
+class HostsParser(BaseParser):
     '''
-    # test adblock plus filter format
+    /etc/hosts style lists, every name after the address is extracted
+    eg. 0.0.0.0 example.com
+    eg. 127.0.0.1 example.com www.example.com # comment
+    '''
+    MAPPED_PATTERN = Regex.HOSTS_LINE_BYTES
+    MAPPED_GROUP = 1
+    # names found in the stock hosts file of most systems
+    LOCAL_NAMES = frozenset((b'localhost', b'localhost.localdomain',
+        b'local', b'broadcasthost', b'ip6-localhost', b'ip6-loopback'))
+
+    @classmethod
+    def _names(cls, matches):
+        for match in matches:
+            for name in match.group(cls.MAPPED_GROUP).split():
+                if name not in cls.LOCAL_NAMES:
+                    yield name.decode('utf-8', 'replace')
+
+    @classmethod
+    def extract_data(cls, data):
+        return cls.extract_mapped(data.encode('utf-8'))
+
+    @classmethod
+    def extract_mapped(cls, buf):
+        matches = list(cls._names(cls.MAPPED_PATTERN.finditer(buf)))
+        if matches:
+            return matches
+        raise Exceptions.NoMatchesFound('No hosts file entries found.')
+
+    @classmethod
+    def extract_stream(cls, lines):
+        matches = (cls.MAPPED_PATTERN.match(line) for line in lines)
+        return cls._names(match for match in matches if match)
+
+class MixedParser(BaseParser):
+    '''
+    feeds mixing ABP rules, hosts entries, bare domains, addresses and
+    comments, each line is classified by its first byte and only the
+    extractor for that class runs so the page is read once whatever it holds
+    yields (base_type, name) tuples where base_type is 'domain' or 'ip'
+    eg. ||example.com^ gives ('domain', 'example.com')
+    eg. 0.0.0.0 example.com gives ('domain', 'example.com')
+    eg. 10.0.0.0/8 gives ('ip', '10.0.0.0/8')
+    names are yielded as written, Data.DataList makes them canonical
+    '''
+    # every line class counted by extract_stream
+    CLASSES = ('blank', 'comment', 'abp', 'abp_other', 'hosts', 'ip',
+        'domain', 'unknown')
+    # first byte: what the line can be, anything else is unknown
+    DISPATCH = dict.fromkeys(b'![#', 'comment')
+    DISPATCH.update(dict.fromkeys(b'|', 'abp'))
+    # @@ exception rules are never blocked names
+    DISPATCH.update(dict.fromkeys(b'@', 'abp_other'))
+    DISPATCH.update(dict.fromkeys(b'0123456789:', 'numeric'))
+    DISPATCH.update(dict.fromkeys(b'abcdefghijklmnopqrstuvwxyz'
+        + b'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'name'))
+    # utf-8 lead and continuation bytes start IDNs
+    DISPATCH.update(dict.fromkeys(range(0x80, 0x100), 'name'))
+    # the bytes of an address or CIDR block
+    ADDR_BYTES = b'0123456789./'
+
+    @classmethod
+    def extract_stream(cls, lines, counts=None):
+        '''
+        generator of (base_type, name) from bytes lines, counts (a dict) is
+        given the number of lines of each of CLASSES
+        '''
+        if counts is None:
+            counts = {}
+        for key in cls.CLASSES:
+            counts.setdefault(key, 0)
+        dispatch = cls.DISPATCH.get
+        abp_match = Regex.ABP_DOMAIN_BYTES.match
+        domain_match = Regex.NEWLINE_DOMAIN_BYTES.match
+        local_names = HostsParser.LOCAL_NAMES
+        addr_bytes = cls.ADDR_BYTES
+        for line in lines:
+            line = line.strip()
+            if not line:
+                counts['blank'] += 1
+                continue
+            kind = dispatch(line[0], 'unknown')
+            if kind == 'abp':
+                match = abp_match(line)
+                if match:
+                    counts['abp'] += 1
+                    yield 'domain', match.group(1).decode('utf-8', 'replace')
+                else:
+                    counts['abp_other'] += 1
+                continue
+            if kind != 'numeric' and kind != 'name':
+                counts[kind] += 1
+                continue
+            # trailing comments eg. 0.0.0.0 example.com # tracker
+            if b'#' in line:
+                line = line.partition(b'#')[0]
+            fields = line.split()
+            if len(fields) > 1:
+                # only hosts entries start with an address and have names
+                if kind == 'name':
+                    counts['unknown'] += 1
+                    continue
+                counts['hosts'] += 1
+                for name in fields[1:]:
+                    if name not in local_names:
+                        yield 'domain', name.decode('utf-8', 'replace')
+                continue
+            name = fields[0]
+            if kind == 'numeric' and not name.translate(None, addr_bytes):
+                counts['ip'] += 1
+                yield 'ip', name.decode('ascii')
+                continue
+            match = domain_match(name)
+            if match:
+                counts['domain'] += 1
+                yield 'domain', match.group(1).decode('utf-8', 'replace')
+            else:
+                counts['unknown'] += 1
+
+    @classmethod
+    def classify(cls, lines):
+        '''
+        count the lines of each class without keeping the names
+        returns a dict of class: lines
+        '''
+        counts = {}
+        for _ in cls.extract_stream(lines, counts):
+            pass
+        return counts
+
+    @classmethod
+    def extract_data(cls, data):
+        return cls.extract_mapped(data.encode('utf-8'))
+
+    @classmethod
+    def extract_mapped(cls, buf):
+        '''
+        returns a list of (base_type, name) or raises
+        Exceptions.NoMatchesFound
+        '''
+        if hasattr(buf, 'readline'):
+            lines = iter(buf.readline, b'')
+        else:
+            lines = buf.splitlines()
+        matches = list(cls.extract_stream(lines))
+        if matches:
+            return matches
+        raise Exceptions.NoMatchesFound('No domains or ip addresses found.')
+
+class CsvParser(BaseParser):
+    '''
+    comma separated threat feeds, names are taken from a single column
+    (0 by default) selected with a page format like csv:2
+    '''
+    DELIMITER = ','
+
+    @classmethod
+    def extract_data(cls, data, column=0):
+        return cls.extract_mapped(data.encode('utf-8'), column)
+
+    @classmethod
+    def extract_mapped(cls, buf, column=0):
+        # mmap objects can be read line by line without a copy
+        if hasattr(buf, 'readline'):
+            lines = iter(buf.readline, b'')
+        else:
+            lines = buf.splitlines()
+        matches = list(cls.extract_stream(lines, column))
+        if matches:
+            return matches
+        raise Exceptions.NoMatchesFound('No values found in column '
+            + str(column))
+
+    @classmethod
+    def extract_stream(cls, lines, column=0):
+        rows = reader(iterdecode(lines, 'utf-8', 'replace'),
+            delimiter=cls.DELIMITER)
+        for row in rows:
+            if len(row) > column:
+                value = row[column].strip()
+                if value:
+                    yield value
+
+class TsvParser(CsvParser):
+    '''
+    tab separated version of CsvParser
+    '''
+    DELIMITER = '\t'
+
+def read_chunks(stream, size=None):
+    '''
+    generator reading a binary file object in chunks of size bytes
+    (CHUNK_SIZE by default)
+    '''
+    size = size or CHUNK_SIZE
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+def _gunzip(chunks):
+    # wbits 32 + 15 auto detects gzip or zlib headers
+    decomp = zlib.decompressobj(47)
     try:
-        ABPParser.extract_data(data)
-        return 'adblock'
-    except Exceptions.NoMatchesFound:
-        pass
-    # test newline format
+        for chunk in chunks:
+            while chunk:
+                # gzip files may hold several concatenated members
+                if decomp.eof:
+                    decomp = zlib.decompressobj(47)
+                yield decomp.decompress(chunk)
+                chunk = decomp.unused_data
+        yield decomp.flush()
+    except zlib.error as err:
+        raise Exceptions.BadFileType('Failed to decompress gzip: ' + str(err))
+
+def _unzip(chunks):
+    # the zip directory is at the end of the file so it must be seekable,
+    # small archives stay in memory and larger ones spill to disk
+    with SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE) as spool:
+        for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            with ZipFile(spool) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    with archive.open(info) as member:
+                        yield from read_chunks(member)
+                    # members may not end with a newline
+                    yield b'\n'
+        except (BadZipFile, zlib.error) as err:
+            raise Exceptions.BadFileType('Failed to decompress zip: ' + str(err))
+
+def decompress_chunks(stream):
+    '''
+    generator of decompressed chunks from a binary file object, gzip and zip
+    are detected by their magic bytes anything else is passed through
+    '''
+    chunks = read_chunks(stream)
+    first = next(chunks, b'')
+    chunks = chain((first,), chunks)
+    if first.startswith(GZIP_MAGIC):
+        return _gunzip(chunks)
+    if first.startswith(ZIP_MAGIC):
+        return _unzip(chunks)
+    return chunks
+
+def split_lines(chunks):
+    '''
+    generator splitting a stream of bytes chunks into bytes lines
+    '''
+    tail = b''
+    for chunk in chunks:
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+def split_format(page_format):
+    '''
+    split a source page format into a SHORTNAME and an optional column
+    eg. 'csv:2' returns ('csv', 2) and 'hosts' returns ('hosts', None)
+    '''
+    shortname, sep, column = str(page_format).partition(':')
+    if shortname not in SHORTNAME:
+        errmsg = 'data type ' + str(shortname) + ' not supported'
+        raise Exceptions.IncorrectDataType(errmsg)
+    if not sep:
+        return shortname, None
+    if not issubclass(SHORTNAME[shortname], CsvParser):
+        errmsg = 'data type ' + str(shortname) + ' does not take a column'
+        raise Exceptions.IncorrectDataType(errmsg)
     try:
-        NewlineParser.extract_data(data)
-        return 'newline'
-    except Exceptions.NoMatchesFound:
-        pass
+        column = int(column)
+        assert column >= 0
+    except (ValueError, AssertionError):
+        errmsg = 'column must be a positive integer not ' + str(column)
+        raise Exceptions.IncorrectDataType(errmsg)
+    return shortname, column
 
-    raise Exceptions.IncorrectDataType('Unable to detect format of input data.')
+def extract_stream(stream, page_format, counts=None):
+    '''
+    extract data from a binary file object (eg. a http response) using the
+    parser for page_format, the stream is decompressed and parsed
+    incrementally so the whole page is never held in memory
+    counts (a dict) is given the line classes of a mixed page
+    returns a generator of str, or of (base_type, name) for mixed pages
+    '''
+    shortname, column = split_format(page_format)
+    lines = split_lines(decompress_chunks(stream))
+    parser = SHORTNAME[shortname]
+    if column is not None:
+        return parser.extract_stream(lines, column)
+    if issubclass(parser, MixedParser):
+        return parser.extract_stream(lines, counts)
+    return parser.extract_stream(lines)
+
+def parse_file(pathname, shortname):
+    '''
+    extract data from a local file using the SHORTNAME parser without reading
+    the whole file into a str, the file is mmap'd and scanned as bytes
+    returns a list of str or raises Exceptions.NoMatchesFound
+    '''
+    parser = SHORTNAME[shortname]
+    with open(pathname, 'rb') as data_file:
+        # mmap refuses to map empty files
+        if fstat(data_file.fileno()).st_size == 0:
+            raise Exceptions.NoMatchesFound('File ' + str(pathname) + ' is empty')
+        with mmap(data_file.fileno(), 0, access=ACCESS_READ) as buf:
+            return parser.extract_mapped(buf)
 
-SHORTNAME = {'adblock' : ABPParser, 'newline' : NewlineParser, 'ipset' : IpsetParser}
+SHORTNAME = {
+    'adblock' : ABPParser,
+    'newline' : NewlineParser,
+    'domain' : NewlineParser,
+    'ipset' : IpsetParser,
+    'ip' : IpsetParser,
+    'hosts' : HostsParser,
+    'csv' : CsvParser,
+    'csv_ip' : CsvParser,
+    'tsv' : TsvParser,
+    'tsv_ip' : TsvParser,
+    'mixed' : MixedParser}
+# line class of MixedParser: format_detector result, in order of preference
+DETECTED_FORMATS = (
+    ('abp', 'adblock'),
+    ('hosts', 'hosts'),
+    ('domain', 'newline'),
+    ('ip', 'ipset'))
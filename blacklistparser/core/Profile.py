@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+import sys
+import signal
+import threading
+from os import path
+from collections import Counter
+
+'''
+profiling for --profile, wraps the subcommand action
+- cprofile: deterministic profile, output is a pstats file
+- sample: wall clock stack sampling with SIGALRM, output is collapsed
+  stacks (one "frame;frame;frame count" line per stack) for flamegraph.pl
+  or speedscope, only the main thread (the one running the subcommand) is
+  sampled unless all_threads is set
+'''
+
+MODES = ('cprofile', 'sample')
+# seconds between samples in sample mode
+SAMPLE_INTERVAL = 0.005
+# a thread whose innermost frame is in one of these is waiting on a lock,
+# queue or event (eg. the log QueueListener or an idle writer)
+IDLE_FILES = (threading.__file__,)
+
+
+def _frame_name(code):
+    return (code.co_name + ' (' + path.basename(code.co_filename) + ':'
+        + str(code.co_firstlineno) + ')')
+
+
+class Sampler:
+    '''
+    collect the stack of the main thread each interval seconds of wall
+    time, with all_threads every thread that isn't waiting is sampled
+    '''
+    def __init__(self, interval=SAMPLE_INTERVAL, all_threads=False):
+        self.interval = interval
+        self.all_threads = all_threads
+        # tuple of frame names, root first: samples
+        self.stacks = Counter()
+        self.old_handler = None
+
+    def _sample(self, signum, frame):
+        frames = sys._current_frames()
+        if not self.all_threads:
+            # signal handlers run in the main thread
+            frames = {None : frame}
+        for thread_frame in frames.values():
+            if (thread_frame is not frame
+                    and thread_frame.f_code.co_filename in IDLE_FILES):
+                continue
+            stack = []
+            while thread_frame is not None:
+                # leave this handler out of its own samples
+                if thread_frame.f_code is not Sampler._sample.__code__:
+                    stack.append(_frame_name(thread_frame.f_code))
+                thread_frame = thread_frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+
+    def start(self):
+        self.old_handler = signal.signal(signal.SIGALRM, self._sample)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self.old_handler)
+
+    def collapsed(self):
+        '''
+        return the samples as collapsed stack lines
+        '''
+        return [';'.join(stack) + ' ' + str(count)
+            for stack, count in sorted(self.stacks.items())]
+
+    def top(self, limit):
+        '''
+        return up to limit (self samples, samples, frame name) tuples sorted
+        by self samples (the frame was running rather than waiting on a
+        call), samples counts each stack the frame appears in once
+        '''
+        total = Counter()
+        own = Counter()
+        for stack, count in self.stacks.items():
+            for name in set(stack):
+                total[name] += count
+            if stack:
+                own[stack[-1]] += count
+        return [(count, total[name], name)
+            for name, count in own.most_common(limit)]
+
+
+class Profiler:
+    def __init__(self, mode, logger, output=None, limit=20,
+            interval=SAMPLE_INTERVAL, all_threads=False):
+        '''
+        mode is one of MODES, output is an optional file to dump the
+        profile to and limit is how many hot functions are logged,
+        all_threads samples the other threads too
+        '''
+        if mode not in MODES:
+            raise ValueError('profile mode must be one of ' + str(MODES))
+        self.mode = mode
+        self.log = logger
+        self.output = output
+        self.limit = limit
+        self.interval = interval
+        self.all_threads = all_threads
+
+    def run(self, func, *args):
+        '''
+        call func under the profiler, the profile is written and logged
+        even if func raises
+        '''
+        if self.mode == 'cprofile':
+            from cProfile import Profile
+            profile = Profile()
+            try:
+                return profile.runcall(func, *args)
+            finally:
+                self._report_cprofile(profile)
+        sampler = Sampler(self.interval, self.all_threads)
+        sampler.start()
+        try:
+            return func(*args)
+        finally:
+            sampler.stop()
+            self._report_sampler(sampler)
+
+    def _report_cprofile(self, profile):
+        from pstats import Stats
+        stats = Stats(profile)
+        if self.output is not None:
+            stats.dump_stats(self.output)
+            self.log.info('Wrote cProfile stats to ' + str(self.output))
+        # (file, line, func): (prim calls, calls, self, cumulative, callers)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2],
+            reverse=True)
+        self.log.info('profile top %d by self time', self.limit)
+        for (filename, line, func), (_, calls, own, cumulative, _) in \
+                rows[:self.limit]:
+            self.log.info('profile self=%.4fs cumulative=%.4fs calls=%d %s',
+                own, cumulative, calls,
+                func + ' (' + path.basename(filename) + ':' + str(line) + ')')
+
+    def _report_sampler(self, sampler):
+        if self.output is not None:
+            with open(self.output, 'w') as out_file:
+                for line in sampler.collapsed():
+                    out_file.write(line + '\n')
+            self.log.info('Wrote collapsed stacks to ' + str(self.output))
+        self.log.info('profile top %d by self samples every %.3fs',
+            self.limit, self.interval)
+        for own, samples, name in sampler.top(self.limit):
+            self.log.info('profile self=%d samples=%d %s', own, samples, name)
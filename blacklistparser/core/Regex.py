@@ -16,5 +16,19 @@ ABP_DOMAIN = re.compile(r'^(?:\|\|)(((?=[a-z0-9-]{1,63}\.)(xn--)?[a-z0-9]+(-[a-z
 ABP_DOMAIN_NOTHIRD = re.compile(r'^(?:\|\|)(((?=[a-z0-9-]{1,63}\.)(xn--)?[a-z0-9]+(-[a-z0-9]+)*\.)+[a-z]{2,63})(?:\^)$')
 ABP_VERSION = re.compile(r'^\[Adblock Plus 2\.0\]$')
 NEWLINE_DOMAIN = re.compile(r'^(((?=[a-z0-9-]{1,63}\.)(xn--)?[a-z0-9]+(-[a-z0-9]+)*\.)+[a-z]{2,63})$')
-IPV4_ADDR = re.compile(r'\b(?:\d|[1-9]\d|1\d\d|2[0-5]{2})\.(?:\d|[1-9]\d|1\d\d|2[0-5]{2})\.(?:\d|[1-9]\d|1\d\d|2[0-5]{2})\.(?:\d|[1-9]\d|1\d\d|2[0-5]{2})(?:/[1-9]|/1[0-9]|/2[0-4])?\b')
-IPV4_ADDR_2 = re.compile(r'^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)(?:/[1-9]|/1[0-9]|/2[0-4])?$')
+IPV4_ADDR = re.compile(r'\b(?:\d|[1-9]\d|1\d\d|2[0-5]{2})\.(?:\d|[1-9]\d|1\d\d|2[0-5]{2})\.(?:\d|[1-9]\d|1\d\d|2[0-5]{2})\.(?:\d|[1-9]\d|1\d\d|2[0-5]{2})(?:/[1-9]|/[12][0-9]|/3[0-2])?\b')
+IPV4_ADDR_2 = re.compile(r'^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)(?:/[1-9]|/[12][0-9]|/3[0-2])?$')
+
+# bytes patterns for scanning pages and mmap'd files, these are multiline so
+# ^ and $ match at each line of the buffer
+# the domain patterns only pick out candidate names, any case, a trailing dot
+# and utf-8 (IDN) labels get through to Canonical and the patterns above
+# check the canonical name
+_NAME_LABEL_BYTES = rb'(?:xn--)?[a-z0-9\x80-\xff]+(?:-[a-z0-9\x80-\xff]+)*'
+_NAME_BYTES = (rb'(?:' + _NAME_LABEL_BYTES + rb'\.)+'
+    + rb'(?:[a-z]{2,63}|xn--[a-z0-9-]+|[\x80-\xff][a-z0-9\x80-\xff-]*)')
+ABP_DOMAIN_BYTES = re.compile(rb'^\|\|(' + _NAME_BYTES + rb')\^(?:\$third-party)?$', re.MULTILINE | re.IGNORECASE)
+NEWLINE_DOMAIN_BYTES = re.compile(rb'^(' + _NAME_BYTES + rb'\.?)$', re.MULTILINE | re.IGNORECASE)
+IPV4_ADDR_BYTES = re.compile(IPV4_ADDR.pattern.encode('ascii'))
+# hosts file lines, group 1 holds every name after the address
+HOSTS_LINE_BYTES = re.compile(rb'^[ \t]*(?:[0-9.]+|[0-9A-Fa-f.]*:[0-9A-Fa-f.:]*)[ \t]+([^#\r\n]+)', re.MULTILINE)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+from random import Random
+from hashlib import blake2b
+
+'''
+adaptive polling for update, each source starts at its configured interval
+which shrinks while the feed keeps changing and grows while it doesn't
+(304 Not Modified or the same names as last time), bounded by factors of
+the configured interval. Jitter spreads sources with the same interval so
+they aren't all fetched in the same run
+'''
+
+# interval multipliers after a changed and an unchanged fetch
+SHRINK = 0.5
+GROW = 1.5
+# bounds as factors of the configured interval
+MIN_FACTOR = 0.25
+MAX_FACTOR = 8.0
+# +/- fraction of the interval added at random to each poll time
+JITTER = 0.1
+
+
+def content_hash(lines):
+    '''
+    hash of a page's names in order, equal hashes mean nothing changed
+    '''
+    digest = blake2b(digest_size=16)
+    for line in lines:
+        digest.update(line.encode('utf-8', 'replace'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class Policy:
+    def __init__(self, min_factor=MIN_FACTOR, max_factor=MAX_FACTOR,
+            jitter=JITTER, rand=None):
+        '''
+        min_factor and max_factor bound the interval relative to the
+        source's configured interval, jitter is a fraction of the interval
+        '''
+        if not 0 < min_factor <= max_factor:
+            raise ValueError('interval factors must satisfy '
+                + '0 < min <= max')
+        if not 0 <= jitter < 1:
+            raise ValueError('jitter must be between 0 and 1')
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.jitter = jitter
+        self.rand = rand or Random()
+
+    def next_interval(self, interval, base, changed):
+        '''
+        return the interval after a fetch, interval is the current one (None
+        for a source polled for the first time, which keeps base as there
+        is nothing to compare with) and base the configured one
+        '''
+        if interval is None:
+            return base
+        interval *= SHRINK if changed else GROW
+        return min(max(interval, base * self.min_factor),
+            base * self.max_factor)
+
+    def next_update(self, now, interval):
+        '''
+        the time of the next poll, interval from now with jitter
+        '''
+        return now + interval * (1 + self.rand.uniform(-self.jitter,
+            self.jitter))
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+import os
+import stat
+from os import path
+from hashlib import blake2b
+from threading import Lock
+from urllib.parse import urlsplit, unquote
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+serve the files written by output over http so downstream hosts can poll
+them without a separate web server
+- every response has a strong ETag (a hash of the bytes sent) and a
+  Last-Modified, If-None-Match and If-Modified-Since get a 304 without a body
+- clients sending Accept-Encoding: gzip get the OUTPUT.gz written by
+  output -z gz when it is at least as new as OUTPUT
+- bodies go straight from the file to the socket with sendfile
+
+server = Serve.Server(('127.0.0.1', 8080), '/var/lib/blacklists', log)
+server.serve_forever()
+
+hidden files (the temporary files of output) and anything outside root are
+never served, outputs are renamed into place so a file opened for a request
+is always complete
+'''
+
+# bytes read at a time when hashing a file for its ETag
+CHUNK_SIZE = 1024 * 1024
+# files whose ETags are remembered
+ETAG_CACHE_SIZE = 1024
+# every counter of Server.counts
+COUNTERS = ('requests', 'ok', 'not_modified', 'gzip', 'not_found', 'bytes')
+# suffix: Content-Type, anything else is served as text
+CONTENT_TYPES = {
+    '.gz' : 'application/gzip',
+    '.zst' : 'application/zstd',
+    '.snap' : 'application/octet-stream',
+    '.bloom' : 'application/octet-stream'}
+TEXT_TYPE = 'text/plain; charset=utf-8'
+
+
+def file_etag(data_file):
+    '''
+    strong ETag of a binary file object, read from the start with pread so
+    the file position is left alone
+    '''
+    digest = blake2b(digest_size=16)
+    offset = 0
+    while True:
+        chunk = os.pread(data_file.fileno(), CHUNK_SIZE, offset)
+        if not chunk:
+            break
+        digest.update(chunk)
+        offset += len(chunk)
+    return '"' + digest.hexdigest() + '"'
+
+
+def etag_matches(header, etag):
+    '''
+    True if the If-None-Match header names etag, the comparison is weak as
+    RFC 7232 asks for If-None-Match
+    '''
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.startswith('W/') and tag[2:] == etag or tag == etag:
+            return True
+    return False
+
+
+def accepts_gzip(header):
+    '''
+    True if an Accept-Encoding header allows gzip
+    '''
+    for coding in header.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class ETags:
+    '''
+    ETags of files keyed by path, a file is hashed again when its inode,
+    size or mtime change
+    '''
+    def __init__(self, size=ETAG_CACHE_SIZE):
+        self.size = size
+        self.tags = {}
+        self.lock = Lock()
+
+    def get(self, pathname, data_file, stats):
+        key = (stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns)
+        with self.lock:
+            cached = self.tags.get(pathname)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        etag = file_etag(data_file)
+        with self.lock:
+            if len(self.tags) >= self.size:
+                self.tags.clear()
+            self.tags[pathname] = (key, etag)
+        return etag
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root, log=None):
+        '''
+        serve the files under root on address (host, port), log is a
+        logging.Logger for the requests
+        '''
+        self.root = path.realpath(root)
+        self.log = log
+        self.etags = ETags()
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.lock = Lock()
+        super().__init__(address, Handler)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+    def resolve(self, url_path):
+        '''
+        file path of a request path or None if it isn't one we serve
+        '''
+        parts = unquote(urlsplit(url_path).path).split('/')
+        if any(part.startswith('.') for part in parts) or '\0' in url_path:
+            return None
+        pathname = path.realpath(path.join(self.root, *parts))
+        if not pathname.startswith(self.root + os.sep):
+            return None
+        return pathname
+
+
+def _open_regular(pathname):
+    # (file, stat) of a regular file or None
+    try:
+        data_file = open(pathname, 'rb')
+    except OSError:
+        return None
+    stats = os.fstat(data_file.fileno())
+    if not stat.S_ISREG(stats.st_mode):
+        data_file.close()
+        return None
+    return data_file, stats
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'blacklistparser'
+    # keep connections open between polls
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+    def log_message(self, format, *args):
+        if self.server.log is not None:
+            self.server.log.debug('%s %s', self.address_string(),
+                format % args)
+
+    def _serve(self, body):
+        server = self.server
+        server.count('requests')
+        pathname = server.resolve(self.path)
+        plain = gzipped = None
+        if pathname is not None:
+            plain = _open_regular(pathname)
+            if (not pathname.endswith('.gz')
+                    and accepts_gzip(self.headers.get('Accept-Encoding', ''))):
+                gzipped = _open_regular(pathname + '.gz')
+        if plain and gzipped and gzipped[1].st_mtime_ns < plain[1].st_mtime_ns:
+            # output hasn't replaced the .gz yet
+            gzipped[0].close()
+            gzipped = None
+        if gzipped and plain:
+            plain[0].close()
+        chosen = gzipped or plain
+        if chosen is None:
+            server.count('not_found')
+            self.send_error(404)
+            return
+        data_file, stats = chosen
+        with data_file:
+            etag = server.etags.get(data_file.name, data_file, stats)
+            if self._not_modified(etag, stats):
+                server.count('not_modified')
+                self.send_response(304)
+                self._send_validators(etag, stats, pathname)
+                self.end_headers()
+                return
+            self.send_response(200)
+            if gzipped:
+                server.count('gzip')
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Type', TEXT_TYPE)
+            else:
+                self.send_header('Content-Type', CONTENT_TYPES.get(
+                    path.splitext(pathname)[1], TEXT_TYPE))
+            self.send_header('Content-Length', str(stats.st_size))
+            self._send_validators(etag, stats, pathname)
+            self.end_headers()
+            server.count('ok')
+            if body and stats.st_size:
+                self.wfile.flush()
+                # os.sendfile where the platform has it
+                sent = self.connection.sendfile(data_file, 0, stats.st_size)
+                server.count('bytes', sent)
+
+    def _send_validators(self, etag, stats, pathname):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(stats.st_mtime,
+            usegmt=True))
+        self.send_header('Cache-Control', 'no-cache')
+        if not pathname.endswith('.gz'):
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def _not_modified(self, etag, stats):
+        # If-None-Match wins when both are sent
+        header = self.headers.get('If-None-Match')
+        if header is not None:
+            return etag_matches(header, etag)
+        header = self.headers.get('If-Modified-Since')
+        if header is None:
+            return False
+        try:
+            since = parsedate_to_datetime(header)
+        except (TypeError, ValueError, IndexError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return int(stats.st_mtime) <= since.timestamp()
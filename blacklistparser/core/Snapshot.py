@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+import mmap
+from struct import Struct
+from zlib import crc32
+
+from blacklistparser.core import Exceptions, Data, IPv4
+
+'''
+read only binary snapshot of the blacklist for consumers that want to mmap
+a file and look names up instead of parsing a text list on every reload
+
+all integers are little endian
+header (HEADER below)
+    magic b'BLSNAP\\0\\0', version u16, flags u16, ranges u32, domains u32,
+    ranges offset u64, domain offsets offset u64, names offset u64,
+    names size u64, crc32 u32 of everything after the header
+ranges
+    sorted merged inclusive (start u32, end u32) ipv4 ranges
+domain offsets
+    domains + 1 u32 offsets into names, domain i is names[off[i]:off[i+1]]
+names
+    the lowercase ascii domains sorted bytewise and concatenated
+'''
+
+MAGIC = b'BLSNAP\0\0'
+VERSION = 1
+HEADER = Struct('<8sHHIIQQQQI')
+RANGE = Struct('<II')
+OFFSET = Struct('<I')
+# sections start on 8 byte boundaries
+ALIGN = 8
+
+
+def _pad(length):
+    return -length % ALIGN
+
+
+class Sink:
+    '''
+    collect ip and domain rows from the output action and write a snapshot
+    when closed, same interface as Data.Sink
+    '''
+    def __init__(self, pathname, out_format='snapshot'):
+        self.pathname = pathname
+        self.out_format = out_format
+        self.addrs = []
+        self.names = set()
+        self.rows = 0
+        self.bytes = 0
+
+    def write(self, name, data_format):
+        if data_format == 'ip':
+            self.addrs.append(name)
+        else:
+            self.names.add(name.lower().encode('ascii'))
+        self.rows += 1
+
+    def close(self):
+        from tempfile import NamedTemporaryFile
+        from os import path
+        with NamedTemporaryFile('wb', delete=False,
+                dir=path.dirname(path.abspath(self.pathname)),
+                prefix='.' + path.basename(self.pathname) + '.') as tmp:
+            try:
+                ranges = IPv4.merge_names(self.addrs)
+                self.bytes = write(tmp, ranges, self.names)
+            except BaseException:
+                tmp.close()
+                Data.remove_quietly(tmp.name)
+                raise
+        Data.install(tmp.name, self.pathname)
+
+    def abort(self):
+        self.addrs = []
+        self.names = set()
+
+
+def write(out_file, ranges, names):
+    '''
+    write a snapshot of (start, end) ipv4 ranges and domain bytes to the
+    binary file out_file, returns the number of bytes written
+    ranges must be sorted and merged eg. by IPv4.merge_arrays
+    '''
+    names = sorted(set(names))
+    ranges_offset = HEADER.size + _pad(HEADER.size)
+    offsets_offset = ranges_offset + RANGE.size * len(ranges)
+    offsets_offset += _pad(offsets_offset)
+    names_offset = offsets_offset + OFFSET.size * (len(names) + 1)
+    names_offset += _pad(names_offset)
+
+    sections = []
+    sections.append(b'\0' * _pad(HEADER.size))
+    sections.append(b''.join(RANGE.pack(start, end) for start, end in ranges))
+    sections.append(b'\0' * (offsets_offset - ranges_offset
+        - RANGE.size * len(ranges)))
+    offsets = [0]
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+    if offsets[-1] > 0xffffffff:
+        raise Exceptions.IncorrectDataType('too many domains for a snapshot')
+    sections.append(b''.join(OFFSET.pack(offset) for offset in offsets))
+    sections.append(b'\0' * (names_offset - offsets_offset
+        - OFFSET.size * len(offsets)))
+    sections.append(b''.join(names))
+
+    checksum = 0
+    for section in sections:
+        checksum = crc32(section, checksum)
+    header = HEADER.pack(MAGIC, VERSION, 0, len(ranges), len(names),
+        ranges_offset, offsets_offset, names_offset, offsets[-1], checksum)
+    written = out_file.write(header)
+    for section in sections:
+        written += out_file.write(section)
+    return written
+
+
+class Reader:
+    '''
+    query a snapshot through mmap, lookups are binary searches over the
+    mapped file so nothing is loaded into python objects up front
+    with Snapshot.Reader('/var/lib/bl.snap') as snap:
+        snap.contains_ip('1.2.3.4')
+        snap.contains_domain('ads.example.com')
+    '''
+    def __init__(self, pathname, verify=True):
+        '''
+        raises Exceptions.BadFileType if the file isn't a snapshot, verify
+        checks the crc32 which reads the whole file once
+        '''
+        with open(pathname, 'rb') as snap_file:
+            try:
+                self.buf = mmap.mmap(snap_file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+            except ValueError:
+                raise Exceptions.BadFileType('snapshot is empty')
+        try:
+            self._read_header(verify)
+        except Exceptions.BadFileType:
+            self.close()
+            raise
+
+    def _read_header(self, verify):
+        if len(self.buf) < HEADER.size:
+            raise Exceptions.BadFileType('snapshot is truncated')
+        (magic, version, _, self.range_count, self.domain_count,
+            self.ranges_offset, self.offsets_offset, self.names_offset,
+            names_size, checksum) = HEADER.unpack_from(self.buf)
+        if magic != MAGIC:
+            raise Exceptions.BadFileType('not a blacklistparser snapshot')
+        if version > VERSION:
+            raise Exceptions.BadFileType('snapshot version ' + str(version)
+                + ' is newer than supported version ' + str(VERSION))
+        if (self.ranges_offset + RANGE.size * self.range_count
+                > self.offsets_offset
+                or self.offsets_offset + OFFSET.size * (self.domain_count + 1)
+                > self.names_offset
+                or self.names_offset + names_size != len(self.buf)):
+            raise Exceptions.BadFileType('snapshot is truncated')
+        if verify and crc32(memoryview(self.buf)[HEADER.size:]) != checksum:
+            raise Exceptions.BadFileType('snapshot checksum mismatch')
+
+    def close(self):
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _range(self, index):
+        return RANGE.unpack_from(self.buf,
+            self.ranges_offset + RANGE.size * index)
+
+    def _name(self, index):
+        start, end = (OFFSET.unpack_from(self.buf,
+            self.offsets_offset + OFFSET.size * (index + i))[0]
+            for i in (0, 1))
+        return self.buf[self.names_offset + start:self.names_offset + end]
+
+    def contains_ip(self, addr):
+        '''
+        True if the address is inside any range, addr is a dotted quad
+        '''
+        value = IPv4.to_int(addr)
+        # find the last range starting at or before value
+        low, high = 0, self.range_count
+        while low < high:
+            mid = (low + high) // 2
+            if self._range(mid)[0] <= value:
+                low = mid + 1
+            else:
+                high = mid
+        return low > 0 and self._range(low - 1)[1] >= value
+
+    def contains_domain(self, name, parents=True):
+        '''
+        True if name is in the snapshot, with parents a name is also
+        matched when one of its parent domains is eg. a.example.com
+        '''
+        key = name.lower().rstrip('.').encode('ascii', 'replace')
+        while True:
+            if self._find_name(key):
+                return True
+            if not parents or b'.' not in key:
+                return False
+            key = key.partition(b'.')[2]
+
+    def _find_name(self, key):
+        low, high = 0, self.domain_count
+        while low < high:
+            mid = (low + high) // 2
+            found = self._name(mid)
+            if found == key:
+                return True
+            if found < key:
+                low = mid + 1
+            else:
+                high = mid
+        return False
+
+    def ranges(self):
+        '''
+        iterate over the (start, end) ranges
+        '''
+        for index in range(self.range_count):
+            yield self._range(index)
+
+    def domains(self):
+        '''
+        iterate over the domains as str
+        '''
+        for index in range(self.domain_count):
+            yield self._name(index).decode('ascii')
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+from abc import ABCMeta, abstractmethod
+
+'''
+the storage interface used by App and Writer, every engine implements the
+abstract methods below with the semantics of Database.Manager
+- Database.Manager keeps everything in sqlite3 files
+- Memory.Manager keeps everything in dicts and sorted lists for runs that
+  don't need to keep anything eg. tests and CI
+
+db = Storage.open_backend('memory')
+db.add_source_url('https://example.com/list.txt', 'domain', 3600)
+db.bulk_add(['example.com'], 'domain', 'https://example.com/list.txt')
+db.commit()
+
+writes are transactional, nothing is kept until commit() and rollback()
+drops everything since the last commit
+'''
+
+# engine name: (module, class)
+BACKENDS = {
+    'sqlite' : ('Database', 'Manager'),
+    'memory' : ('Memory', 'Manager')}
+
+
+def open_backend(engine, db_path=None):
+    '''
+    return a storage object for engine (a key of BACKENDS), db_path is the
+    database file of engines that have one
+    '''
+    from importlib import import_module
+    from blacklistparser.core import Exceptions
+    if engine not in BACKENDS:
+        raise Exceptions.DatabaseError('Unknown storage engine '
+            + str(engine))
+    module, name = BACKENDS[engine]
+    backend = getattr(import_module('blacklistparser.core.' + module), name)
+    if engine == 'memory':
+        return backend()
+    return backend(db_path)
+
+def sync_key(source):
+    '''
+    the (page_format, timeout, membership) of a source as sync_sources
+    compares them, groups are compared as text because sqlite reads a
+    group of '5' back as 5
+    '''
+    page_format, timeout, membership = source
+    if membership is not None:
+        membership = str(membership)
+    return page_format, timeout, membership
+
+
+class Backend(metaclass=ABCMeta):
+    # engines that split data across files list them here, see Database
+    shards = []
+
+    ## transactions
+    @abstractmethod
+    def begin(self):
+        '''
+        start a transaction explicitly, writes start one implicitly
+        '''
+
+    @abstractmethod
+    def commit(self):
+        pass
+
+    @abstractmethod
+    def rollback(self):
+        pass
+
+    @abstractmethod
+    def savepoint(self, name):
+        '''
+        context manager, writes in the with block are rolled back alone if
+        it raises
+        '''
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    ## sources
+    @abstractmethod
+    def add_source_url(self, url, dataformat, timeout):
+        pass
+
+    @abstractmethod
+    def change_group(self, group, source_url):
+        pass
+
+    @abstractmethod
+    def test_source_url(self, url):
+        '''
+        True if url is a source, raises Exceptions.NoMatchesFound if not
+        '''
+
+    @abstractmethod
+    def delete_source_url(self, url):
+        pass
+
+    @abstractmethod
+    def pull_sources(self):
+        '''
+        dict of url: (page_format, timeout, membership)
+        '''
+
+    @abstractmethod
+    def sync_sources(self, sources, prune=True):
+        pass
+
+    @abstractmethod
+    def pull_active_source_urls(self):
+        '''
+        list of dicts for the sources due an update, raises
+        Exceptions.NoMatchesFound when there are none
+        '''
+
+    @abstractmethod
+    def schedule_source(self, url, interval, next_update, changed,
+            content_hash=None, name_count=None, name_delta=None):
+        pass
+
+    @abstractmethod
+    def update_last_modified(self, url, last_modified):
+        pass
+
+    @abstractmethod
+    def touch_source_url(self, url):
+        pass
+
+    ## names
+    @abstractmethod
+    def bulk_add(self, data_lst, data_type, source_url):
+        pass
+
+    @abstractmethod
+    def add_element(self, data, data_type, source_url, whitelist=False):
+        pass
+
+    @abstractmethod
+    def remove_element(self, data, source_url=None, whitelist=False):
+        pass
+
+    @abstractmethod
+    def refresh_source(self, url):
+        '''
+        mark every name from url as seen now, returns the rows touched
+        '''
+
+    @abstractmethod
+    def sync_exceptions(self, exceptions, prune=True):
+        pass
+
+    @abstractmethod
+    def stream_names(self, timeout, data_formats, groups=None,
+            exceptions=True):
+        '''
+        iterable of (name, data_format, group, last_seen) rows
+        '''
+
+    @abstractmethod
+    def lookup_ip(self, addr, timeout=None, exceptions=True):
+        pass
+
+    @abstractmethod
+    def merged_ip_ranges(self, timeout, exceptions=True):
+        pass
+
+    @abstractmethod
+    def overlap_stats(self):
+        pass
+
+    ## built on the methods above, engines may replace them
+    def partition(self, names, data_format):
+        '''
+        split names by shard, everything is under None without shards
+        '''
+        return {None : names}
+
+    def contains_ip(self, addr, timeout=None, exceptions=True):
+        return bool(self.lookup_ip(addr, timeout, exceptions))
+
+    def pull_names_2(self, timeout, data_format, exceptions=True):
+        return [(name,) for name, _, _, _ in
+            self.stream_names(timeout, [data_format], None, exceptions)]
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Liam Nolan (c) 2019 ISC
+# Full licence terms located in LICENCE file
+
+from queue import Queue, Empty
+from threading import Thread
+from time import perf_counter
+
+from blacklistparser.core import Exceptions
+
+'''
+single writer for the database, a thread that opens its own
+Storage.Backend with open_db (sqlite3 connections belong to the thread
+that made them) and runs write jobs taken from a bounded queue
+
+writer = Writer.Writer(partial(Storage.open_backend, 'sqlite', '/tmp/bl.db'),
+    log, rows_per_commit=50000)
+writer.start()
+writer.submit(url, len(names), lambda db: db.bulk_add(names, 'domain', url))
+writer.close()
+
+- submit() blocks while the queue is full so producers slow down to the
+  pace of the writer instead of holding every parsed feed in memory
+- consecutive jobs share a transaction until rows_per_commit rows have
+  been written or the queue runs dry, each job runs in its own savepoint
+  so a failing job rolls back alone
+- once a job for a label fails later jobs with that label are skipped, so
+  a source that fails part way isn't marked as updated
+'''
+
+# jobs waiting in the queue before submit() blocks
+QUEUE_SIZE = 8
+
+
+class Writer:
+    def __init__(self, open_db, logger, rows_per_commit=50000,
+            queue_size=QUEUE_SIZE, name='writer'):
+        '''
+        open_db is called in the writer thread and returns the backend the
+        jobs write to, the writer closes it when it stops
+        '''
+        self.open_db = open_db
+        self.name = name
+        self.log = logger
+        self.rows_per_commit = rows_per_commit
+        self.queue = Queue(maxsize=queue_size)
+        self.thread = Thread(target=self._run,
+            name='blacklistparser-' + name.replace(' ', '-'), daemon=True)
+        # labels with a failed job
+        self.failed = set()
+        # an exception that stopped the writer, submit() and close() raise
+        # Exceptions.DatabaseError from it
+        self.error = None
+        self.stats = {
+            'jobs' : 0,
+            'skipped' : 0,
+            'rows' : 0,
+            'commits' : 0,
+            # queue depth seen by submit()
+            'depth_max' : 0,
+            'depth_total' : 0,
+            # seconds producers spent blocked on a full queue
+            'blocked' : 0.0,
+            # seconds from submit() until the job's transaction committed
+            'latency_max' : 0.0,
+            'latency_total' : 0.0,
+            # label: [seconds running jobs, rows, jobs]
+            'labels' : {}}
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, label, rows, func, *args):
+        '''
+        queue func(db, *args) to run in the writer thread, func may also be
+        the name of a Storage.Backend method to call on db, label names the
+        source the job belongs to and rows is how many rows it writes
+        '''
+        if self.error is not None:
+            self._raise_error()
+        depth = self.queue.qsize()
+        self.stats['depth_max'] = max(self.stats['depth_max'], depth)
+        self.stats['depth_total'] += depth
+        start = perf_counter()
+        self.queue.put((label, rows, func, args, start))
+        self.stats['blocked'] += perf_counter() - start
+
+    def close(self):
+        '''
+        wait for every queued job to be written, raises
+        Exceptions.DatabaseError if an error stopped the writer
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            self._raise_error()
+
+    def _raise_error(self):
+        raise Exceptions.DatabaseError(self.name + ' stopped: '
+            + str(self.error)) from self.error
+
+    def _run(self):
+        try:
+            db = self.open_db()
+        except Exception as err:
+            self.error = err
+            self._drain()
+            return
+        try:
+            self._write_batches(db)
+        except Exception as err:
+            self.error = err
+            self._drain()
+        finally:
+            db.close()
+
+    def _drain(self):
+        # unblock producers after a fatal error, the jobs are dropped
+        while self.queue.get() is not None:
+            pass
+
+    def _write_batches(self, db):
+        done = False
+        while not done:
+            job = self.queue.get()
+            if job is None:
+                return
+            # one transaction for as many jobs as are ready, up to the limit
+            db.begin()
+            submitted = []
+            rows = 0
+            while job is not None:
+                rows += self._run_job(db, job)
+                submitted.append(job[4])
+                if rows >= self.rows_per_commit:
+                    break
+                try:
+                    job = self.queue.get_nowait()
+                except Empty:
+                    break
+            else:
+                done = True
+            db.commit()
+            now = perf_counter()
+            self.stats['commits'] += 1
+            for start in submitted:
+                self.stats['latency_total'] += now - start
+                self.stats['latency_max'] = max(self.stats['latency_max'],
+                    now - start)
+
+    def _run_job(self, db, job):
+        label, rows, func, args, _ = job
+        self.stats['jobs'] += 1
+        if label in self.failed:
+            self.stats['skipped'] += 1
+            return 0
+        start = perf_counter()
+        try:
+            with db.savepoint('job'):
+                if isinstance(func, str):
+                    getattr(db, func)(*args)
+                else:
+                    func(db, *args)
+        except Exception as err:
+            self.failed.add(label)
+            self.log.error('Failed to write %s, rolled back: %s', label, err)
+            return 0
+        total = self.stats['labels'].setdefault(label, [0.0, 0, 0])
+        total[0] += perf_counter() - start
+        total[1] += rows
+        total[2] += 1
+        self.stats['rows'] += rows
+        return rows
+
+    def report(self, metrics=None):
+        '''
+        log the queue and latency stats, metrics is an optional
+        Metrics.Recorder that gets a db_write stage per label
+        '''
+        stats = self.stats
+        jobs = max(stats['jobs'], 1)
+        self.log.info('%s: %d jobs (%d skipped), %d rows in %d commits, '
+            'queue depth max %d mean %.1f, producers blocked %.3fs, '
+            'write latency max %.3fs mean %.3fs', self.name,
+            stats['jobs'], stats['skipped'], stats['rows'], stats['commits'],
+            stats['depth_max'], stats['depth_total'] / jobs,
+            stats['blocked'], stats['latency_max'],
+            stats['latency_total'] / jobs)
+        if metrics is None:
+            return
+        for label, (seconds, rows, runs) in stats['labels'].items():
+            metrics.add(('db_write', label), seconds, rows)
+        metrics.add(('write_latency', None), stats['latency_total'],
+            stats['jobs'])
+        metrics.add(('writer_blocked', None), stats['blocked'])
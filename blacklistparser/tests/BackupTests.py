@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import gzip
+import shutil
+import unittest
+from unittest import mock
+from os import path, listdir
+from tempfile import TemporaryDirectory
+from blacklistparser.core import Backup, Database
+
+class TestBackup(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.db_path = path.join(self.tmp.name, 'live.db')
+        self.db = Database.Manager(self.db_path)
+        self.db.bulk_add(['%d.example.com' % n for n in range(2000)],
+            'domain', 'one')
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def names(self, db_path):
+        db = Database.Manager(db_path)
+        try:
+            return len(db.pull_names_2(3600, 'domain'))
+        finally:
+            db.close()
+
+    def test_backup(self):
+        out = path.join(self.tmp.name, 'copy.db')
+        copy, = Backup.backup(self.db_path, out, pages=4, pause=0)
+        self.assertGreater(copy['steps'], 1)
+        self.assertEqual(copy['bytes'], path.getsize(out))
+        self.assertEqual(self.names(out), 2000)
+        self.assertEqual(sorted(listdir(self.tmp.name)),
+            ['copy.db', 'live.db'])
+
+    def test_writes_during_backup(self):
+        out = path.join(self.tmp.name, 'copy.db')
+        writer = Database.Manager(self.db_path)
+        pauses = []
+
+        def write(seconds):
+            # another connection commits between steps, the copy restarts
+            if not pauses:
+                writer.bulk_add(['new.example.com'], 'domain', 'two')
+                writer.commit()
+            pauses.append(seconds)
+        with mock.patch.object(Backup, 'sleep', write):
+            Backup.copy_database(self.db_path, out, pages=4, pause=0.5)
+        writer.close()
+        self.assertEqual(pauses[0], 0.5)
+        self.assertEqual(self.names(out), 2001)
+
+    def test_compressed_shards(self):
+        self.db.create_shards('format')
+        out = path.join(self.tmp.name, 'copy.db.gz')
+        copies = Backup.backup(self.db_path, out, pause=0, vacuum_copy=True,
+            compress=True)
+        self.assertEqual([path.basename(copy['path']) for copy in copies],
+            ['copy.db.gz', 'copy.db.domain.gz', 'copy.db.ip.gz'])
+        for copy in copies:
+            with gzip.open(copy['path']) as packed, open(path.join(
+                    self.tmp.name, path.basename(copy['path'])[:-3]),
+                    'wb') as unpacked:
+                shutil.copyfileobj(packed, unpacked)
+        self.assertEqual(self.names(path.join(self.tmp.name, 'copy.db')),
+            2000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+'''
+time each stage of update/output over synthetic feeds and write the
+results as json so they can be compared between releases
+usage: python3 -m blacklistparser.tests.BenchTrial [-s 10000,1000000] [-o results.json]
+'''
+
+import sys
+import json
+import sqlite3
+import platform
+from os import path
+from time import perf_counter
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+
+from blacklistparser.core import Parser, Data, Database
+from blacklistparser.tests import FeedGen
+
+SIZES = (10000, 1000000, 10000000)
+# output format used for each base type
+OUTPUT_FORMAT = {'domain' : 'unbound_nxdomain', 'ip' : 'ipset'}
+
+
+class Stages:
+    '''
+    collect the time taken and rows produced by each stage
+    '''
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, func, *args):
+        start = perf_counter()
+        result = func(*args)
+        elapsed = perf_counter() - start
+        stage = {'seconds' : round(elapsed, 6)}
+        if isinstance(result, str):
+            stage['bytes'] = len(result)
+        elif isinstance(result, Data.DataList):
+            stage['rows'] = len(result.data)
+        else:
+            stage['rows'] = len(result)
+        self.results[name] = stage
+        return result
+
+def bench_feed(tmpdir, feed, lines, seed):
+    page_format = FeedGen.FEEDS[feed][1]
+    base_type = Data.BASE_TYPE[page_format]
+    feed_path = path.join(tmpdir, feed + '.txt')
+    size = FeedGen.write_feed(feed_path, feed, lines, seed)
+    db = Database.Manager(path.join(tmpdir, feed + '.db'))
+    stages = Stages()
+
+    def parse():
+        with open(feed_path, 'rb') as feed_file:
+            return list(Parser.extract_stream(feed_file, page_format))
+    def bulk_add(data_list):
+        data_list.add_to_db(db)
+        db.db_conn.commit()
+        return data_list.data
+    def write(output):
+        with open(path.join(tmpdir, feed + '.out'), 'w') as out_file:
+            out_file.write(output)
+        return output
+
+    names = stages.run('parse', parse)
+    data_list = stages.run('validate', Data.DataList, names, page_format,
+        'bench://' + feed)
+    stages.run('bulk_add', bulk_add, data_list)
+    results = stages.run('pull_names_2', db.pull_names_2, 3600, base_type)
+    output = stages.run('format', Data.FORMAT[OUTPUT_FORMAT[base_type]],
+        [result[0] for result in results])
+    stages.run('write', write, output)
+    db.db_conn.close()
+    return {
+        'feed' : feed,
+        'lines' : lines,
+        'bytes' : size,
+        'stages' : stages.results}
+
+def bench(sizes=SIZES, feeds=tuple(FeedGen.FEEDS), seed=0):
+    results = []
+    for lines in sizes:
+        for feed in feeds:
+            with TemporaryDirectory() as tmpdir:
+                results.append(bench_feed(tmpdir, feed, lines, seed))
+    return {
+        'python' : platform.python_version(),
+        'sqlite' : sqlite3.sqlite_version,
+        'seed' : seed,
+        'results' : results}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='BenchTrial')
+    parser.add_argument('-s', '--sizes', default=','.join(map(str, SIZES)),
+        help='comma separated feed sizes in lines')
+    parser.add_argument('-f', '--feeds', default=','.join(FeedGen.FEEDS),
+        help='comma separated feeds ' + str(list(FeedGen.FEEDS)))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write json to this file')
+    args = parser.parse_args()
+    report = bench(
+        [int(size) for size in args.sizes.split(',')],
+        args.feeds.split(','),
+        args.seed)
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            json.dump(report, out_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
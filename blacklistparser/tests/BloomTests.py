@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from blacklistparser.core import Bloom, Exceptions, IPv4
+
+class TestBloom(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.pathname = path.join(self.tmp.name, 'bl.bloom')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_size_for(self):
+        bits, hashes = Bloom.size_for(1000000, 0.01)
+        self.assertEqual(bits % 8, 0)
+        self.assertTrue(9500000 < bits < 9700000)
+        self.assertEqual(hashes, 7)
+        self.assertRaises(ValueError, Bloom.size_for, 10, 1.5)
+
+    def test_sink(self):
+        sink = Bloom.Sink(self.pathname, fp_rate=0.01)
+        names = ['{:x}.example.com'.format(i) for i in range(2000)]
+        for name in names:
+            sink.write(name, 'domain')
+        sink.write('10.1.2.3/24', 'ip')
+        sink.write('1.2.3.4', 'ip')
+        sink.close()
+        with Bloom.Reader(self.pathname) as bloom:
+            self.assertEqual(bloom.entries, 2002)
+            for name in names:
+                self.assertTrue(bloom.might_contain_domain(name))
+            self.assertTrue(bloom.might_contain_domain('a.' + names[0]))
+            self.assertTrue(bloom.might_contain_ip('10.1.2.200'))
+            self.assertTrue(bloom.might_contain_ip('1.2.3.4'))
+            misses = sum(bloom.might_contain_domain(
+                '{:x}.example.org'.format(i), False) for i in range(2000))
+            self.assertTrue(misses < 100, misses)
+
+    def test_numpy_matches(self):
+        if IPv4.load_numpy() is None:
+            self.skipTest('numpy not installed')
+        keys = [str(i).encode('ascii') for i in range(1000)]
+        pure = Bloom.Builder(len(keys))
+        pure.add_many(keys, use_numpy=False)
+        vector = Bloom.Builder(len(keys))
+        vector.add_many(keys)
+        self.assertEqual(pure.array, vector.array)
+
+    def test_small_blocks(self):
+        sink = Bloom.Sink(self.pathname, fp_rate=0.0001)
+        sink.write('1.2.3.16/28', 'ip')
+        sink.write('10.0.0.128/25', 'ip')
+        sink.write('10.9.9.2/31', 'ip')
+        sink.close()
+        with Bloom.Reader(self.pathname) as bloom:
+            for addr in ('1.2.3.16', '1.2.3.17', '1.2.3.31', '10.0.0.200',
+                    '10.9.9.3'):
+                self.assertTrue(bloom.might_contain_ip(addr), addr)
+
+    def test_bad_file(self):
+        with open(self.pathname, 'wb') as bloom_file:
+            bloom_file.write(b'1.2.3.4\n' * 8)
+        self.assertRaises(Exceptions.BadFileType, Bloom.Reader, self.pathname)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+'''
+time building a bloom filter over synthetic domains and report the build
+time, peak python memory and measured false positive rate per size as json
+usage: python3 -m blacklistparser.tests.BloomTrial [-s 100000,1000000] [-r 0.001]
+'''
+
+import sys
+import json
+import platform
+import tracemalloc
+from random import Random
+from time import perf_counter
+from itertools import islice
+from argparse import ArgumentParser
+
+from blacklistparser.core import Bloom
+from blacklistparser.tests import FeedGen
+
+SIZES = (100000, 1000000)
+# keys not in the filter checked to measure the false positive rate
+PROBES = 100000
+
+
+def trial(size, fp_rate, use_numpy, seed=0):
+    keys = [Bloom.domain_key(name)
+        for name in islice(FeedGen.domains(Random(seed)), size)]
+    start = perf_counter()
+    builder = Bloom.Builder(len(keys), fp_rate)
+    builder.add_many(keys, use_numpy)
+    elapsed = perf_counter() - start
+    # build again under tracemalloc, it slows the build too much to time
+    tracemalloc.start()
+    Bloom.Builder(len(keys), fp_rate).add_many(keys, use_numpy)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # domains from another seed are almost certainly not in keys
+    bits = builder.array
+    hits = 0
+    for name in islice(FeedGen.domains(Random(seed + 1)), PROBES):
+        h1, h2 = Bloom._halves(Bloom.domain_key(name))
+        hits += all(bits[pos >> 3] & (1 << (pos & 7)) for pos in (
+            ((h1 + i * h2) & Bloom.MASK64) % builder.bits
+            for i in range(builder.hashes)))
+    return {
+        'entries' : size,
+        'numpy' : use_numpy,
+        'bits' : builder.bits,
+        'hashes' : builder.hashes,
+        'seconds' : round(elapsed, 6),
+        'seconds_per_million' : round(elapsed * 1000000 / size, 6),
+        'peak_bytes' : peak,
+        'peak_bytes_per_million' : peak * 1000000 // size,
+        'fp_rate' : fp_rate,
+        'measured_fp_rate' : hits / PROBES}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='BloomTrial')
+    parser.add_argument('-s', '--sizes', default=','.join(map(str, SIZES)),
+        help='comma separated numbers of keys')
+    parser.add_argument('-r', '--fp-rate', type=float,
+        default=Bloom.DEFAULT_FP_RATE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    modes = [False] + ([True] if Bloom.numpy is not None else [])
+    results = [trial(int(size), args.fp_rate, use_numpy, args.seed)
+        for size in args.sizes.split(',') for use_numpy in modes]
+    json.dump({'python' : platform.python_version(), 'results' : results},
+        sys.stdout, indent=2)
+    print()
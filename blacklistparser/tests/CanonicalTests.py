@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from blacklistparser.core import Canonical, Data, Parser
+
+class TestCanonicalizer(unittest.TestCase):
+    def test_domain(self):
+        canon = Canonical.Canonicalizer('domain')
+        self.assertEqual(canon('Example.COM.'), 'example.com')
+        self.assertEqual(canon('bücher.example'), 'xn--bcher-kva.example')
+        self.assertEqual(canon('BÜCHER.example.'), 'xn--bcher-kva.example')
+        self.assertEqual(canon('example.com'), 'example.com')
+        self.assertEqual(canon.counts['changed'], 3)
+        self.assertEqual(canon.counts['lowercase'], 1)
+        self.assertEqual(canon.counts['trailing_dot'], 2)
+        self.assertEqual(canon.counts['idn'], 2)
+
+    def test_ip(self):
+        canon = Canonical.Canonicalizer('ip')
+        self.assertEqual(canon('010.001.002.003'), '10.1.2.3')
+        self.assertEqual(canon('1.2.3.4/24'), '1.2.3.0/24')
+        self.assertEqual(canon('1.2.3.4/32'), '1.2.3.4')
+        self.assertEqual(canon('1.2.3.0/24'), '1.2.3.0/24')
+        # left for the validator
+        for name in ('1.2.3.256', '1.2.3', '1.2.3.4/33', 'a.b.c.d'):
+            self.assertEqual(canon(name), name)
+        self.assertEqual(canon.counts['changed'], 3)
+        self.assertEqual(canon.counts['leading_zeros'], 1)
+        self.assertEqual(canon.counts['host_bits'], 1)
+        self.assertEqual(canon.counts['host_prefix'], 1)
+
+    def test_datalist(self):
+        names = ['Example.com', 'example.com.', 'bad_name']
+        data = Data.DataList(names, 'hosts')
+        self.assertEqual(data.data, ['example.com', 'example.com'])
+        self.assertEqual(data.canonical.counts['changed'], 2)
+        raw = Data.DataList(names, 'hosts', canonical=False)
+        self.assertEqual(raw.data, [])
+        self.assertIsNone(raw.canonical)
+
+    def test_newline_stream(self):
+        lines = [b'Example.COM.', b'# comment', b'ads.example.com']
+        # the parsers leave the spelling to the canonicalizer
+        names = list(Parser.NewlineParser.extract_stream(lines))
+        self.assertEqual(names, ['Example.COM.', 'ads.example.com'])
+        valid = Data.DataList(names, 'domain')
+        self.assertEqual(valid.data, ['example.com', 'ads.example.com'])
+        self.assertEqual(valid.canonical.counts['trailing_dot'], 1)
+        self.assertEqual(list(Parser.ABPParser.extract_stream(
+            [b'||Ads.Example.com^'])), ['Ads.Example.com'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from blacklistparser.core import Config, Exceptions
+
+INI = '''
+[blacklistparser]
+version = 1
+
+[source https://example.com/hosts.txt]
+format = hosts
+interval = 3600
+group = ads
+
+[source https://example.com/feed.csv]
+format = csv
+column = 2
+interval = 600
+
+[exception example.com]
+
+[output /tmp/blacklist.conf]
+format = unbound_nxdomain
+expiry = 86400
+compress = gz
+'''
+
+TOML = '''
+version = 1
+[[source]]
+url = "https://example.com/hosts.txt"
+format = "hosts"
+interval = 3600
+group = "ads"
+[[source]]
+url = "https://example.com/feed.csv"
+format = "csv"
+column = 2
+interval = 600
+[[exception]]
+name = "example.com"
+[[output]]
+path = "/tmp/blacklist.conf"
+format = "unbound_nxdomain"
+expiry = 86400
+compress = ["gz"]
+'''
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def load(self, name, text):
+        pathname = path.join(self.tmp.name, name)
+        with open(pathname, 'w') as config_file:
+            config_file.write(text)
+        return Config.Config.load(pathname)
+
+    def check(self, config):
+        self.assertEqual(config.sources, [
+            {'url' : 'https://example.com/hosts.txt', 'page_format' : 'hosts',
+                'timeout' : 3600.0, 'membership' : 'ads'},
+            {'url' : 'https://example.com/feed.csv', 'page_format' : 'csv:2',
+                'timeout' : 600.0, 'membership' : None}])
+        self.assertEqual(config.exceptions, [('example.com', 'domain')])
+        self.assertEqual(config.outputs, [{'path' : '/tmp/blacklist.conf',
+            'format' : 'unbound_nxdomain', 'expiry' : 86400, 'group' : None,
+            'fp_rate' : None, 'compress' : ['gz']}])
+
+    def test_ini(self):
+        self.check(self.load('bl.ini', INI))
+
+    def test_toml(self):
+        self.check(self.load('bl.toml', TOML))
+
+    def test_errors(self):
+        for text in (
+                '[blacklistparser]\nversion = 2\n',
+                '[source http://a]\nformat = nope\ninterval = 1\n',
+                '[source http://a]\nformat = hosts\n',
+                '[source http://a]\nformat = hosts\ninterval = 1\ncolumn = 1\n',
+                '[exception a.com]\ntype = other\n',
+                '[output /tmp/a]\nformat = ipset\nexpiry = 1\ncompress = xz\n',
+                '[bogus section]\n'):
+            with self.assertRaises(Exceptions.ConfigError):
+                self.load('bad.ini', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
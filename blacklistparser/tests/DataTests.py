@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import os
+import gzip
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from blacklistparser.core import Data
+
+NAMES = ['a.example.com', 'b.example.com', 'c.example.com']
+
+class TestSink(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.pathname = path.join(self.tmp.name, 'out')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self):
+        with open(self.pathname) as out_file:
+            return out_file.read()
+
+    def test_matches_format(self):
+        for out_format in Data.FORMAT:
+            sink = Data.Sink(self.pathname, out_format)
+            sink.BUFFER_ROWS = 2
+            for name in NAMES:
+                sink.write(name)
+            sink.close()
+            self.assertEqual(self.read(), Data.FORMAT[out_format](NAMES))
+            self.assertEqual(sink.bytes, len(self.read()))
+            self.assertEqual(sink.rows, len(NAMES))
+
+    def test_keeps_mode(self):
+        with open(self.pathname, 'w') as out_file:
+            out_file.write('old')
+        os.chmod(self.pathname, 0o640)
+        sink = Data.Sink(self.pathname, 'ipset')
+        sink.write('1.2.3.4')
+        sink.close()
+        self.assertEqual(self.read(), '1.2.3.4')
+        self.assertEqual(os.stat(self.pathname).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.tmp.name), ['out'])
+
+    def test_merged(self):
+        sink = Data.open_sink(self.pathname, 'ipset_merged')
+        for name in ('1.2.3.0/24', '1.2.3.9', '1.2.2.0/24', '9.9.9.9'):
+            sink.write(name, 'ip')
+        self.assertEqual(sink.rows, 4)
+        sink.close()
+        self.assertEqual(self.read(), '1.2.2.0/23\n9.9.9.9')
+        self.assertEqual(sink.rows, 2)
+
+    def test_merged_validates(self):
+        # blocks longer than /24 come out of the merge and must read back
+        sink = Data.open_sink(self.pathname, 'ipset_merged')
+        for name in ('1.2.3.0', '1.2.3.1', '1.2.3.128/25', '1.2.3.4/30'):
+            sink.write(name, 'ip')
+        sink.close()
+        blocks = self.read().split('\n')
+        self.assertEqual(blocks, ['1.2.3.0/31', '1.2.3.4/30', '1.2.3.128/25'])
+        for block in blocks:
+            self.assertEqual(Data.Validator.ipv4_addr(block), block)
+        self.assertIsNone(Data.Validator.ipv4_addr('1.2.3.0/33'))
+
+    def test_abort(self):
+        with open(self.pathname, 'w') as out_file:
+            out_file.write('old')
+        sink = Data.Sink(self.pathname, 'ipset')
+        sink.write('1.2.3.4')
+        sink.abort()
+        self.assertEqual(self.read(), 'old')
+        self.assertEqual(os.listdir(self.tmp.name), ['out'])
+
+    def test_compressed(self):
+        sink = Data.open_sink(self.pathname, 'unbound_nxdomain', None,
+            ['gz'], 9)
+        sink.BUFFER_ROWS = 2
+        for name in NAMES:
+            sink.write(name, 'domain')
+        sink.close()
+        with gzip.open(self.pathname + '.gz', 'rt') as gz_file:
+            self.assertEqual(gz_file.read(), self.read())
+        out = sink.compressed[0]
+        self.assertEqual(out.bytes, path.getsize(self.pathname + '.gz'))
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ['out', 'out.gz'])
+        # no timestamp in the header, the same list gives the same file
+        with open(self.pathname + '.gz', 'rb') as gz_file:
+            first = gz_file.read()
+        sink = Data.open_sink(self.pathname, 'unbound_nxdomain', None,
+            ['gz'], 9)
+        for name in NAMES:
+            sink.write(name, 'domain')
+        sink.close()
+        with open(self.pathname + '.gz', 'rb') as gz_file:
+            self.assertEqual(gz_file.read(), first)
+        sink = Data.open_sink(self.pathname, 'ipset_merged', None, ['gz'],
+            plain=False)
+        sink.write('1.2.3.4', 'ip')
+        sink.abort()
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ['out', 'out.gz'])
+
+    def test_compressed_only(self):
+        sink = Data.open_sink(self.pathname, 'ipset_merged', None, ['gz'],
+            plain=False)
+        for name in ('1.2.3.0/24', '1.2.2.0/24'):
+            sink.write(name, 'ip')
+        sink.close()
+        self.assertEqual(os.listdir(self.tmp.name), ['out.gz'])
+        with gzip.open(self.pathname + '.gz', 'rt') as gz_file:
+            self.assertEqual(gz_file.read(), '1.2.2.0/23')
+        with self.assertRaises(Data.Exceptions.IncorrectDataType):
+            Data.open_sink(self.pathname, 'bloom', None, ['gz'])
+
+    def test_compressed_bad_level(self):
+        with self.assertRaises(ValueError):
+            Data.open_sink(self.pathname, 'ipset', None, ['gz'], 22)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,18 +2,22 @@
 # Liam Nolan 2018 (c) ISC
 
 import unittest
-from gphull.core import Parser, Data
+from os import path
+from blacklistparser.core import Parser, Data
+
+EASYLIST = path.join(path.dirname(__file__), 'data', 'easylist.txt')
 
 def test():
-    with open('bdigester/tests/data/easylist.txt', 'r') as testdata:
+    with open(EASYLIST, 'r') as testdata:
         print("begin")
         try:
-            matches = Data.DataList(testdata.read())
+            matches = Data.DataList(
+                Parser.ABPParser.extract_data(testdata.read()), 'adblock')
         except:
             raise
         if matches:
             print("matches found")
-            for each in matches:
+            for each in matches.data:
                 print(each)
                 
 
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from os import path
+from sqlite3 import connect
+from tempfile import TemporaryDirectory
+from time import time
+from blacklistparser.core import Database, Exceptions
+
+class TestActive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.db_path = path.join(self.tmp.name, 'test.db')
+        self.db = Database.Manager(self.db_path)
+
+    def tearDown(self):
+        self.db.db_conn.close()
+        self.tmp.cleanup()
+
+    def test_bulk_add_dedupes(self):
+        self.db.bulk_add(['a.example.com', 'b.example.com'], 'domain', 'one')
+        self.db.bulk_add(['a.example.com'], 'domain', 'two')
+        self.db.bulk_add(['a.example.com'], 'domain', 'two')
+        names = sorted(self.db.pull_names_2(3600, 'domain'))
+        self.assertEqual(names, [('a.example.com',), ('b.example.com',)])
+        stats = self.db.overlap_stats()
+        self.assertEqual(stats['distinct'], 2)
+        self.assertEqual(stats['rows'], 3)
+        self.assertEqual(stats['histogram'], [(1, 1), (2, 1)])
+        self.assertEqual(stats['sources'], [('one', 2, 1), ('two', 1, 0)])
+
+    def test_delete_updates_active(self):
+        self.db.bulk_add(['a.example.com'], 'domain', 'one')
+        self.db.bulk_add(['a.example.com'], 'domain', 'two')
+        self.db.db_cur.execute('DELETE FROM data WHERE source_url=?', ('one',))
+        self.assertEqual(self.db.overlap_stats()['histogram'], [(1, 1)])
+        self.db.db_cur.execute('DELETE FROM data WHERE source_url=?', ('two',))
+        self.assertEqual(self.db.pull_names_2(3600, 'domain'), [])
+
+    def test_exceptions_and_expiry(self):
+        self.db.bulk_add(['a.example.com', 'b.example.com'], 'domain', 'one')
+        self.db.add_element('b.example.com', 'domain', None, whitelist=True)
+        self.assertEqual(self.db.pull_names_2(3600, 'domain'),
+            [('a.example.com',)])
+        self.assertEqual(self.db.pull_names_2(-3600, 'domain'), [])
+
+    def test_savepoint(self):
+        with self.db.savepoint('source'):
+            self.db.bulk_add(['a.example.com'], 'domain', 'one')
+        with self.assertRaises(ValueError):
+            with self.db.savepoint('source'):
+                self.db.bulk_add(['b.example.com'], 'domain', 'two')
+                raise ValueError
+        self.assertFalse(self.db.db_conn.in_transaction)
+        conn = connect(self.db_path)
+        names = conn.execute('SELECT name FROM active').fetchall()
+        conn.close()
+        self.assertEqual(names, [('a.example.com',)])
+
+    def test_migrate_fills_active(self):
+        self.db.bulk_add(['a.example.com'], 'domain', 'one')
+        self.db.bulk_add(['a.example.com'], 'domain', 'two')
+        self.db.db_cur.execute('DELETE FROM active')
+        self.db.db_cur.execute('PRAGMA user_version = 3')
+        self.db.db_conn.commit()
+        self.db.db_conn.close()
+        self.db = Database.Manager(self.db_path)
+        self.assertEqual(self.db.overlap_stats()['histogram'], [(2, 1)])
+        conn = connect(self.db_path)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.close()
+        self.assertEqual(version, Database.SCHEMA_VERSION)
+
+    def test_ip_ranges(self):
+        self.db.bulk_add(['1.2.3.4', '10.0.0.0/8'], 'ip', 'one')
+        self.db.bulk_add(['a.example.com'], 'domain', 'one')
+        self.db.db_cur.execute('SELECT name, ip_start, ip_end FROM data '
+            'ORDER BY name')
+        self.assertEqual(self.db.db_cur.fetchall(), [
+            ('1.2.3.4', 0x01020304, 0x01020304),
+            ('10.0.0.0/8', 0x0a000000, 0x0affffff),
+            ('a.example.com', None, None)])
+
+    def test_lookup_ip(self):
+        self.db.bulk_add(['1.2.3.0/24', '1.2.4.0/24', '1.2.3.7'], 'ip', 'one')
+        self.db.bulk_add(['1.2.3.0/24'], 'ip', 'two')
+        self.db.add_element('1.2.4.0/24', 'ip', None, whitelist=True)
+        self.assertEqual([row[:2] for row in self.db.lookup_ip('1.2.3.7')],
+            [('1.2.3.0/24', 'one'), ('1.2.3.0/24', 'two'), ('1.2.3.7', 'one')])
+        self.assertTrue(self.db.contains_ip('1.2.3.255'))
+        self.assertFalse(self.db.contains_ip('1.2.4.1'))
+        self.assertTrue(self.db.contains_ip('1.2.4.1', exceptions=False))
+        self.assertFalse(self.db.contains_ip('1.2.3.7', timeout=-3600))
+        self.assertEqual(self.db.merged_ip_ranges(3600),
+            [(0x01020300, 0x010203ff)])
+        self.assertEqual(self.db.merged_ip_ranges(3600, exceptions=False),
+            [(0x01020300, 0x010204ff)])
+
+    def test_migrate_adds_ip_ranges(self):
+        self.db.db_conn.close()
+        conn = connect(self.db_path)
+        conn.execute('DROP TABLE data')
+        conn.execute('CREATE TABLE data ( name TEXT, data_format TEXT, '
+            'first_seen REAL, last_seen REAL, source_url TEXT, '
+            'UNIQUE ( name, source_url ))')
+        conn.execute("INSERT INTO data VALUES ('1.2.3.0/24', 'ip', 0, 0, 'one')")
+        conn.execute('PRAGMA user_version = 4')
+        conn.commit()
+        conn.close()
+        self.db = Database.Manager(self.db_path)
+        self.db.db_cur.execute('SELECT ip_start, ip_end FROM data')
+        self.assertEqual(self.db.db_cur.fetchall(), [(0x01020300, 0x010203ff)])
+
+    def test_failed_migration_keeps_version(self):
+        self.db.db_conn.close()
+        conn = connect(self.db_path)
+        conn.execute('DROP TABLE data')
+        conn.execute('CREATE TABLE data ( name TEXT, data_format TEXT, '
+            'first_seen REAL, last_seen REAL, source_url TEXT, '
+            'UNIQUE ( name, source_url ))')
+        conn.execute("INSERT INTO data VALUES ('not an ip', 'ip', 0, 0, 'one')")
+        conn.execute('PRAGMA user_version = 4')
+        conn.commit()
+        conn.close()
+        self.assertRaises(ValueError, Database.Manager, self.db_path)
+        conn = connect(self.db_path)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(data)')]
+        conn.close()
+        # the migration is tried again on the next open
+        self.assertEqual(version, 4)
+        self.assertNotIn('ip_start', columns)
+
+    def test_stream_groups(self):
+        for url, group in (('one', 'ads'), ('two', 'ads'), ('three', 5)):
+            self.db.add_source_url(url, 'hosts', 3600)
+            self.db.change_group(group, url)
+        self.db.bulk_add(['a.example.com', 'b.example.com'], 'domain', 'one')
+        self.db.bulk_add(['a.example.com'], 'domain', 'two')
+        self.db.bulk_add(['c.example.com'], 'domain', 'three')
+        self.db.add_element('b.example.com', 'domain', None, whitelist=True)
+        rows = self.db.stream_names(3600, ['domain'], ['ads', '5'])
+        self.assertEqual([(name, str(group)) for name, _, group, _ in rows],
+            [('c.example.com', '5'), ('a.example.com', 'ads')])
+        self.assertEqual(list(self.db.stream_names(3600, ['domain'],
+            ['none'])), [])
+
+    def test_stream_names(self):
+        self.db.add_source_url('one', 'hosts', 3600)
+        self.db.change_group('ads', 'one')
+        self.db.bulk_add(['a.example.com'], 'domain', 'one')
+        self.db.bulk_add(['a.example.com'], 'domain', 'two')
+        self.db.bulk_add(['1.2.3.4'], 'ip', 'two')
+        rows = sorted(row[:3] for row in
+            self.db.stream_names(3600, ['domain', 'ip']))
+        self.assertEqual(rows, [('1.2.3.4', 'ip', None),
+            ('a.example.com', 'domain', None)])
+        rows = [row[:3] for row in
+            self.db.stream_names(3600, ['domain', 'ip'], ['ads'])]
+        self.assertEqual(rows, [('a.example.com', 'domain', 'ads')])
+
+
+class TestSchedule(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.db = Database.Manager(path.join(self.tmp.name, 'test.db'))
+        self.db.add_source_url('one', 'domain', 3600)
+
+    def tearDown(self):
+        self.db.db_conn.close()
+        self.tmp.cleanup()
+
+    def due(self):
+        try:
+            return [entry['url'] for entry in
+                self.db.pull_active_source_urls()]
+        except Exceptions.NoMatchesFound:
+            return []
+
+    def test_schedule(self):
+        self.assertEqual(self.due(), ['one'])
+        self.db.schedule_source('one', 1800, time() + 1800, True, 'abc', 10)
+        self.assertEqual(self.due(), [])
+        self.db.schedule_source('one', 2700, time() - 1, False)
+        entry = self.db.pull_active_source_urls()[0]
+        self.assertEqual((entry['interval'], entry['content_hash'],
+            entry['name_count'], entry['timeout']), (2700, 'abc', 10, 3600))
+        self.db.db_cur.execute('SELECT unchanged FROM schedule')
+        self.assertEqual(self.db.db_cur.fetchone(), (1,))
+        self.db.delete_source_url('one')
+        self.db.db_cur.execute('SELECT COUNT(*) FROM schedule')
+        self.assertEqual(self.db.db_cur.fetchone(), (0,))
+
+    def test_refresh_source(self):
+        self.db.bulk_add(['a.example.com', 'b.example.com'], 'domain', 'one')
+        self.db.db_cur.execute('UPDATE data SET last_seen=0')
+        self.db.db_cur.execute('UPDATE active SET last_seen=0')
+        self.assertEqual(self.db.pull_names_2(3600, 'domain'), [])
+        self.assertEqual(self.db.refresh_source('one'), 2)
+        self.assertEqual(len(self.db.pull_names_2(3600, 'domain')), 2)
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.db_path = path.join(self.tmp.name, 'test.db')
+        self.db = Database.Manager(self.db_path)
+        self.db.add_source_url('one', 'domain', 3600)
+        self.db.change_group('ads', 'one')
+        self.names = ['%s.example.com' % n for n in range(20)]
+        self.db.bulk_add(self.names, 'domain', 'one')
+        self.db.bulk_add(['1.2.3.0/25', '1.2.3.128/25'], 'ip', 'one')
+        self.db.db_conn.commit()
+
+    def tearDown(self):
+        self.db.db_conn.close()
+        self.tmp.cleanup()
+
+    def reopen(self):
+        self.db.db_conn.close()
+        self.db = Database.Manager(self.db_path)
+
+    def check(self):
+        rows = list(self.db.stream_names(3600, ['domain', 'ip']))
+        # shard streams are merged in order
+        self.assertEqual([row[0] for row in rows],
+            sorted(self.names + ['1.2.3.0/25', '1.2.3.128/25']))
+        rows = list(self.db.stream_names(3600, ['domain'], ['ads']))
+        self.assertEqual([row[0] for row in rows], sorted(self.names))
+        self.assertEqual(self.db.merged_ip_ranges(3600),
+            [(0x01020300, 0x010203ff)])
+        self.assertTrue(self.db.contains_ip('1.2.3.200'))
+        stats = self.db.overlap_stats()
+        self.assertEqual((stats['distinct'], stats['rows']), (22, 22))
+        self.assertEqual(stats['sources'], [('one', 22, 22)])
+        self.assertEqual(self.db.refresh_source('one'), 22)
+
+    def test_hash_shards(self):
+        shards = self.db.create_shards('hash', 3)
+        self.assertEqual([shard['name'] for shard in shards], ['0', '1', '2'])
+        self.reopen()
+        self.check()
+        self.db.bulk_add(['new.example.com'], 'domain', 'one')
+        self.db.db_conn.commit()
+        shard, = self.db.partition(['new.example.com'], 'domain')
+        shard_db = Database.Manager(self.db_path + '.' + shard)
+        self.assertEqual(shard_db.pull_names_2(3600, 'domain').count(
+            ('new.example.com',)), 1)
+        shard_db.db_conn.close()
+        # nothing left in the main file
+        self.db.db_cur.execute('SELECT COUNT(*) FROM main.data')
+        self.assertEqual(self.db.db_cur.fetchone(), (0,))
+
+    def test_format_shards(self):
+        self.db.create_shards('format')
+        self.reopen()
+        self.check()
+        self.assertEqual(self.db.partition(['1.2.3.4'], 'ip'),
+            {'ip' : ['1.2.3.4']})
+        self.assertEqual(self.db._data_schemas(['ip']), ['shard_ip'])
+        self.assertRaises(Exceptions.DatabaseError, self.db.create_shards,
+            'format')
+
+    def test_bad_shards(self):
+        self.assertRaises(Exceptions.DatabaseError, self.db.create_shards,
+            'hash', 1)
+        self.assertRaises(Exceptions.DatabaseError, self.db.create_shards,
+            'name')
+        self.assertEqual(self.db.partition(['a'], 'domain'), {None : ['a']})
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.db = Database.Manager(':memory:')
+
+    def source(self, url, page_format='hosts', timeout=3600, group=None):
+        return {'url' : url, 'page_format' : page_format,
+            'timeout' : timeout, 'membership' : group}
+
+    def test_sync_sources(self):
+        self.db.add_source_url('http://keep', 'hosts', 3600)
+        self.db.add_source_url('http://change', 'hosts', 3600)
+        self.db.add_source_url('http://remove', 'hosts', 3600)
+        self.db.touch_source_url('http://change')
+        result = self.db.sync_sources([
+            self.source('http://keep'),
+            self.source('http://change', 'csv:1', 60, 'ads'),
+            self.source('http://new')])
+        self.assertEqual(result,
+            (['http://new'], ['http://change'], ['http://remove']))
+        sources = self.db.pull_sources()
+        self.assertEqual(sources['http://change'], ('csv:1', 60.0, 'ads'))
+        self.assertNotIn('http://remove', sources)
+        # last_updated survives the change
+        self.db.db_cur.execute(
+            'SELECT last_updated FROM sources WHERE url=?', ('http://change',))
+        self.assertGreater(self.db.db_cur.fetchone()[0], 61)
+        # nothing left to do
+        self.assertEqual(self.db.sync_sources([self.source('http://keep'),
+            self.source('http://change', 'csv:1', 60, 'ads'),
+            self.source('http://new')]), ([], [], []))
+
+    def test_sync_numeric_group(self):
+        sources = [self.source('http://a', group='5')]
+        self.assertEqual(self.db.sync_sources(sources), (['http://a'], [], []))
+        self.assertEqual(self.db.sync_sources(sources), ([], [], []))
+
+    def test_sync_keep(self):
+        self.db.add_source_url('http://old', 'hosts', 3600)
+        self.assertEqual(self.db.sync_sources([], prune=False), ([], [], []))
+        self.assertIn('http://old', self.db.pull_sources())
+
+    def test_sync_exceptions(self):
+        self.db.add_element('old.example.com', 'domain', None, True)
+        result = self.db.sync_exceptions([('new.example.com', 'domain')])
+        self.assertEqual(result, ([('new.example.com', 'domain')],
+            [('old.example.com', 'domain')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
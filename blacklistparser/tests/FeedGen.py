@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+'''
+synthetic feed generator for benchmarks, the same seed always produces the
+same feed
+usage: python3 -m blacklistparser.tests.FeedGen feed lines path [seed]
+'''
+
+import sys
+from random import Random
+
+TLDS = ('com', 'net', 'org', 'info', 'io', 'xyz', 'co.uk', 'de')
+
+def domains(rand):
+    while True:
+        yield '{:x}.{:x}.{}'.format(rand.getrandbits(32), rand.getrandbits(16),
+            TLDS[rand.getrandbits(3)])
+
+def abp_lines(rand):
+    for i, domain in enumerate(domains(rand)):
+        if i % 50 == 0:
+            yield '! comment ' + str(i)
+        elif i % 4 == 0:
+            yield '||' + domain + '^$third-party'
+        else:
+            yield '||' + domain + '^'
+
+def newline_lines(rand):
+    for i, domain in enumerate(domains(rand)):
+        if i % 50 == 0:
+            yield '# comment ' + str(i)
+        else:
+            yield domain
+
+def hosts_lines(rand):
+    for i, domain in enumerate(domains(rand)):
+        if i % 50 == 0:
+            yield '# comment ' + str(i)
+        else:
+            yield '0.0.0.0 ' + domain
+
+def ipv4_lines(rand):
+    i = 0
+    while True:
+        addr = rand.getrandbits(32).to_bytes(4, 'big')
+        line = '.'.join(str(octet) for octet in addr)
+        if i % 10 == 0:
+            # network address for a /24
+            line = line.rpartition('.')[0] + '.0/24'
+        i += 1
+        yield line
+
+# feed name: (line generator, SHORTNAME format of the feed)
+FEEDS = {
+    'abp' : (abp_lines, 'adblock'),
+    'newline' : (newline_lines, 'domain'),
+    'hosts' : (hosts_lines, 'hosts'),
+    'ipv4' : (ipv4_lines, 'ipset')}
+
+def write_feed(pathname, feed, lines, seed=0):
+    '''
+    write lines lines of the synthetic feed to pathname
+    returns the size of the file in bytes
+    '''
+    generator = FEEDS[feed][0](Random(seed))
+    size = 0
+    with open(pathname, 'w') as feed_file:
+        for _ in range(lines):
+            size += feed_file.write(next(generator) + '\n')
+    return size
+
+
+if __name__ == '__main__':
+    write_feed(sys.argv[3], sys.argv[1], int(sys.argv[2]),
+        int(sys.argv[4]) if len(sys.argv) > 4 else 0)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from random import Random
+from blacklistparser.core import IPv4
+
+class TestIPv4(unittest.TestCase):
+    def test_to_range(self):
+        self.assertEqual(IPv4.to_range('1.2.3.4'), (0x01020304, 0x01020304))
+        self.assertEqual(IPv4.to_range('1.2.3.4/24'), (0x01020300, 0x010203ff))
+        self.assertEqual(IPv4.to_text(0x01020304), '1.2.3.4')
+
+    def test_merge(self):
+        self.assertEqual(IPv4.merge([(5, 9), (1, 2), (3, 4), (8, 12), (20, 20)]),
+            [(1, 12), (20, 20)])
+        self.assertEqual(IPv4.merge([]), [])
+
+    def test_to_cidrs(self):
+        self.assertEqual(IPv4.to_cidrs(*IPv4.to_range('10.0.0.0/8')),
+            ['10.0.0.0/8'])
+        self.assertEqual(IPv4.to_cidrs(1, 6),
+            ['0.0.0.1', '0.0.0.2/31', '0.0.0.4/31', '0.0.0.6'])
+        self.assertEqual(IPv4.to_cidrs(0, 0xffffffff), ['0.0.0.0/0'])
+
+    def test_network_starts(self):
+        starts = IPv4.network_starts(0x01020304)
+        self.assertEqual(len(starts), 32)
+        self.assertEqual(starts[:2], [0x01020304, 0x01020304])
+        self.assertIn(0x01020300, starts)
+        self.assertEqual(starts[-1], 0)
+
+    def test_parse(self):
+        names = ['1.2.3.4', '10.0.0.77/8', '255.255.255.255', '1.2.3.0/24']
+        for use_numpy in (False, True):
+            self.assertEqual(IPv4.parse(names, use_numpy), (
+                [0x01020304, 0x0a000000, 0xffffffff, 0x01020300],
+                [0x01020304, 0x0affffff, 0xffffffff, 0x010203ff]))
+            self.assertEqual(IPv4.parse([], use_numpy), ([], []))
+
+    def test_merge_arrays(self):
+        starts = [20, 5, 1, 3, 8, 5]
+        ends = [20, 9, 2, 4, 12, 6]
+        for use_numpy in (False, True):
+            self.assertEqual(IPv4.merge_arrays(starts, ends, use_numpy),
+                [(1, 12), (20, 20)])
+            self.assertEqual(IPv4.merge_arrays([], [], use_numpy), [])
+
+    def test_numpy_matches(self):
+        if IPv4.load_numpy() is None:
+            self.skipTest('numpy not installed')
+        rand = Random(0)
+        names = []
+        for i in range(5000):
+            name = '.'.join(str(rand.getrandbits(8)) for _ in range(4))
+            if i % 3 == 0:
+                name += '/' + str(rand.randint(16, 24))
+            names.append(name)
+        pure = IPv4.parse(names, use_numpy=False)
+        self.assertEqual(IPv4.parse(names), pure)
+        self.assertEqual(IPv4.merge_arrays(*pure),
+            IPv4.merge_arrays(*pure, use_numpy=False))
+        self.assertEqual(IPv4.merge_names(names),
+            IPv4.merge_names(names, use_numpy=False))
+        self.assertEqual(IPv4.merge_names([]), [])
+
+if __name__ == '__main__':
+    unittest.main()
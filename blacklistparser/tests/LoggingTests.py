@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from os import path
+from logging.handlers import QueueHandler
+from tempfile import TemporaryDirectory
+from blacklistparser.core import Logging
+
+class TestStartLog(unittest.TestCase):
+    def test_queued_file_log(self):
+        with TemporaryDirectory() as tmpdir:
+            logpath = path.join(tmpdir, 'bl.log')
+            logger = Logging.StartLog(quiet=False, syslog=False,
+                logpath=logpath, loglevel='DEBUG')
+            try:
+                self.assertEqual([type(handler) for handler
+                    in logger.log.handlers], [QueueHandler])
+                logger.log.debug('%d names in page.', 42)
+            finally:
+                logger.stop()
+                logger.log.removeHandler(logger.queue_handler)
+                logger.disk_log.close()
+                logger.stop()
+            with open(logpath) as log_file:
+                self.assertIn('blacklistparser - 42 names in page.\n',
+                    log_file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import os
+import unittest
+from io import BytesIO
+from os import path
+from tempfile import TemporaryDirectory
+from blacklistparser.core import Metrics
+
+class TestRecorder(unittest.TestCase):
+    def test_disabled(self):
+        recorder = Metrics.Recorder()
+        with recorder.stage('parse', 'url') as stage:
+            stage.rows = 10
+        self.assertIs(stage, Metrics.NULL_STAGE)
+        self.assertEqual(stage.rows, 0)
+        self.assertEqual(recorder.totals, {})
+
+    def test_totals(self):
+        recorder = Metrics.Recorder(enabled=True)
+        for _ in range(2):
+            with recorder.stage('parse', 'url') as stage:
+                stage.rows = 10
+                stage.bytes = 100
+        seconds, rows, nbytes, runs = recorder.totals[('parse', 'url')]
+        self.assertEqual((rows, nbytes, runs), (20, 200, 2))
+        self.assertGreaterEqual(seconds, 0)
+
+    def test_prometheus(self):
+        recorder = Metrics.Recorder(enabled=True)
+        recorder.add(('fetch', 'http://example.com/"a"'), 1.5, 0, 10)
+        with TemporaryDirectory() as tmpdir:
+            pathname = path.join(tmpdir, 'bl.prom')
+            recorder.write_prometheus(pathname)
+            with open(pathname) as prom:
+                text = prom.read()
+            self.assertEqual(os.stat(pathname).st_mode & 0o777, 0o644)
+            os.chmod(pathname, 0o640)
+            recorder.write_prometheus(pathname)
+            self.assertEqual(os.stat(pathname).st_mode & 0o777, 0o640)
+        self.assertIn('blacklistparser_stage_seconds{stage="fetch",'
+            + 'source="http://example.com/\\"a\\""} 1.5\n', text)
+        self.assertIn('# TYPE blacklistparser_stage_bytes gauge\n', text)
+
+    def test_counting_reader(self):
+        reader = Metrics.CountingReader(BytesIO(b'x' * 10))
+        reader.read(4)
+        reader.read()
+        self.assertEqual(reader.bytes, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+'''
+compare throughput and peak RSS of the str parsing path against the mmap'd
+bytes path, each run happens in a fresh child process so ru_maxrss is not
+shared between the two
+usage: python3 -m blacklistparser.tests.MmapTrial [path] [format]
+'''
+
+import sys
+from os import path
+from time import perf_counter
+from resource import getrusage, RUSAGE_SELF
+from multiprocessing import Process, Queue
+
+from blacklistparser.core import Parser
+
+DEFAULT_PATH = path.join(path.dirname(__file__), 'data', 'easylist.txt')
+
+
+def str_path(pathname, shortname):
+    with open(pathname, 'r') as data_file:
+        return Parser.SHORTNAME[shortname].extract_data(data_file.read())
+
+def mmap_path(pathname, shortname):
+    return Parser.parse_file(pathname, shortname)
+
+def run(func, pathname, shortname, results):
+    start = perf_counter()
+    matches = func(pathname, shortname)
+    elapsed = perf_counter() - start
+    # ru_maxrss is KiB on linux
+    results.put((len(matches), elapsed, getrusage(RUSAGE_SELF).ru_maxrss))
+
+def trial(pathname=DEFAULT_PATH, shortname='adblock'):
+    size = path.getsize(pathname)
+    print('file: ' + pathname + ' (' + str(size) + ' bytes)')
+    for name, func in (('str', str_path), ('mmap', mmap_path)):
+        results = Queue()
+        proc = Process(target=run, args=(func, pathname, shortname, results))
+        proc.start()
+        count, elapsed, maxrss = results.get()
+        proc.join()
+        print('{:5} matches={} time={:.3f}s throughput={:.1f}MiB/s '
+            'peak_rss={}KiB'.format(name, count, elapsed,
+                size / elapsed / 2**20, maxrss))
+
+
+if __name__ == '__main__':
+    trial(*sys.argv[1:3])
@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
 # Liam Nolan 2018 (c) ISC
 
+import gzip
 import unittest
-from bdigester.core import Parser 
+from io import BytesIO
+from os import path
+from zipfile import ZipFile
+from tempfile import NamedTemporaryFile
+from blacklistparser.core import Parser, Exceptions, Data
+
+EASYLIST = path.join(path.dirname(__file__), 'data', 'easylist.txt')
 
 class TestParser(unittest.TestCase):
     def TestFindABP(self):
@@ -10,8 +17,119 @@ class TestParser(unittest.TestCase):
              for line in Parser.find_abp_data(testdata):
                  print(line)
 
+    def test_parse_file_matches_str_path(self):
+        with open(EASYLIST, 'r') as testdata:
+            expected = Parser.ABPParser.extract_data(testdata.read())
+        self.assertEqual(Parser.parse_file(EASYLIST, 'adblock'), expected)
 
-if __name__ == '__main__':
-    unittest.main()
+    def test_extract_mapped(self):
+        buf = b'example.com\nNOT A DOMAIN\nxn--80ak6aa92e.com\n'
+        self.assertEqual(Parser.NewlineParser.extract_mapped(buf),
+            ['example.com', 'xn--80ak6aa92e.com'])
+        buf = b'# comment\n10.0.0.1\n192.168.0.0/16\n'
+        self.assertEqual(Parser.IpsetParser.extract_mapped(buf),
+            ['10.0.0.1', '192.168.0.0/16'])
+
+    def test_parse_file_empty(self):
+        with NamedTemporaryFile() as tmp:
+            with self.assertRaises(Exceptions.NoMatchesFound):
+                Parser.parse_file(tmp.name, 'newline')
+
+    def test_hosts(self):
+        data = ('127.0.0.1 localhost\n'
+            + '0.0.0.0 ads.example.com www.ads.example.com # comment\n'
+            + '# 0.0.0.0 commented.example.com\n'
+            + '::1 ip6.example.com\n')
+        self.assertEqual(Parser.HostsParser.extract_data(data),
+            ['ads.example.com', 'www.ads.example.com', 'ip6.example.com'])
+
+    def test_csv_column(self):
+        data = 'id,domain\n1,"evil.example.com"\n2,bad.example.org\n'
+        self.assertEqual(Parser.CsvParser.extract_data(data, 1),
+            ['domain', 'evil.example.com', 'bad.example.org'])
+        stream = BytesIO(data.replace(',', '\t').encode())
+        self.assertEqual(list(Parser.extract_stream(stream, 'tsv:1')),
+            ['domain', 'evil.example.com', 'bad.example.org'])
+
+    def test_split_format(self):
+        self.assertEqual(Parser.split_format('csv:2'), ('csv', 2))
+        self.assertEqual(Parser.split_format('hosts'), ('hosts', None))
+        for bad in ('hosts:1', 'csv:x', 'csv:-1', 'nope'):
+            with self.assertRaises(Exceptions.IncorrectDataType):
+                Parser.split_format(bad)
+
+    def test_extract_stream_gzip(self):
+        # two concatenated gzip members, split across small chunks
+        data = gzip.compress(b'0.0.0.0 one.example.com\n0.0.0.0 tw')
+        data += gzip.compress(b'o.example.com\n')
+        chunk_size = Parser.CHUNK_SIZE
+        Parser.CHUNK_SIZE = 7
+        try:
+            names = list(Parser.extract_stream(BytesIO(data), 'hosts'))
+        finally:
+            Parser.CHUNK_SIZE = chunk_size
+        self.assertEqual(names, ['one.example.com', 'two.example.com'])
 
+    def test_extract_stream_zip(self):
+        buf = BytesIO()
+        with ZipFile(buf, 'w') as archive:
+            archive.writestr('a.txt', '10.0.0.1\n10.0.0.2')
+            archive.writestr('b.txt', '10.0.0.3\n')
+        buf.seek(0)
+        self.assertEqual(list(Parser.extract_stream(buf, 'ipset')),
+            ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
 
+    def test_extract_stream_bad_gzip(self):
+        stream = BytesIO(b'\x1f\x8b' + b'not gzip' * 10)
+        with self.assertRaises(Exceptions.BadFileType):
+            list(Parser.extract_stream(stream, 'hosts'))
+
+    def test_mixed(self):
+        data = (b'[Adblock Plus 2.0]\n! comment\n||Ads.example.com^\n'
+            + b'@@||ok.example.com^\n||example.com/banner.gif\n\n'
+            + b'0.0.0.0 one.example.com two.example.com # tracker\n'
+            + b'127.0.0.1 localhost\n10.0.0.0/8\n192.168.1.1\n'
+            + b'1password.example.com\nExample.ORG.\n# 0.0.0.0 x.com\n'
+            + b'not a domain\n*.example.net\n')
+        counts = {}
+        names = list(Parser.extract_stream(BytesIO(data), 'mixed', counts))
+        self.assertEqual(names, [('domain', 'Ads.example.com'),
+            ('domain', 'one.example.com'), ('domain', 'two.example.com'),
+            ('ip', '10.0.0.0/8'), ('ip', '192.168.1.1'),
+            ('domain', '1password.example.com'), ('domain', 'Example.ORG.')])
+        self.assertEqual(counts, {'blank' : 1, 'comment' : 3, 'abp' : 1,
+            'abp_other' : 2, 'hosts' : 2, 'ip' : 2, 'domain' : 2,
+            'unknown' : 2})
+        self.assertEqual(Parser.MixedParser.extract_data(data.decode()),
+            names)
+
+    def test_idn(self):
+        data = 'Bücher.de.\nexample.com\nbad_name.com\n'.encode('utf-8')
+        names = list(Parser.extract_stream(BytesIO(data), 'domain'))
+        self.assertEqual(names, ['Bücher.de.', 'example.com'])
+        valid = Data.DataList(names, 'domain')
+        self.assertEqual(valid.data, ['xn--bcher-kva.de', 'example.com'])
+        self.assertEqual(valid.canonical.counts['idn'], 1)
+        abp = '||bücher.de^\n'.encode('utf-8')
+        self.assertEqual(list(Parser.extract_stream(BytesIO(abp), 'adblock')),
+            ['bücher.de'])
+        mixed = 'ñandu.es\n||Bücher.de^\n'.encode('utf-8')
+        self.assertEqual(list(Parser.extract_stream(BytesIO(mixed), 'mixed')),
+            [('domain', 'ñandu.es'), ('domain', 'Bücher.de')])
+
+    def test_format_detector(self):
+        self.assertEqual(Parser.format_detector(
+            '! easylist\n||a.example.com^\n||b.example.com^\n'), 'adblock')
+        self.assertEqual(Parser.format_detector(
+            '# hosts\n0.0.0.0 a.example.com\nb.example.com\n'
+            + '0.0.0.0 c.example.com\n'), 'hosts')
+        self.assertEqual(Parser.format_detector('a.example.com\n'),
+            'newline')
+        self.assertEqual(Parser.format_detector('10.0.0.1\n10.0.0.2\n'),
+            'ipset')
+        with self.assertRaises(Exceptions.IncorrectDataType):
+            Parser.format_detector('# nothing\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
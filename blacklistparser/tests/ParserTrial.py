@@ -2,13 +2,16 @@
 # Liam Nolan 2018 (c) ISC
 
 import unittest
-from bdigester.core import Parser
+from os import path
+from blacklistparser.core import Parser
+
+EASYLIST = path.join(path.dirname(__file__), 'data', 'easylist.txt')
 
 def test():
-    with open('gphull/tests/data/easylist.txt', 'r') as testdata:
+    with open(EASYLIST, 'r') as testdata:
         print("begin")
         try:
-            matches = Parser.find_abp_data(testdata.read())
+            matches = Parser.ABPParser.extract_data(testdata.read())
         except:
             raise
         if matches:
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from os import path
+from time import perf_counter
+from logging import getLogger
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from blacklistparser.core import Profile
+
+def busy(seconds):
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        pass
+    return 'done'
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.log = getLogger('blacklistparser.tests')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cprofile(self):
+        output = path.join(self.tmp.name, 'out.pstats')
+        profiler = Profile.Profiler('cprofile', self.log, output, 5)
+        self.assertEqual(profiler.run(busy, 0.01), 'done')
+        self.assertTrue(path.getsize(output) > 0)
+
+    def test_sample(self):
+        output = path.join(self.tmp.name, 'out.collapsed')
+        profiler = Profile.Profiler('sample', self.log, output, 5, 0.001)
+        self.assertEqual(profiler.run(busy, 0.05), 'done')
+        with open(output) as collapsed:
+            lines = collapsed.read().splitlines()
+        self.assertTrue(any('busy (ProfileTests.py' in line for line in lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertTrue(int(count) > 0)
+
+    def test_sample_threads(self):
+        idle = Event()
+        waiter = Thread(target=idle.wait)
+        worker = Thread(target=busy, args=(0.1,))
+        waiter.start()
+        worker.start()
+        try:
+            stacks = {}
+            for all_threads in (False, True):
+                sampler = Profile.Sampler(0.001, all_threads)
+                sampler.start()
+                try:
+                    busy(0.04)
+                finally:
+                    sampler.stop()
+                stacks[all_threads] = sampler.collapsed()
+        finally:
+            idle.set()
+            waiter.join()
+            worker.join()
+        # the main thread only unless asked, never the waiting thread
+        self.assertFalse(any('_bootstrap' in line for line in stacks[False]))
+        self.assertTrue(any('_bootstrap' in line and 'busy' in line
+            for line in stacks[True]))
+        self.assertFalse(any('wait (threading.py' in line
+            for line in stacks[True]))
+
+    def test_report_on_error(self):
+        output = path.join(self.tmp.name, 'out.collapsed')
+        profiler = Profile.Profiler('sample', self.log, output)
+        with self.assertRaises(ZeroDivisionError):
+            profiler.run(lambda: 1 / 0)
+        self.assertTrue(path.exists(output))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from random import Random
+from blacklistparser.core import Schedule
+
+class TestPolicy(unittest.TestCase):
+    def test_next_interval(self):
+        policy = Schedule.Policy(0.25, 4, 0)
+        self.assertEqual(policy.next_interval(None, 100, True), 100)
+        self.assertEqual(policy.next_interval(100, 100, True), 50)
+        self.assertEqual(policy.next_interval(30, 100, True), 25)
+        self.assertEqual(policy.next_interval(100, 100, False), 150)
+        self.assertEqual(policy.next_interval(350, 100, False), 400)
+        # bounds follow the configured interval when it changes
+        self.assertEqual(policy.next_interval(400, 10, False), 40)
+
+    def test_next_update(self):
+        policy = Schedule.Policy(jitter=0.1, rand=Random(0))
+        times = [policy.next_update(1000, 100) for _ in range(100)]
+        self.assertTrue(all(1090 <= t <= 1110 for t in times))
+        self.assertNotEqual(min(times), max(times))
+        self.assertEqual(Schedule.Policy(jitter=0).next_update(1000, 100),
+            1100)
+
+    def test_bad_policy(self):
+        self.assertRaises(ValueError, Schedule.Policy, 2, 1)
+        self.assertRaises(ValueError, Schedule.Policy, jitter=1)
+
+    def test_content_hash(self):
+        self.assertEqual(Schedule.content_hash(['a', 'b']),
+            Schedule.content_hash(['a', 'b']))
+        self.assertNotEqual(Schedule.content_hash(['a', 'b']),
+            Schedule.content_hash(['ab']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import os
+import gzip
+import unittest
+from os import path
+from threading import Thread
+from http.client import HTTPConnection
+from tempfile import TemporaryDirectory
+from blacklistparser.core import Serve
+
+TEXT = b'local-zone: a.example.com always_nxdomain'
+
+class TestServe(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.root = path.join(self.tmp.name, 'www')
+        os.mkdir(self.root)
+        self.write('u.conf', TEXT)
+        self.write('.u.conf.tmp', b'half')
+        self.write(path.join('..', 'secret'), b'secret')
+        self.server = Serve.Server(('127.0.0.1', 0), self.root)
+        self.thread = Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmp.cleanup()
+
+    def write(self, name, data, mtime=None):
+        pathname = path.join(self.root, name)
+        with open(pathname, 'wb') as out_file:
+            out_file.write(data)
+        if mtime is not None:
+            os.utime(pathname, (mtime, mtime))
+
+    def get(self, url, method='GET', **headers):
+        conn = HTTPConnection(*self.server.server_address[:2])
+        try:
+            conn.request(method, url, headers=headers)
+            response = conn.getresponse()
+            return response, response.read()
+        finally:
+            conn.close()
+
+    def test_conditional(self):
+        response, body = self.get('/u.conf')
+        self.assertEqual((response.status, body), (200, TEXT))
+        etag = response.getheader('ETag')
+        self.assertTrue(etag.startswith('"'))
+        response, body = self.get('/u.conf', **{'If-None-Match' : etag})
+        self.assertEqual((response.status, body), (304, b''))
+        response, _ = self.get('/u.conf', **{'If-None-Match' : '"other"'})
+        self.assertEqual(response.status, 200)
+        since = response.getheader('Last-Modified')
+        response, _ = self.get('/u.conf', **{'If-Modified-Since' : since})
+        self.assertEqual(response.status, 304)
+        # a new list gets a new ETag
+        self.write('u.conf', TEXT + b'\n' + TEXT.replace(b'a.', b'b.'))
+        response, _ = self.get('/u.conf', **{'If-None-Match' : etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.getheader('ETag'), etag)
+        self.assertEqual(self.server.counts['not_modified'], 2)
+
+    def test_gzip(self):
+        stat = os.stat(path.join(self.root, 'u.conf'))
+        self.write('u.conf.gz', gzip.compress(TEXT), stat.st_mtime + 1)
+        response, body = self.get('/u.conf', **{'Accept-Encoding' : 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.decompress(body), TEXT)
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        response, body = self.get('/u.conf',
+            **{'Accept-Encoding' : 'gzip;q=0'})
+        self.assertEqual((response.getheader('Content-Encoding'), body),
+            (None, TEXT))
+        # a .gz older than the list isn't served
+        self.write('u.conf.gz', gzip.compress(TEXT), stat.st_mtime - 10)
+        response, body = self.get('/u.conf', **{'Accept-Encoding' : 'gzip'})
+        self.assertEqual(body, TEXT)
+
+    def test_head(self):
+        response, body = self.get('/u.conf', 'HEAD')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Length'), str(len(TEXT)))
+        self.assertEqual(body, b'')
+
+    def test_not_found(self):
+        for url in ('/', '/.u.conf.tmp', '/../secret', '/%2e%2e/secret',
+                '/nope'):
+            response, _ = self.get(url)
+            self.assertEqual(response.status, 404, url)
+
+    def test_accepts_gzip(self):
+        self.assertTrue(Serve.accepts_gzip('deflate, gzip;q=0.5'))
+        self.assertTrue(Serve.accepts_gzip('*'))
+        self.assertFalse(Serve.accepts_gzip('gzip;q=0, br'))
+        self.assertFalse(Serve.accepts_gzip(''))
+
+
+if __name__ == '__main__':
+    unittest.main()
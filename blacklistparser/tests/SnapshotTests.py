@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from blacklistparser.core import Snapshot, Exceptions
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.pathname = path.join(self.tmp.name, 'bl.snap')
+        sink = Snapshot.Sink(self.pathname)
+        for name in ('10.0.0.0/24', '10.0.1.0/24', '1.2.3.4', '10.0.0.7'):
+            sink.write(name, 'ip')
+        for name in ('example.com', 'ads.example.org', 'Zed.net',
+                'example.com'):
+            sink.write(name, 'domain')
+        sink.close()
+        self.bytes = sink.bytes
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup(self):
+        with Snapshot.Reader(self.pathname) as snap:
+            self.assertEqual(path.getsize(self.pathname), self.bytes)
+            self.assertEqual(list(snap.ranges()),
+                [(0x01020304, 0x01020304), (0x0a000000, 0x0a0001ff)])
+            self.assertEqual(list(snap.domains()),
+                ['ads.example.org', 'example.com', 'zed.net'])
+            for addr in ('1.2.3.4', '10.0.0.0', '10.0.1.255'):
+                self.assertTrue(snap.contains_ip(addr), addr)
+            for addr in ('0.0.0.0', '1.2.3.5', '10.0.2.0', '255.255.255.255'):
+                self.assertFalse(snap.contains_ip(addr), addr)
+            self.assertTrue(snap.contains_domain('example.com'))
+            self.assertTrue(snap.contains_domain('a.b.Example.com.'))
+            self.assertFalse(snap.contains_domain('a.example.com', False))
+            self.assertFalse(snap.contains_domain('example.org'))
+            self.assertFalse(snap.contains_domain('com'))
+
+    def test_empty(self):
+        Snapshot.Sink(self.pathname).close()
+        with Snapshot.Reader(self.pathname) as snap:
+            self.assertFalse(snap.contains_ip('1.2.3.4'))
+            self.assertFalse(snap.contains_domain('example.com'))
+
+    def test_corrupt(self):
+        with open(self.pathname, 'r+b') as snap_file:
+            snap_file.seek(-1, 2)
+            snap_file.write(b'!')
+        self.assertRaises(Exceptions.BadFileType, Snapshot.Reader,
+            self.pathname)
+        Snapshot.Reader(self.pathname, verify=False).close()
+        with open(self.pathname, 'wb') as snap_file:
+            snap_file.write(b'1.2.3.4\n')
+        self.assertRaises(Exceptions.BadFileType, Snapshot.Reader,
+            self.pathname)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import sys
+import unittest
+import subprocess
+from blacklistparser.core import App
+
+# modules App must not import until an action needs them
+LAZY_MODULES = ('urllib.request', 'http.client', 'shutil', 'tempfile',
+    'zipfile', 'csv', 'numpy', 'blacklistparser.core.Net',
+    'blacklistparser.core.Parser')
+# generous cold start budget for importing App in microseconds
+IMPORT_BUDGET = 150000
+
+def import_times(module):
+    '''
+    run python -X importtime on module and return {module: cumulative us}
+    '''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_imports(self):
+        times = import_times('blacklistparser.core.App')
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_lazy_numpy(self):
+        # output -f bloom works without numpy
+        times = import_times('blacklistparser.core.Bloom')
+        self.assertNotIn('numpy', times)
+
+    def test_import_budget(self):
+        times = import_times('blacklistparser.core.App')
+        self.assertLess(times['blacklistparser.core.App'], IMPORT_BUDGET)
+
+    def test_find_subcommand(self):
+        self.assertEqual(App.find_subcommand(
+            ['-v', 'address', '-a', 'update']), 'address')
+        self.assertEqual(App.find_subcommand(
+            ['--logpath', 'output', 'update', '-d', 'x']), 'update')
+        self.assertIsNone(App.find_subcommand(['-v']))
+        self.assertIsNone(App.find_subcommand(['bogus', 'update']))
+
+
+if __name__ == '__main__':
+    unittest.main()
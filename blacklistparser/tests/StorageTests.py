@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+'''
+conformance tests run against every Storage engine, engine specific tests
+stay in DatabaseTests
+'''
+
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from time import time
+from blacklistparser.core import Exceptions, Storage
+
+class Conformance:
+    ENGINE = None
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.db = Storage.open_backend(self.ENGINE,
+            path.join(self.tmp.name, 'test.db'))
+        self.db.add_source_url('one', 'domain', 3600)
+        self.db.add_source_url('two', 'ip', 3600)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def names(self, data_format='domain'):
+        return sorted(self.db.pull_names_2(3600, data_format))
+
+    def test_interface(self):
+        self.assertIsInstance(self.db, Storage.Backend)
+
+    def test_sources(self):
+        self.assertTrue(self.db.test_source_url('one'))
+        self.assertRaises(Exceptions.NoMatchesFound,
+            self.db.test_source_url, 'three')
+        self.db.change_group('ads', 'one')
+        self.assertEqual(self.db.pull_sources(), {
+            'one' : ('domain', 3600.0, 'ads'),
+            'two' : ('ip', 3600.0, None)})
+        due = [entry['url'] for entry in self.db.pull_active_source_urls()]
+        self.assertEqual(sorted(due), ['one', 'two'])
+        self.db.touch_source_url('one')
+        self.db.update_last_modified('one', 'Mon, 01 Jan 2024 00:00:00 GMT')
+        entry, = self.db.pull_active_source_urls()
+        self.assertEqual(entry['url'], 'two')
+        self.db.delete_source_url('two')
+        self.assertRaises(Exceptions.NoMatchesFound,
+            self.db.pull_active_source_urls)
+
+    def test_schedule(self):
+        self.db.schedule_source('one', 1800, time() - 1, True, 'abc', 10)
+        self.db.schedule_source('one', 2700, time() - 1, False)
+        entry = [entry for entry in self.db.pull_active_source_urls()
+            if entry['url'] == 'one'][0]
+        self.assertEqual((entry['interval'], entry['content_hash'],
+            entry['name_count']), (2700, 'abc', 10))
+
+    def test_sync(self):
+        result = self.db.sync_sources([
+            {'url' : 'one', 'page_format' : 'hosts', 'timeout' : 60,
+                'membership' : None},
+            {'url' : 'new', 'page_format' : 'domain', 'timeout' : 60,
+                'membership' : 'ads'}])
+        self.assertEqual(result, (['new'], ['one'], ['two']))
+        self.assertEqual(self.db.sync_exceptions([('a.example.com',
+            'domain')]), ([('a.example.com', 'domain')], []))
+
+    def test_sync_numeric_group(self):
+        sources = [{'url' : 'one', 'page_format' : 'domain',
+            'timeout' : 3600, 'membership' : 5}]
+        self.assertEqual(self.db.sync_sources(sources, False),
+            ([], ['one'], []))
+        self.assertEqual(self.db.sync_sources(sources, False), ([], [], []))
+        sources[0]['membership'] = '5'
+        self.assertEqual(self.db.sync_sources(sources, False), ([], [], []))
+
+    def test_bulk_add(self):
+        self.assertRaises(Exceptions.EmptyList, self.db.bulk_add, [],
+            'domain', 'one')
+        self.db.bulk_add(['a.example.com', 'b.example.com '], 'domain', 'one')
+        self.db.bulk_add(['a.example.com'], 'domain', 'two')
+        self.assertEqual(self.names(), [('a.example.com',),
+            ('b.example.com',)])
+        stats = self.db.overlap_stats()
+        self.assertEqual((stats['distinct'], stats['rows']), (2, 3))
+        self.assertEqual(stats['histogram'], [(1, 1), (2, 1)])
+        self.assertEqual(stats['sources'], [('one', 2, 1), ('two', 1, 0)])
+        self.assertEqual(self.db.refresh_source('one'), 2)
+        self.assertEqual(self.db.pull_names_2(-3600, 'domain'), [])
+
+    def test_elements(self):
+        self.db.bulk_add(['a.example.com', 'b.example.com'], 'domain', 'one')
+        self.db.add_element('b.example.com', 'domain', None, True)
+        self.assertEqual(self.names(), [('a.example.com',)])
+        self.assertEqual(len(self.db.pull_names_2(3600, 'domain', False)), 2)
+        self.db.remove_element('b.example.com', whitelist=True)
+        self.db.remove_element('a.example.com')
+        self.assertEqual(self.names(), [('b.example.com',)])
+        self.db.add_element('c.example.com', 'domain', 'two')
+        self.db.remove_element('c.example.com', 'one')
+        self.assertIn(('c.example.com',), self.names())
+        self.assertRaises(Exceptions.NotString, self.db.add_element, 1,
+            'domain', 'one')
+
+    def test_stream(self):
+        self.db.change_group('ads', 'one')
+        self.db.bulk_add(['b.example.com', 'a.example.com'], 'domain', 'one')
+        self.db.bulk_add(['1.2.3.4'], 'ip', 'two')
+        rows = sorted(row[:3] for row in
+            self.db.stream_names(3600, ['domain', 'ip']))
+        self.assertEqual(rows, [('1.2.3.4', 'ip', None),
+            ('a.example.com', 'domain', None),
+            ('b.example.com', 'domain', None)])
+        rows = sorted(row[:3] for row in
+            self.db.stream_names(3600, ['domain', 'ip'], ['ads']))
+        self.assertEqual(rows, [('a.example.com', 'domain', 'ads'),
+            ('b.example.com', 'domain', 'ads')])
+        self.assertEqual(list(self.db.stream_names(3600, ['domain'], ['x'])),
+            [])
+
+    def test_ip_ranges(self):
+        self.db.bulk_add(['1.2.3.0/24', '1.2.3.7', '1.2.4.0/24'], 'ip', 'two')
+        self.db.add_element('1.2.4.0/24', 'ip', None, True)
+        self.assertEqual([row[:2] for row in self.db.lookup_ip('1.2.3.7')],
+            [('1.2.3.0/24', 'two'), ('1.2.3.7', 'two')])
+        self.assertFalse(self.db.contains_ip('1.2.4.1'))
+        self.assertTrue(self.db.contains_ip('1.2.4.1', exceptions=False))
+        self.assertEqual(self.db.merged_ip_ranges(3600, exceptions=False),
+            [(0x01020300, 0x010204ff)])
+
+    def test_transactions(self):
+        self.db.bulk_add(['a.example.com'], 'domain', 'one')
+        self.db.commit()
+        self.db.bulk_add(['b.example.com'], 'domain', 'one')
+        self.db.rollback()
+        self.assertEqual(self.names(), [('a.example.com',)])
+        self.db.begin()
+        with self.db.savepoint('keep'):
+            self.db.bulk_add(['c.example.com'], 'domain', 'one')
+        with self.assertRaises(ValueError):
+            with self.db.savepoint('undo'):
+                self.db.remove_element('a.example.com')
+                raise ValueError()
+        self.db.commit()
+        self.assertEqual(self.names(), [('a.example.com',),
+            ('c.example.com',)])
+        self.assertEqual(self.db.partition(['a'], 'domain'), {None : ['a']})
+
+
+class TestSqlite(Conformance, unittest.TestCase):
+    ENGINE = 'sqlite'
+
+
+class TestMemory(Conformance, unittest.TestCase):
+    ENGINE = 'memory'
+
+    def test_unknown_engine(self):
+        self.assertRaises(Exceptions.DatabaseError, Storage.open_backend,
+            'none')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+'''
+time the same workload against every storage engine: bulk adding feeds,
+refreshing a source, streaming the active names and ip lookups, reported
+as json
+usage: python3 -m blacklistparser.tests.StorageTrial [-s 100000] [-f 4]
+'''
+
+import sys
+import json
+import platform
+from os import path
+from random import Random
+from time import perf_counter
+from itertools import islice
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+
+from blacklistparser.core import Storage
+from blacklistparser.tests import FeedGen
+
+SIZE = 100000
+FEEDS = 4
+LOOKUPS = 10000
+
+
+def trial(engine, size, feeds, seed=0):
+    rand = Random(seed)
+    domains = list(islice(FeedGen.domains(rand), size))
+    addrs = ['%d.%d.%d.%d' % tuple(rand.randrange(1, 255) for _ in range(4))
+        for _ in range(size // 10)]
+    timings = {}
+    with TemporaryDirectory() as tmp:
+        db = Storage.open_backend(engine, path.join(tmp, 'trial.db'))
+        start = perf_counter()
+        for feed in range(feeds):
+            # feeds overlap by half
+            offset = feed * size // (2 * feeds)
+            db.bulk_add(domains[offset:offset + size // 2], 'domain',
+                'feed%d' % feed)
+        db.bulk_add(addrs, 'ip', 'ips')
+        db.commit()
+        timings['bulk_add'] = perf_counter() - start
+        start = perf_counter()
+        db.refresh_source('feed0')
+        db.commit()
+        timings['refresh_source'] = perf_counter() - start
+        start = perf_counter()
+        rows = sum(1 for _ in db.stream_names(3600, ['domain', 'ip']))
+        timings['stream_names'] = perf_counter() - start
+        start = perf_counter()
+        for addr in islice(addrs * 2, LOOKUPS):
+            db.contains_ip(addr)
+        timings['lookup_ip'] = perf_counter() - start
+        db.close()
+    return {
+        'engine' : engine,
+        'names' : size,
+        'feeds' : feeds,
+        'rows_streamed' : rows,
+        'seconds' : {stage : round(seconds, 6)
+            for stage, seconds in timings.items()}}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='StorageTrial')
+    parser.add_argument('-s', '--size', type=int, default=SIZE,
+        help='number of distinct domains')
+    parser.add_argument('-f', '--feeds', type=int, default=FEEDS)
+    parser.add_argument('-e', '--engines', default=','.join(Storage.BACKENDS),
+        help='comma separated storage engines')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    results = [trial(engine, args.size, args.feeds, args.seed)
+        for engine in args.engines.split(',')]
+    json.dump({'python' : platform.python_version(), 'results' : results},
+        sys.stdout, indent=2)
+    print()
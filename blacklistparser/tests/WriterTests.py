@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Liam Nolan (c) 2019 ISC
+
+import logging
+import unittest
+from os import path
+from functools import partial
+from tempfile import TemporaryDirectory
+from threading import Event
+from blacklistparser.core import Database, Exceptions, Memory, Writer
+
+def fail(db):
+    db.bulk_add(['c.example.com'], 'domain', 'one')
+    raise ValueError('broken job')
+
+class TestWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.db_path = path.join(self.tmp.name, 'test.db')
+        self.log = logging.getLogger('WriterTests')
+        self.log.disabled = True
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open_db(self):
+        return Database.Manager(self.db_path)
+
+    def names(self):
+        db = Database.Manager(self.db_path)
+        try:
+            return sorted(name for name, in db.pull_names_2(3600, 'domain'))
+        finally:
+            db.db_conn.close()
+
+    def test_grouped_commits(self):
+        writer = Writer.Writer(self.open_db, self.log, rows_per_commit=2)
+        # queue everything before the thread starts so jobs are grouped
+        for name in ('a', 'b', 'c'):
+            writer.submit('one', 1, Database.Manager.bulk_add,
+                [name + '.example.com'], 'domain', 'one')
+        writer.start()
+        writer.close()
+        self.assertEqual(self.names(),
+            ['a.example.com', 'b.example.com', 'c.example.com'])
+        self.assertEqual(writer.stats['jobs'], 3)
+        self.assertEqual(writer.stats['rows'], 3)
+        self.assertEqual(writer.stats['commits'], 2)
+        self.assertEqual(writer.stats['labels']['one'][1:], [3, 3])
+
+    def test_failed_job(self):
+        writer = Writer.Writer(self.open_db, self.log)
+        writer.submit('two', 1, Database.Manager.bulk_add,
+            ['a.example.com'], 'domain', 'two')
+        writer.submit('one', 1, fail)
+        writer.submit('one', 1, Database.Manager.bulk_add,
+            ['b.example.com'], 'domain', 'one')
+        writer.start()
+        writer.close()
+        # the failed job rolled back alone and the rest of its source
+        # was skipped
+        self.assertEqual(self.names(), ['a.example.com'])
+        self.assertEqual(writer.failed, {'one'})
+        self.assertEqual(writer.stats['skipped'], 1)
+
+    def test_backpressure(self):
+        writer = Writer.Writer(self.open_db, self.log, queue_size=1)
+        release = Event()
+        writer.start()
+        writer.submit('one', 0, lambda db: release.wait())
+        writer.submit('one', 0, lambda db: None)
+        # the queue is full until the first job finishes
+        self.assertFalse(writer.queue.empty())
+        release.set()
+        writer.submit('one', 0, lambda db: None)
+        writer.close()
+        self.assertEqual(writer.stats['jobs'], 3)
+
+    def test_fatal_error(self):
+        writer = Writer.Writer(partial(Database.Manager,
+            path.join(self.tmp.name, 'missing', 'x.db')), self.log)
+        # queued before the writer can fail
+        writer.submit('one', 0, lambda db: None)
+        writer.start()
+        self.assertRaises(Exceptions.DatabaseError, writer.close)
+        self.assertRaises(Exceptions.DatabaseError, writer.submit, 'one', 0,
+            lambda db: None)
+
+    def test_memory(self):
+        db = Memory.Manager()
+        db.add_source_url('one', 'domain', 3600)
+        db.commit()
+        writer = Writer.Writer(lambda: db, self.log)
+        writer.start()
+        writer.submit('one', 1, 'bulk_add', ['a.example.com'], 'domain',
+            'one')
+        writer.close()
+        self.assertEqual(db.pull_names_2(3600, 'domain'),
+            [('a.example.com',)])
+
+if __name__ == '__main__':
+    unittest.main()